@@ -3,47 +3,176 @@ ANÁLISE DARK POOLING - SCRIPT COMPLETO
 Versão final organizada para execução local
 
 REQUISITOS:
-pip install requests numpy scipy networkx python-louvain scikit-learn
+pip install requests aiohttp numpy scipy networkx python-louvain scikit-learn
 
 EXECUÇÃO:
 python analise_completa_darkpools.py
+python analise_completa_darkpools.py --incremental   (recoleta diária: refaz só o que mudou)
+python analise_completa_darkpools.py --resume        (continua uma coleta interrompida)
+python analise_completa_darkpools.py --offline       (analisa o checkpoint, sem rede)
+python analise_completa_darkpools.py --sites lista.csv.gz --grupos grupos.csv
+python analise_completa_darkpools.py --sites lista.csv.gz --processos 8
+python analise_completa_darkpools.py --perfil-memoria --trace trace.json   (tempos, memória e latências)
+python pipeline_dag.py   (este script + analise_de_redes.py como DAG com artefatos em cache)
+
+CACHE:
+.cache_adstxt/ guarda os ads.txt baixados com ETag/Last-Modified; execuções
+seguintes revalidam com requisições condicionais (304 = lido do disco).
+
+VARIANTES:
+Sem URL memorizada, https/http com e sem www. disputam cada domínio (vence o
+primeiro ads.txt válido); a vencedora fica em variantes_adstxt.json e as
+próximas execuções vão direto a ela.
+
+REFERÊNCIAS:
+subdomain=, OWNERDOMAIN=, MANAGERDOMAIN= e inventorypartnerdomain= apontam
+para outros ads.txt, coletados recursivamente (--profundidade-referencias);
+os sellers encontrados ficam em sellers_descobertos do site de origem, com
+a cadeia de referências que levou até eles (no .npz, tabela descobertos.*).
+
+CORTESIA:
+Domínios no mesmo /24 (mesma hospedagem/CDN) formam um grupo com taxa
+própria (--taxa-por-grupo) e concorrência adaptativa; 429 e Retry-After
+pausam o grupo. A vazão de cada grupo vai para metadata['instrumentacao'].
 
 OUTPUTS:
-- resultados_completos.json (todos os números)
+- resultados_colunares.npz (tabelas de sites, sellers, incidência e pools)
+- resultados_completos.json (resumo; --json completo inclui os sellers de cada site)
+- resultados_sites.jsonl / resultados_pools.jsonl (--jsonl, um registro por linha)
 - relatorio_executivo.txt (resumo legível)
+- coleta_checkpoint.jsonl (um registro por domínio coletado)
+- variantes_adstxt.json (URL que serviu o ads.txt de cada domínio)
+- historico_adstxt/ (todos os ads.txt coletados, deduplicados; ver snapshots_adstxt.py)
+- mudancas_dark_pools.json (pools que surgiram/sumiram/mudaram, modo --incremental)
 - grafos/ (figuras PNG dos grafos)
 """
 
+import asyncio
+import csv
+import email.utils
+import multiprocessing
+import queue
+import threading
+import gzip
+import hashlib
+import heapq
+import ipaddress
+import itertools
+import math
+import os
+import random
+import socket
+import time
 import requests
 import json
 import numpy as np
-from collections import defaultdict, Counter
+from collections import defaultdict, deque, Counter
 from datetime import datetime
-from scipy import stats
-from typing import Dict, List, Tuple
+from scipy import sparse, stats
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
+from instrumentacao import Instrumentacao, criar_trace_config, marcar_fase, nova_medicao, somar_medicao
+from snapshots_adstxt import TIPOS_RELACAO, RepositorioSnapshots
 import warnings
 warnings.filterwarnings('ignore')
 
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    print("AVISO: aiohttp não instalado. Coleta será sequencial")
+    HAS_AIOHTTP = False
+
 # ============================================================================
 # HELPERS
 # ============================================================================
 
-def converter_numpy_para_python(obj):
-    """Converte tipos numpy para tipos Python nativos (para JSON)"""
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.bool_):
-        return bool(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: converter_numpy_para_python(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [converter_numpy_para_python(item) for item in obj]
-    else:
-        return obj
+class CodificadorNumpy(json.JSONEncoder):
+    """Encoder JSON que converte escalares e arrays numpy durante a serialização"""
+    
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.bool_):
+            return bool(obj)
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return super().default(obj)
+
+def abrir_saida_texto(caminho: str, comprimir: bool = False):
+    """Abre arquivo de saída texto; .gz (ou comprimir=True) grava em gzip"""
+    if comprimir and not caminho.endswith('.gz'):
+        caminho += '.gz'
+    if caminho.endswith('.gz'):
+        return gzip.open(caminho, 'wt', encoding='utf-8')
+    return open(caminho, 'w', encoding='utf-8')
+
+class EscritorJSON:
+    """
+    Grava um objeto JSON de nível superior seção por seção, em streaming.
+    
+    Cada seção é serializada com iterencode direto no arquivo, sem cópia
+    convertida da árvore; secao_mapeamento aceita um iterável de pares
+    (chave, valor) para objetos grandes (sites, pools) que não precisam
+    existir inteiros na memória. Com indentação, a saída é idêntica à de
+    json.dump(..., indent=2, ensure_ascii=False).
+    """
+    
+    def __init__(self, caminho: str, compacto: bool = False, comprimir: bool = False):
+        self.arquivo = abrir_saida_texto(caminho, comprimir)
+        self.indent = None if compacto else 2
+        separadores = (',', ':') if compacto else (',', ': ')
+        self.codificador = CodificadorNumpy(indent=self.indent, separators=separadores, ensure_ascii=False)
+        self._primeira = True
+        self.arquivo.write('{')
+    
+    def _quebra(self, nivel: int) -> str:
+        return '' if self.indent is None else '\n' + ' ' * (self.indent * nivel)
+    
+    def _chave(self, chave: str, nivel: int, primeira: bool):
+        separador = '' if primeira else ','
+        dois_pontos = ':' if self.indent is None else ': '
+        self.arquivo.write(separador + self._quebra(nivel) + json.dumps(chave, ensure_ascii=False) + dois_pontos)
+    
+    def _valor(self, valor, nivel: int):
+        # JSON nunca tem quebras de linha dentro de strings: basta reindentar os blocos
+        prefixo = self._quebra(nivel)
+        for bloco in self.codificador.iterencode(valor):
+            self.arquivo.write(bloco.replace('\n', prefixo) if prefixo else bloco)
+    
+    def secao(self, chave: str, valor):
+        self._chave(chave, 1, self._primeira)
+        self._primeira = False
+        self._valor(valor, 1)
+    
+    def secao_mapeamento(self, chave: str, itens: Iterable[Tuple[str, object]]):
+        self._chave(chave, 1, self._primeira)
+        self._primeira = False
+        self.arquivo.write('{')
+        vazio = True
+        for subchave, valor in itens:
+            self._chave(subchave, 2, vazio)
+            self._valor(valor, 2)
+            vazio = False
+        self.arquivo.write('}' if vazio else self._quebra(1) + '}')
+    
+    def fechar(self):
+        self.arquivo.write('}' if self._primeira else self._quebra(0) + '}')
+        self.arquivo.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.fechar()
+
+def salvar_jsonl(caminho: str, chave: str, itens: Iterable[Tuple[str, Dict]], comprimir: bool = False) -> str:
+    """Um registro JSON compacto por linha: {chave: nome, **dados}. Retorna o caminho gravado"""
+    with abrir_saida_texto(caminho, comprimir) as f:
+        for nome, dados in itens:
+            f.write(json.dumps({chave: nome, **dados}, cls=CodificadorNumpy, ensure_ascii=False) + '\n')
+        return f.name
 
 # ============================================================================
 # CONFIGURAÇÃO: LISTA COMPLETA DE SITES
@@ -105,51 +234,1793 @@ GRUPOS_EDITORIAIS = {
     'Folha/UOL': {'folha.uol.com.br', 'uol.com.br'},
 }
 
+# ============================================================================
+# INGESTÃO DE LISTAS DE DOMÍNIOS (CSV/TSV)
+# ============================================================================
+
+COLUNAS_DOMINIO = ('domain', 'dominio', 'domínio', 'site', 'url')
+COLUNAS_CATEGORIA = ('cat', 'categoria', 'category')
+COLUNAS_NOME = ('name', 'nome')
+COLUNAS_GRUPO = ('grupo', 'group', 'grupo_editorial')
+
+def normalizar_dominio(valor: str) -> str:
+    """Minúsculas, sem esquema/caminho/porta, sem 'www.' inicial e sem ponto final"""
+    dominio = valor.strip().lower()
+    if '://' in dominio:
+        dominio = dominio.split('://', 1)[1]
+    dominio = dominio.split('/', 1)[0].split(':', 1)[0].rstrip('.')
+    if dominio.startswith('www.'):
+        dominio = dominio[4:]
+    return dominio
+
+class ConjuntoDominios:
+    """
+    Conjunto compacto de domínios já vistos, para deduplicar listas enormes.
+    
+    Guarda hashes de 64 bits (não as strings): a maior parte num array uint64
+    ordenado (8 bytes por domínio), consultado por busca binária vetorizada,
+    e os mais recentes num set pequeno, fundido ao array quando cresce.
+    """
+    
+    def __init__(self, tamanho_buffer: int = 1 << 16):
+        self.tamanho_buffer = tamanho_buffer
+        self._ordenados = np.zeros(0, dtype=np.uint64)
+        self._buffer = set()
+    
+    def __len__(self) -> int:
+        return len(self._ordenados) + len(self._buffer)
+    
+    def adicionar_lote(self, dominios: List[str]) -> List[bool]:
+        """Registra um lote; retorna, para cada domínio, se ele ainda não tinha sido visto"""
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(d.encode('utf-8'), digest_size=8).digest(), 'little') for d in dominios),
+            dtype=np.uint64, count=len(dominios))
+        
+        vistos = np.zeros(len(hashes), dtype=bool)
+        if len(self._ordenados):
+            posicoes = np.minimum(np.searchsorted(self._ordenados, hashes), len(self._ordenados) - 1)
+            vistos = self._ordenados[posicoes] == hashes
+        
+        novos = []
+        for h, visto in zip(hashes.tolist(), vistos.tolist()):
+            novo = not visto and h not in self._buffer
+            if novo:
+                self._buffer.add(h)
+            novos.append(novo)
+        
+        if len(self._buffer) >= max(self.tamanho_buffer, len(self._ordenados) // 8):
+            self._ordenados = np.union1d(self._ordenados, np.fromiter(self._buffer, dtype=np.uint64))
+            self._buffer.clear()
+        return novos
+    
+    def adicionar(self, dominio: str) -> bool:
+        """Registra o domínio; False se ele já tinha sido visto"""
+        return self.adicionar_lote([dominio])[0]
+
+def _abrir_texto(caminho: str):
+    if caminho.endswith('.gz'):
+        return gzip.open(caminho, 'rt', encoding='utf-8', newline='')
+    return open(caminho, 'r', encoding='utf-8', newline='')
+
+def _ler_tabela(caminho: str, campos: List[Tuple[Tuple[str, ...], int]]) -> Iterator[List[str]]:
+    """
+    Lê um CSV/TSV (delimitador pelo nome do arquivo) linha a linha.
+    
+    campos lista (nomes aceitos no cabeçalho, posição sem cabeçalho); cada
+    linha é devolvida só com esses campos, na mesma ordem ('' se ausente).
+    """
+    delimitador = '\t' if '.tsv' in caminho or '.tab' in caminho else ','
+    with _abrir_texto(caminho) as f:
+        indices = None
+        for linha in csv.reader(f, delimiter=delimitador):
+            if not linha or linha[0].lstrip().startswith('#'):
+                continue
+            if indices is None:
+                cabecalho = [c.strip().lower() for c in linha]
+                if any(nome in cabecalho for aceitos, _ in campos for nome in aceitos):
+                    indices = [next((cabecalho.index(n) for n in aceitos if n in cabecalho), None)
+                               for aceitos, _ in campos]
+                    continue
+                indices = [posicao for _, posicao in campos]
+            yield [linha[i].strip() if i is not None and i < len(linha) else '' for i in indices]
+
+def ler_lista_sites(caminho: str, cat_padrao: str = 'NA', tamanho_lote: int = 4096) -> Iterator[Dict]:
+    """
+    Lê uma lista de sites sob demanda, no formato de SITES.
+    
+    Aceita CSV/TSV (opcionalmente .gz) com cabeçalho (domain/dominio,
+    cat/categoria, name/nome) ou sem cabeçalho (domínio, categoria, nome).
+    Domínios são normalizados e repetidos são descartados sem materializar
+    a lista inteira.
+    """
+    vistos = ConjuntoDominios()
+    lote = []
+    
+    def despachar():
+        novos = vistos.adicionar_lote([site['domain'] for site in lote])
+        for site, novo in zip(lote, novos):
+            if novo:
+                yield site
+        lote.clear()
+    
+    campos = [(COLUNAS_DOMINIO, 0), (COLUNAS_CATEGORIA, 1), (COLUNAS_NOME, 2)]
+    for dominio, cat, nome in _ler_tabela(caminho, campos):
+        dominio = normalizar_dominio(dominio)
+        if not dominio:
+            continue
+        lote.append({'name': nome or dominio, 'domain': dominio, 'cat': cat.upper() or cat_padrao})
+        if len(lote) >= tamanho_lote:
+            yield from despachar()
+    yield from despachar()
+
+def ler_grupos_editoriais(caminho: str) -> Dict[str, Set[str]]:
+    """Grupos editoriais de um CSV/TSV com colunas (grupo, domínio)"""
+    grupos = defaultdict(set)
+    for grupo, dominio in _ler_tabela(caminho, [(COLUNAS_GRUPO, 0), (COLUNAS_DOMINIO, 1)]):
+        dominio = normalizar_dominio(dominio)
+        if grupo and dominio:
+            grupos[grupo].add(dominio)
+    return dict(grupos)
+
+# ============================================================================
+# PARSER INCREMENTAL DE ADS.TXT
+# ============================================================================
+
+MAX_BYTES_ADSTXT = 4 * 1024 ** 2  # teto rígido; ads.txt reais têm algumas centenas de KB
+TAMANHO_BLOCO = 16 * 1024
+# Content-Types rejeitados antes do corpo. text/html não entra: muitos servidores entregam o
+# ads.txt com esse tipo; a página HTML no lugar do arquivo é barrada pelo início do corpo (ParserAdsTxt)
+TIPOS_NAO_TEXTUAIS = ('image/', 'audio/', 'video/', 'font/')
+
+# Variáveis que apontam para outros ads.txt; ficam em sellers['referencias']
+# como "diretiva=dominio" (ver FronteiraReferencias)
+DIRETIVAS_REFERENCIA = ('subdomain', 'ownerdomain', 'managerdomain', 'inventorypartnerdomain')
+
+def _registrar_linha(linha: str, sellers: Dict[str, List[str]]):
+    """Parseia uma linha de ads.txt direto na estrutura DIRECT/RESELLER (e referencias)"""
+    # Comentários (linha inteira ou trecho após '#') são ignorados
+    comentario = linha.find('#')
+    if comentario >= 0:
+        linha = linha[:comentario]
+    
+    # Variáveis (VARIAVEL=valor); MANAGERDOMAIN pode trazer ", país" depois do domínio
+    variavel, igual, valor = linha.partition('=')
+    if igual and ',' not in variavel:
+        diretiva = variavel.strip().lower()
+        dominio = normalizar_dominio(valor.partition(',')[0])
+        if diretiva in DIRETIVAS_REFERENCIA and dominio:
+            sellers['referencias'].append(f"{diretiva}={dominio}")
+        return
+    
+    domain, sep, resto = linha.partition(',')
+    if not sep:
+        return
+    publisher_id, sep, resto = resto.partition(',')
+    if not sep:
+        return
+    relacao = resto.partition(',')[0].strip().upper()
+    
+    if relacao in ('DIRECT', 'RESELLER'):
+        domain = domain.strip().lower().replace('www.', '')
+        sellers[relacao].append(f"{domain}#{publisher_id.strip()}")
+
+def verificar_cabecalhos(headers, max_bytes: int = MAX_BYTES_ADSTXT) -> str:
+    """Rejeita a resposta antes de ler o corpo (retorna o erro ou string vazia)"""
+    tamanho = headers.get('Content-Length')
+    if tamanho and tamanho.isdigit() and int(tamanho) > max_bytes:
+        return f"ads.txt excede {max_bytes} bytes"
+    
+    content_type = headers.get('Content-Type', '').lower()
+    if content_type.startswith(TIPOS_NAO_TEXTUAIS):
+        return f"Content-Type {content_type.split(';')[0]}"
+    return ""
+
+class ParserAdsTxt:
+    """
+    Parser de ads.txt alimentado por blocos de bytes à medida que chegam.
+    
+    Mantém só a linha incompleta entre blocos, aborta ao passar de max_bytes
+    ou quando o corpo começa com marcação (página HTML servida no lugar do
+    ads.txt). Com guardar_corpo=True os bytes são retidos (para o cache).
+    """
+    
+    def __init__(self, max_bytes: int = MAX_BYTES_ADSTXT, guardar_corpo: bool = False):
+        self.max_bytes = max_bytes
+        self.sellers = {'DIRECT': [], 'RESELLER': [], 'referencias': []}
+        self.n_bytes = 0
+        self.erro = ""
+        self._resto = b''
+        self._inspecionado = False
+        self._blocos = [] if guardar_corpo else None
+    
+    @property
+    def corpo(self) -> bytes:
+        return b''.join(self._blocos) if self._blocos is not None else b''
+    
+    def alimentar(self, bloco: bytes) -> bool:
+        """Processa um bloco; retorna False se a coleta deve ser abortada"""
+        self.n_bytes += len(bloco)
+        if self.n_bytes > self.max_bytes:
+            self.erro = f"ads.txt excede {self.max_bytes} bytes"
+            return False
+        if self._blocos is not None:
+            self._blocos.append(bloco)
+        
+        dados = self._resto + bloco if self._resto else bloco
+        
+        if not self._inspecionado:
+            inicio = dados.lstrip(b' \t\r\n\xef\xbb\xbf')
+            if not inicio:
+                self._resto = dados
+                return True
+            self._inspecionado = True
+            if dados.startswith(b'\xef\xbb\xbf'):
+                dados = dados[3:]
+            # Nenhuma linha válida de ads.txt começa com '<'
+            if inicio.startswith(b'<'):
+                self.erro = "HTML em vez de ads.txt"
+                return False
+        
+        inicio = 0
+        fim = dados.find(b'\n')
+        while fim >= 0:
+            self._linha(dados[inicio:fim])
+            inicio = fim + 1
+            fim = dados.find(b'\n', inicio)
+        self._resto = dados[inicio:]
+        return True
+    
+    def finalizar(self) -> Dict[str, List[str]]:
+        """Processa a última linha (sem quebra final) e retorna os sellers"""
+        if self._resto:
+            self._linha(self._resto)
+            self._resto = b''
+        return self.sellers
+    
+    def _linha(self, bruta: bytes):
+        if bruta.find(b',') < 0 and bruta.find(b'=') < 0:
+            return
+        _registrar_linha(bruta.decode('utf-8', errors='replace'), self.sellers)
+
+def parsear_corpo(corpo: bytes, max_bytes: int = MAX_BYTES_ADSTXT) -> Tuple[Dict[str, List[str]], str]:
+    """Atalho para um corpo já em memória (ex.: lido do cache)"""
+    parser = ParserAdsTxt(max_bytes)
+    for inicio in range(0, len(corpo), TAMANHO_BLOCO):
+        if not parser.alimentar(corpo[inicio:inicio + TAMANHO_BLOCO]):
+            return {}, parser.erro
+    return parser.finalizar(), ""
+
+# ============================================================================
+# CACHE HTTP EM DISCO
+# ============================================================================
+
+class CacheHTTP:
+    """
+    Cache persistente de ads.txt por domínio, com revalidação condicional.
+    
+    Cada entrada guarda o corpo, os validadores (ETag/Last-Modified) e os
+    sellers já parseados. Entradas com menos de max_idade segundos são
+    servidas sem rede; as demais são revalidadas com
+    If-None-Match/If-Modified-Since. Quando o total passa de max_bytes, as
+    entradas acessadas há mais tempo são removidas (LRU).
+    """
+    
+    def __init__(self, diretorio: str = '.cache_adstxt', max_idade: float = 24 * 3600,
+                 max_bytes: int = 512 * 1024 ** 2):
+        self.diretorio = diretorio
+        self.max_idade = max_idade
+        self.max_bytes = max_bytes
+        self.servidos = set()  # domínios servidos do disco nesta execução
+        os.makedirs(diretorio, exist_ok=True)
+        
+        # Índice em memória: chave -> metadados (inclui tamanho e último acesso)
+        self._indice = {}
+        for arquivo in os.listdir(diretorio):
+            if arquivo.endswith('.meta.json'):
+                try:
+                    with open(os.path.join(diretorio, arquivo), 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                    self._indice[arquivo[:-len('.meta.json')]] = meta
+                except (OSError, ValueError):
+                    continue
+        self.total_bytes = sum(m.get('tamanho', 0) for m in self._indice.values())
+    
+    def _chave(self, domain: str) -> str:
+        return hashlib.sha1(domain.encode('utf-8')).hexdigest()
+    
+    def _caminho(self, chave: str, sufixo: str) -> str:
+        return os.path.join(self.diretorio, f"{chave}.{sufixo}")
+    
+    def _gravar(self, caminho: str, conteudo: bytes):
+        temporario = caminho + '.tmp'
+        with open(temporario, 'wb') as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+    
+    def _salvar_meta(self, chave: str, meta: Dict):
+        self._gravar(self._caminho(chave, 'meta.json'), json.dumps(meta).encode('utf-8'))
+    
+    def entrada(self, domain: str) -> Dict:
+        """Metadados da entrada do domínio (ou None)"""
+        return self._indice.get(self._chave(domain))
+    
+    def fresca(self, meta: Dict) -> bool:
+        """True se a entrada foi validada há menos de max_idade segundos"""
+        return meta is not None and time.time() - meta['validado_em'] < self.max_idade
+    
+    def cabecalhos_condicionais(self, meta: Dict) -> Dict[str, str]:
+        """Cabeçalhos If-None-Match / If-Modified-Since para revalidar a entrada"""
+        cabecalhos = {}
+        if meta:
+            if meta.get('etag'):
+                cabecalhos['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                cabecalhos['If-Modified-Since'] = meta['last_modified']
+        return cabecalhos
+    
+    def servir(self, domain: str, revalidado: bool = False) -> Dict[str, List[str]]:
+        """
+        Sellers da entrada (após entrada fresca ou resposta 304), sem reparsear
+        
+        Retorna None se os arquivos sumiram (ex.: removidos por outro processo
+        que compartilha o diretório); a entrada é então esquecida.
+        """
+        chave = self._chave(domain)
+        meta = self._indice[chave]
+        caminho_sellers = self._caminho(chave, 'sellers.json')
+        try:
+            sellers = None
+            if os.path.exists(caminho_sellers):
+                with open(caminho_sellers, 'r', encoding='utf-8') as f:
+                    sellers = json.load(f)
+            # Sem parse salvo, ou salvo antes das referências (subdomain= etc.): reparseia o corpo
+            if sellers is None or 'referencias' not in sellers:
+                with open(self._caminho(chave, 'txt'), 'rb') as f:
+                    sellers, _ = parsear_corpo(f.read())
+        except (OSError, ValueError):
+            self._indice.pop(chave, None)
+            self.total_bytes -= meta.get('tamanho', 0)
+            return None
+        
+        meta['acessado_em'] = time.time()
+        if revalidado:
+            meta['validado_em'] = meta['acessado_em']
+        self._salvar_meta(chave, meta)
+        self.servidos.add(domain)
+        return sellers
+    
+    def corpo(self, domain: str) -> bytes:
+        """Corpo bruto guardado para o domínio (None se não houver entrada)"""
+        try:
+            with open(self._caminho(self._chave(domain), 'txt'), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def armazenar(self, domain: str, url: str, corpo: bytes, headers, sellers: Dict[str, List[str]]):
+        """Guarda uma resposta 200 nova junto com o parse correspondente"""
+        chave = self._chave(domain)
+        self._remover(chave)
+        
+        conteudo_sellers = json.dumps(sellers).encode('utf-8')
+        self._gravar(self._caminho(chave, 'txt'), corpo)
+        self._gravar(self._caminho(chave, 'sellers.json'), conteudo_sellers)
+        agora = time.time()
+        meta = {
+            'domain': domain,
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'validado_em': agora,
+            'acessado_em': agora,
+            'tamanho': len(corpo) + len(conteudo_sellers)
+        }
+        self._salvar_meta(chave, meta)
+        self._indice[chave] = meta
+        self.total_bytes += meta['tamanho']
+        self._evictar()
+    
+    def _remover(self, chave: str):
+        meta = self._indice.pop(chave, None)
+        if meta:
+            self.total_bytes -= meta.get('tamanho', 0)
+        for sufixo in ('txt', 'sellers.json', 'meta.json'):
+            try:
+                os.remove(self._caminho(chave, sufixo))
+            except FileNotFoundError:
+                pass
+    
+    def _evictar(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for chave, _ in sorted(self._indice.items(), key=lambda x: x[1]['acessado_em']):
+            self._remover(chave)
+            if self.total_bytes <= self.max_bytes:
+                break
+
+# ============================================================================
+# VARIANTES DE URL DO ADS.TXT
+# ============================================================================
+
+# Muitos sites só servem o ads.txt em www. ou em http simples: sem variante
+# memorizada, as quatro são disputadas e vence a primeira com ads.txt válido
+ESQUEMAS_ADSTXT = ('https', 'http')
+ATRASO_VARIANTE = 0.25  # s até disparar a variante seguinte (antes, se a anterior falhar)
+
+def variantes_adstxt(domain: str) -> List[str]:
+    """URLs candidatas em ordem de preferência: https sem e com www., depois http"""
+    base = domain[4:] if domain.startswith('www.') else domain
+    return [f"{esquema}://{host}/ads.txt" for esquema in ESQUEMAS_ADSTXT for host in (base, f"www.{base}")]
+
+def rotulo_variante(url: str) -> str:
+    """'https', 'https+www', 'http' ou 'http+www'"""
+    esquema, _, resto = url.partition('://')
+    return f"{esquema}+www" if resto.startswith('www.') else esquema
+
+class MemoVariantes:
+    """
+    Variante de URL que serviu o ads.txt de cada domínio, persistida em JSON.
+    
+    Nas execuções seguintes o domínio vai direto à URL memorizada; as demais
+    variantes só são disputadas se ela falhar. novos guarda o que foi
+    registrado nesta execução (repassado ao coordenador na coleta multiprocesso).
+    """
+    
+    def __init__(self, caminho: str = 'variantes_adstxt.json'):
+        self.caminho = caminho
+        self.urls = {}
+        self.novos = {}
+        if caminho and os.path.exists(caminho):
+            try:
+                with open(caminho, 'r', encoding='utf-8') as f:
+                    self.urls = json.load(f)
+            except (OSError, ValueError):
+                self.urls = {}
+    
+    def url(self, domain: str) -> str:
+        return self.urls.get(domain)
+    
+    def registrar(self, domain: str, url: str):
+        if self.urls.get(domain) != url:
+            self.urls[domain] = url
+            self.novos[domain] = url
+    
+    def contagem(self) -> Dict[str, int]:
+        """Domínios memorizados por variante"""
+        return dict(Counter(rotulo_variante(url) for url in self.urls.values()).most_common())
+    
+    def salvar(self):
+        if not self.novos:
+            return
+        temporario = self.caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self.urls, f, indent=0, sort_keys=True)
+        os.replace(temporario, self.caminho)
+
 # ============================================================================
 # FUNÇÕES DE COLETA
 # ============================================================================
 
-def coletar_adstxt(domain: str, timeout: int = 15) -> Tuple[bool, List[str], str]:
-    """Coleta ads.txt de um domínio"""
-    url = f"https://{domain}/ads.txt"
+USER_AGENT = 'Mozilla/5.0 Research'
+
+# Falhas de conexão e estes status são tentados de novo, após espera exponencial
+# ou a pedida em Retry-After (timeouts não, para não multiplicar o tempo gasto
+# com hosts que não respondem)
+MAX_TENTATIVAS = 3
+ESPERA_RETENTATIVA = 1.0
+ESPERA_MAXIMA = 120.0
+STATUS_TRANSITORIOS = {429, 500, 502, 503, 504}
+
+def ler_retry_after(valor: str) -> float:
+    """Segundos pedidos em um cabeçalho Retry-After (número ou data HTTP); None se ausente ou inválido"""
+    if not valor:
+        return None
     try:
-        response = requests.get(url, timeout=timeout, headers={'User-Agent': 'Mozilla/5.0 Research'})
-        if response.status_code == 200:
-            return True, response.text.strip().split('\n'), ""
-        return False, [], f"HTTP {response.status_code}"
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        data = email.utils.parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, data.timestamp() - time.time())
+
+def erro_de_dns(erro: BaseException) -> bool:
+    """
+    Se a falha de conexão veio da resolução do nome (permanente: não vale retentar).
+    
+    requests e aiohttp embrulham o socket.gaierror; a cadeia é percorrida
+    por __cause__/__context__, .reason (urllib3) e .os_error (aiohttp).
+    """
+    pendentes = [erro]
+    vistos = set()
+    while pendentes:
+        e = pendentes.pop()
+        if e is None or id(e) in vistos:
+            continue
+        vistos.add(id(e))
+        if isinstance(e, socket.gaierror) or type(e).__name__ in ('NameResolutionError', 'ClientConnectorDNSError'):
+            return True
+        pendentes.extend((e.__cause__, e.__context__, getattr(e, 'reason', None), getattr(e, 'os_error', None)))
+        pendentes.extend(a for a in e.args if isinstance(a, BaseException))
+    return False
+
+def espera_retentativa(tentativa: int, retry_after: float = None) -> float:
+    """Espera antes da próxima tentativa (exponencial com jitter ou Retry-After); None se passar de ESPERA_MAXIMA"""
+    espera = ESPERA_RETENTATIVA * 2 ** (tentativa - 1) * random.uniform(0.5, 1.5)
+    if retry_after is not None:
+        espera = max(espera, retry_after)
+    return espera if espera <= ESPERA_MAXIMA else None
+
+def _consultar_cache(domain: str, cache: CacheHTTP,
+                     instrumentacao: Instrumentacao) -> Tuple[Tuple[bool, Dict[str, List[str]], str], Dict]:
+    """Resultado servido do disco se a cópia estiver fresca (senão None) e os metadados para revalidar"""
+    meta = cache.entrada(domain) if cache else None
+    if cache and cache.fresca(meta):
+        sellers = cache.servir(domain)
+        if sellers is not None:
+            if instrumentacao:
+                instrumentacao.registrar_requisicao({**nova_medicao(domain), 'origem': 'cache'}, '')
+            return (True, sellers, ""), meta
+        meta = None
+    return None, meta
+
+def coletar_adstxt(domain: str, timeout: int = 15, cache: CacheHTTP = None,
+                   instrumentacao: Instrumentacao = None, max_tentativas: int = MAX_TENTATIVAS,
+                   variantes: MemoVariantes = None) -> Tuple[bool, Dict[str, List[str]], str]:
+    """Coleta e parseia (em streaming) o ads.txt de um domínio, tentando as variantes de URL em sequência"""
+    resultado, meta = _consultar_cache(domain, cache, instrumentacao)
+    if resultado is not None:
+        return resultado
+    
+    medicao = nova_medicao(domain)
+    for tentativa in range(1, max_tentativas + 1):
+        medicao['tentativas'] = tentativa
+        resultado, transitoria = _coletar_variantes(domain, meta, timeout, cache, medicao, variantes)
+        espera = espera_retentativa(tentativa, medicao['retry_after']) if transitoria else None
+        if espera is None or tentativa == max_tentativas:
+            break
+        time.sleep(espera)
+    
+    medicao['total'] = time.time() - medicao['inicio']
+    if instrumentacao:
+        instrumentacao.registrar_requisicao(medicao, resultado[2])
+    return resultado
+
+def _adstxt_valido(resultado: Tuple[bool, Dict[str, List[str]], str]) -> bool:
+    """Sucesso com ao menos uma entrada (um 200 vazio costuma ser página de erro servida como texto)"""
+    sucesso, sellers, _ = resultado
+    return sucesso and bool(sellers.get('DIRECT') or sellers.get('RESELLER'))
+
+def _escolher_variante(urls: List[str], concluidas: Dict[str, Tuple]) -> str:
+    """
+    Variante cujo resultado vale para o domínio, em ordem de preferência de urls:
+    a primeira válida, senão um sucesso vazio, senão a falha da variante
+    preferida (que decide se a tentativa é repetida; www. inexistente, por
+    exemplo, é erro de conexão e faria todo domínio sem www. ser repetido)
+    """
+    ordem = [url for url in urls if url in concluidas]
+    for criterio in (_adstxt_valido, lambda resultado: resultado[0]):
+        for url in ordem:
+            if criterio(concluidas[url][0]):
+                return url
+    return ordem[0]
+
+def _aplicar_variante(domain: str, escolha: Tuple, cache: CacheHTTP, medicao: Dict,
+                      variantes: MemoVariantes) -> Tuple[Tuple[bool, Dict[str, List[str]], str], bool]:
+    """Leva a variante escolhida para a medição, o cache e o memo; retorna (resultado, transitória)"""
+    url, resultado, transitoria, parcial, gravacao = escolha
+    somar_medicao(medicao, parcial)
+    if resultado[0]:
+        medicao['variante'] = rotulo_variante(url)
+        if variantes is not None:
+            variantes.registrar(domain, url)
+        if gravacao:
+            cache.armazenar(domain, *gravacao[0])
+    return resultado, transitoria
+
+def _disputar_variantes(domain: str, urls: List[str], meta: Dict, timeout: int, cache: CacheHTTP) -> Tuple:
+    """Versão sequencial da disputa (sem aiohttp): para na primeira variante com ads.txt válido"""
+    concluidas = {}
+    parciais = {url: nova_medicao(domain) for url in urls}
+    gravacoes = {url: [] for url in urls}
+    for url in urls:
+        # Validadores do cache só valem para a URL de onde a cópia veio
+        meta_url = meta if meta and meta.get('url') == url else None
+        concluidas[url] = _baixar_adstxt(domain, url, meta_url, timeout, cache, parciais[url], gravacoes[url])
+        if _adstxt_valido(concluidas[url][0]):
+            break
+    url = _escolher_variante(urls, concluidas)
+    return (url, *concluidas[url], parciais[url], gravacoes[url])
+
+def _coletar_variantes(domain: str, meta: Dict, timeout: int, cache: CacheHTTP, medicao: Dict,
+                       variantes: MemoVariantes) -> Tuple[Tuple[bool, Dict[str, List[str]], str], bool]:
+    """Uma tentativa de coletar_adstxt: a URL memorizada e, se ela falhar de vez, as demais variantes"""
+    urls = variantes_adstxt(domain)
+    memorizada = variantes.url(domain) if variantes is not None else None
+    if memorizada:
+        escolha = _disputar_variantes(domain, [memorizada], meta, timeout, cache)
+        if escolha[1][0] or escolha[2]:
+            return _aplicar_variante(domain, escolha, cache, medicao, variantes)
+        urls = [url for url in urls if url != memorizada]
+    return _aplicar_variante(domain, _disputar_variantes(domain, urls, meta, timeout, cache), cache, medicao,
+                             variantes)
+
+def _baixar_adstxt(domain: str, url: str, meta: Dict, timeout: int, cache: CacheHTTP,
+                   medicao: Dict, gravacao: List = None) -> Tuple[Tuple[bool, Dict[str, List[str]], str], bool]:
+    """
+    Uma requisição de coletar_adstxt: (resultado, se a falha é transitória)
+    
+    Com gravacao, uma resposta nova não vai direto para o cache: os
+    argumentos de cache.armazenar ficam em gravacao, para serem gravados só
+    se esta variante for a escolhida.
+    """
+    headers = {'User-Agent': USER_AGENT}
+    if cache:
+        headers.update(cache.cabecalhos_condicionais(meta))
+    medicao['retry_after'] = None
+    inicio = time.time()
+    try:
+        with requests.get(url, timeout=timeout, headers=headers, stream=True) as response:
+            # requests não separa DNS e conexão: tudo até os cabeçalhos conta como espera
+            marcar_fase(medicao, 'espera', inicio, response.elapsed.total_seconds())
+            if response.status_code == 304 and meta:
+                sellers = cache.servir(domain, revalidado=True)
+                if sellers is None:
+                    return (False, {}, "304 sem cópia em cache"), False
+                return (True, sellers, ""), False
+            if response.status_code != 200:
+                medicao['retry_after'] = ler_retry_after(response.headers.get('Retry-After'))
+                return (False, {}, f"HTTP {response.status_code}"), response.status_code in STATUS_TRANSITORIOS
+            
+            erro = verificar_cabecalhos(response.headers)
+            if erro:
+                return (False, {}, erro), False
+            
+            inicio_corpo = time.time()
+            parser = ParserAdsTxt(guardar_corpo=cache is not None)
+            for bloco in response.iter_content(TAMANHO_BLOCO):
+                if not parser.alimentar(bloco):
+                    return (False, {}, parser.erro), False
+            sellers = parser.finalizar()
+            marcar_fase(medicao, 'corpo', inicio_corpo, time.time() - inicio_corpo)
+            
+            if cache and gravacao is not None:
+                gravacao.append((url, parser.corpo, response.headers, sellers))
+            elif cache:
+                cache.armazenar(domain, url, parser.corpo, response.headers, sellers)
+            return (True, sellers, ""), False
     except requests.exceptions.Timeout:
-        return False, [], "Timeout"
+        return (False, {}, "Timeout"), False
+    except requests.exceptions.SSLError as e:
+        return (False, {}, str(e)[:100]), False
+    except requests.exceptions.ConnectionError as e:
+        return (False, {}, str(e)[:100]), not erro_de_dns(e)
     except Exception as e:
-        return False, [], str(e)[:100]
+        return (False, {}, str(e)[:100]), False
 
 def parsear_adstxt(linhas: List[str]) -> Dict[str, List[str]]:
-    """Parseia ads.txt retornando DIRECT e RESELLER"""
-    sellers = {'DIRECT': [], 'RESELLER': []}
+    """Parseia ads.txt retornando DIRECT, RESELLER e as referencias a outros ads.txt"""
+    sellers = {'DIRECT': [], 'RESELLER': [], 'referencias': []}
+    
+    for linha in linhas:
+        _registrar_linha(linha, sellers)
+    
+    return sellers
+
+# ============================================================================
+# ESCALONADOR DE CORTESIA (POR GRUPO DE HOSPEDAGEM)
+# ============================================================================
+
+# Domínios no mesmo /24 (IPv4) ou /48 (IPv6) costumam ser o mesmo provedor ou
+# CDN: cada grupo tem um balde de fichas (taxa) e um limite de requisições
+# simultâneas ajustado em AIMD (+1 por janela sem sinais de sobrecarga, metade
+# com 429, timeout, erro transitório ou latência acima do alvo)
+TAXA_POR_GRUPO = 5.0                 # requisições/s por grupo
+RAJADA_POR_GRUPO = 5
+CONCORRENCIA_INICIAL_GRUPO = 2
+CONCORRENCIA_MAXIMA_GRUPO = 16
+LATENCIA_ALVO = 3.0                  # s
+FATOR_RECUO = 0.5
+LIMITE_FILA_ESCALONADOR = 10000      # domínios resolvidos aguardando vaga
+RESOLUCOES_SIMULTANEAS = 64
+GRUPOS_NO_RESUMO = 50
+
+class GrupoHospedagem:
+    """Estado de um grupo: fila de domínios, balde de fichas, limite AIMD e estatísticas"""
+    
+    def __init__(self, chave: str, taxa: float, rajada: int, limite: float):
+        self.chave = chave
+        self.fila = deque()
+        self.taxa_maxima = self.taxa = taxa
+        self.rajada = rajada
+        self.fichas = float(rajada)
+        self.atualizado = time.monotonic()
+        self.limite = self.limite_pico = float(limite)
+        self.em_voo = 0
+        self.pausa_ate = 0.0
+        self.ultimo_recuo = 0.0
+        self.agendado = False  # na fila de prontos ou na agenda do escalonador
+        
+        self.dominios = 0
+        self.concluidos = 0
+        self.requisicoes = 0
+        self.retentativas = 0
+        self.http_429 = 0
+        self.timeouts = 0
+        self.recuos = 0
+        self.latencia_total = 0.0
+        self.inicio = None
+        self.fim = None
+    
+    def espera(self, agora: float) -> float:
+        """0 se pode disparar agora; senão segundos até poder (inf se limitado pela concorrência)"""
+        if self.pausa_ate > agora:
+            return self.pausa_ate - agora
+        if self.em_voo >= int(self.limite):
+            return math.inf
+        self.fichas = min(self.rajada, self.fichas + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        return 0.0 if self.fichas >= 1 else (1 - self.fichas) / self.taxa
+    
+    def ajustar(self, agora: float, latencia: float, erro: str, transitoria: bool, espera: float,
+                latencia_alvo: float, limite_maximo: float):
+        """AIMD: um recuo multiplicativo por janela de latencia_alvo; aumento aditivo nos sucessos"""
+        self.requisicoes += 1
+        self.latencia_total += latencia
+        limitado = erro == 'HTTP 429'
+        self.http_429 += limitado
+        self.timeouts += erro == 'Timeout'
+        
+        if limitado or transitoria or erro == 'Timeout' or latencia > latencia_alvo:
+            if agora - self.ultimo_recuo >= latencia_alvo:
+                self.limite = max(1.0, self.limite * FATOR_RECUO)
+                if limitado:
+                    self.taxa = max(self.taxa_maxima / 16, self.taxa * FATOR_RECUO)
+                self.ultimo_recuo = agora
+                self.recuos += 1
+            if limitado and espera is not None:
+                # O servidor pediu para esperar: vale para o grupo todo
+                self.pausa_ate = max(self.pausa_ate, agora + espera)
+        else:
+            self.limite = min(limite_maximo, self.limite + 1 / self.limite)
+            self.taxa = min(self.taxa_maxima, self.taxa + self.taxa_maxima / 10)
+            self.limite_pico = max(self.limite_pico, self.limite)
+    
+    def resumo(self) -> Dict:
+        duracao = (self.fim - self.inicio) if self.inicio is not None and self.fim is not None else 0.0
+        return {
+            'dominios': self.dominios,
+            'concluidos': self.concluidos,
+            'requisicoes': self.requisicoes,
+            'retentativas': self.retentativas,
+            'http_429': self.http_429,
+            'timeouts': self.timeouts,
+            'recuos': self.recuos,
+            'concorrencia_final': round(self.limite, 2),
+            'concorrencia_pico': round(self.limite_pico, 2),
+            'taxa_final': round(self.taxa, 2),
+            'latencia_media_ms': round(1000 * self.latencia_total / self.requisicoes, 1) if self.requisicoes else None,
+            'duracao_s': round(duracao, 3),
+            'vazao_dominios_s': round(self.concluidos / duracao, 2) if duracao > 0 else None
+        }
+
+class ResolvedorCompartilhado:
+    """
+    Resolvedor de nomes da sessão aiohttp que reaproveita a resolução do agrupamento.
+    
+    grupo_de_hospedagem resolve cada domínio uma vez por aqui; as conexões
+    da sessão (todas as variantes de URL do domínio, com e sem www.) usam
+    esses endereços, ou o mesmo erro, até esquecer(domain) ao fim da coleta
+    do domínio.
+    """
+    
+    def __init__(self):
+        self._resolvidos = {}
+    
+    async def _getaddrinfo(self, host: str) -> List[Tuple]:
+        try:
+            return await asyncio.get_running_loop().getaddrinfo(host, 0, type=socket.SOCK_STREAM)
+        except UnicodeError as e:
+            raise socket.gaierror(socket.EAI_NONAME, str(e)) from e
+    
+    async def enderecos(self, host: str) -> List[Tuple]:
+        """getaddrinfo de host, guardado para as conexões (ou o erro, relançado a elas)"""
+        try:
+            enderecos = await self._getaddrinfo(host)
+        except OSError as e:
+            self._resolvidos[host] = e
+            raise
+        self._resolvidos[host] = enderecos
+        return enderecos
+    
+    def esquecer(self, domain: str):
+        self._resolvidos.pop(domain, None)
+        self._resolvidos.pop(f"www.{domain}", None)
+    
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_UNSPEC) -> List[Dict]:
+        # Interface de aiohttp.abc.AbstractResolver
+        enderecos = self._resolvidos.get(host)
+        if enderecos is None:
+            enderecos = await self.enderecos(host)
+        elif isinstance(enderecos, OSError):
+            raise enderecos
+        return [{'hostname': host, 'host': endereco[0], 'port': port, 'family': familia, 'proto': proto,
+                 'flags': socket.AI_NUMERICHOST | socket.AI_NUMERICSERV}
+                for familia, _, proto, _, endereco in enderecos if family in (socket.AF_UNSPEC, familia)]
+    
+    async def close(self):
+        self._resolvidos.clear()
+
+async def grupo_de_hospedagem(domain: str, resolvedor: ResolvedorCompartilhado = None) -> str:
+    """
+    Chave do grupo: prefixo /24 (IPv4) ou /48 (IPv6) do primeiro endereço; o próprio domínio se não resolver.
+    
+    Com resolvedor, a resolução fica guardada para as conexões da sessão.
+    """
+    try:
+        if resolvedor is not None:
+            enderecos = await resolvedor.enderecos(domain)
+        else:
+            enderecos = await asyncio.get_running_loop().getaddrinfo(domain, 443, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        return domain
+    for familia, _, _, _, endereco in enderecos:
+        if familia == socket.AF_INET:
+            return str(ipaddress.ip_network(f"{endereco[0]}/24", strict=False))
+    for familia, _, _, _, endereco in enderecos:
+        if familia == socket.AF_INET6:
+            return str(ipaddress.ip_network(f"{endereco[0].split('%')[0]}/48", strict=False))
+    return domain
+
+class EscalonadorCortesia:
+    """
+    Dispara as tentativas de coleta respeitando cada grupo de hospedagem.
+    
+    Os sites são resolvidos à medida que chegam e entram na fila do seu
+    grupo. Um grupo com domínios na fila fica em um de três estados: pronto
+    (ficha e vaga: fila de prontos, atendida em rodízio enquanto há vaga
+    global em max_concorrencia), agendado (sem ficha ou pausado: heap pelo
+    instante em que volta a poder disparar) ou sem vaga (reavaliado quando
+    uma tentativa dele termina). O laço de despacho só toca os grupos
+    prontos e os que vencem na agenda, não todos os grupos ativos.
+    Falhas transitórias voltam para a fila do grupo depois da espera
+    (exponencial ou Retry-After); um 429 pausa o grupo inteiro.
+    """
+    
+    def __init__(self, max_concorrencia: int = 64, taxa: float = TAXA_POR_GRUPO, rajada: int = RAJADA_POR_GRUPO,
+                 concorrencia_inicial: int = CONCORRENCIA_INICIAL_GRUPO,
+                 concorrencia_maxima: int = CONCORRENCIA_MAXIMA_GRUPO, latencia_alvo: float = LATENCIA_ALVO,
+                 max_tentativas: int = MAX_TENTATIVAS, limite_fila: int = LIMITE_FILA_ESCALONADOR):
+        self.max_concorrencia = max_concorrencia
+        self.taxa = taxa
+        self.rajada = rajada
+        self.concorrencia_inicial = concorrencia_inicial
+        self.concorrencia_maxima = concorrencia_maxima
+        self.latencia_alvo = latencia_alvo
+        self.max_tentativas = max_tentativas
+        self.limite_fila = limite_fila
+        self.grupos = {}
+        self._prontos = deque()
+        self._agenda = []  # heap de (instante, sequência, chave)
+        self._sequencia = 0
+        self.em_voo = 0
+        self.na_fila = 0
+        self._aguardando = 0
+    
+    def _enfileirar(self, chave: str, trabalho: List):
+        grupo = self.grupos.get(chave)
+        if grupo is None:
+            grupo = self.grupos[chave] = GrupoHospedagem(chave, self.taxa, self.rajada, self.concorrencia_inicial)
+        if trabalho[1] == 1:
+            grupo.dominios += 1
+        grupo.fila.append(trabalho)
+        self.na_fila += 1
+        self._avaliar(grupo, time.monotonic())
+    
+    def _avaliar(self, grupo: GrupoHospedagem, agora: float):
+        """Põe o grupo com fila nos prontos ou na agenda; sem vaga, espera uma tentativa dele terminar"""
+        if grupo.agendado or not grupo.fila:
+            return
+        espera = grupo.espera(agora)
+        if espera == math.inf:
+            return
+        grupo.agendado = True
+        if espera == 0:
+            self._prontos.append(grupo)
+        else:
+            self._sequencia += 1
+            heapq.heappush(self._agenda, (agora + espera, self._sequencia, grupo.chave))
+        self._mudou.set()
+    
+    def _reenfileirar(self, chave: str, trabalho: List):
+        self._aguardando -= 1
+        self._enfileirar(chave, trabalho)
+    
+    async def _ler(self, sites, imediato: Callable, ao_concluir: Callable, resolvedor: ResolvedorCompartilhado):
+        resolucoes = asyncio.Semaphore(RESOLUCOES_SIMULTANEAS)
+        pendentes = set()
+        
+        async def resolver(site):
+            async with resolucoes:
+                chave = await grupo_de_hospedagem(site['domain'], resolvedor)
+            self._enfileirar(chave, [site, 1])
+        
+        async def receber(site):
+            resultado = imediato(site) if imediato else None
+            if resultado is not None:
+                ao_concluir(site, resultado)
+                return
+            while self.na_fila + len(pendentes) >= self.limite_fila:
+                self._liberou.clear()
+                await self._liberou.wait()
+            tarefa = asyncio.create_task(resolver(site))
+            pendentes.add(tarefa)
+            tarefa.add_done_callback(pendentes.discard)
+        
+        try:
+            if hasattr(sites, '__aiter__'):
+                async for site in sites:
+                    await receber(site)
+            else:
+                for site in sites:
+                    await receber(site)
+            if pendentes:
+                await asyncio.gather(*pendentes)
+        finally:
+            self._mudou.set()
+    
+    async def _tentar(self, grupo: GrupoHospedagem, trabalho: List, tentativa: Callable, ao_concluir: Callable):
+        site, n = trabalho
+        inicio = time.monotonic()
+        try:
+            resultado, transitoria, retry_after = await tentativa(site, n)
+        except Exception as e:
+            resultado, transitoria, retry_after = (False, {}, str(e)[:100]), False, None
+        agora = time.monotonic()
+        grupo.em_voo -= 1
+        self.em_voo -= 1
+        
+        espera = espera_retentativa(n, retry_after) if transitoria else None
+        grupo.ajustar(agora, agora - inicio, resultado[2], transitoria, espera,
+                      self.latencia_alvo, self.concorrencia_maxima)
+        # A vaga liberada (ou a pausa de um 429) muda o estado só deste grupo
+        self._avaliar(grupo, agora)
+        if espera is not None and n < self.max_tentativas:
+            grupo.retentativas += 1
+            self._aguardando += 1
+            asyncio.get_running_loop().call_later(espera, self._reenfileirar, grupo.chave, [site, n + 1])
+        else:
+            grupo.concluidos += 1
+            grupo.fim = agora
+            ao_concluir(site, resultado)
+        self._mudou.set()
+    
+    async def executar(self, sites: Iterable[Dict], tentativa: Callable, ao_concluir: Callable,
+                       imediato: Callable = None, resolvedor: ResolvedorCompartilhado = None):
+        """
+        Coleta todos os sites.
+        
+        tentativa(site, n) faz a n-ésima tentativa de rede e devolve
+        (resultado, se a falha é transitória, Retry-After em s ou None);
+        imediato(site) devolve um resultado sem rede (cache) ou None;
+        ao_concluir(site, resultado) recebe o resultado final. Com resolvedor
+        (o da sessão), o agrupamento e as conexões resolvem cada domínio uma vez.
+        """
+        self._mudou = asyncio.Event()
+        self._liberou = asyncio.Event()
+        leitura = asyncio.create_task(self._ler(sites, imediato, ao_concluir, resolvedor))
+        tarefas = set()
+        
+        while True:
+            agora = time.monotonic()
+            while self._agenda and self._agenda[0][0] <= agora:
+                grupo = self.grupos[heapq.heappop(self._agenda)[2]]
+                grupo.agendado = False
+                self._avaliar(grupo, agora)
+            
+            while self._prontos and self.em_voo < self.max_concorrencia:
+                grupo = self._prontos.popleft()
+                grupo.agendado = False
+                if grupo.espera(agora) > 0:
+                    # Pausado (429) ou sem vaga desde que entrou nos prontos
+                    self._avaliar(grupo, agora)
+                    continue
+                
+                # Uma tentativa por vez: o grupo volta ao fim dos prontos (rodízio entre grupos)
+                trabalho = grupo.fila.popleft()
+                grupo.fichas -= 1
+                grupo.em_voo += 1
+                self.em_voo += 1
+                self.na_fila -= 1
+                if grupo.inicio is None:
+                    grupo.inicio = agora
+                tarefa = asyncio.create_task(self._tentar(grupo, trabalho, tentativa, ao_concluir))
+                tarefas.add(tarefa)
+                tarefa.add_done_callback(tarefas.discard)
+                self._liberou.set()
+                self._avaliar(grupo, agora)
+            
+            if leitura.done() and not self.na_fila and not self.em_voo and not self._aguardando:
+                break
+            self._mudou.clear()
+            proxima = self._agenda[0][0] - time.monotonic() if self._agenda else None
+            try:
+                await asyncio.wait_for(self._mudou.wait(), None if proxima is None else max(proxima, 0.0))
+            except asyncio.TimeoutError:
+                pass
+        
+        await leitura
+    
+    def resumo(self) -> Dict:
+        """Vazão e ajustes dos grupos com mais domínios"""
+        grupos = sorted(self.grupos.values(), key=lambda g: g.dominios, reverse=True)
+        return {
+            'n_grupos': len(grupos),
+            'taxa_por_grupo': self.taxa,
+            'concorrencia_maxima_grupo': self.concorrencia_maxima,
+            'grupos': {g.chave: g.resumo() for g in grupos[:GRUPOS_NO_RESUMO]}
+        }
+
+# ============================================================================
+# COLETA CONCORRENTE (ASYNCIO)
+# ============================================================================
+
+async def coletar_adstxt_async(session, domain: str, timeout: int = 15, cache: CacheHTTP = None,
+                               instrumentacao: Instrumentacao = None, max_tentativas: int = MAX_TENTATIVAS,
+                               variantes: MemoVariantes = None) -> Tuple[bool, Dict[str, List[str]], str]:
+    """Versão assíncrona de coletar_adstxt: as variantes de URL disputam na sessão (conexões) compartilhada"""
+    resultado, meta = _consultar_cache(domain, cache, instrumentacao)
+    if resultado is not None:
+        return resultado
+    
+    medicao = nova_medicao(domain)
+    for tentativa in range(1, max_tentativas + 1):
+        medicao['tentativas'] = tentativa
+        resultado, transitoria = await _coletar_variantes_async(session, domain, meta, timeout, cache, medicao,
+                                                                variantes)
+        espera = espera_retentativa(tentativa, medicao['retry_after']) if transitoria else None
+        if espera is None or tentativa == max_tentativas:
+            break
+        await asyncio.sleep(espera)
+    
+    medicao['total'] = time.time() - medicao['inicio']
+    if instrumentacao:
+        instrumentacao.registrar_requisicao(medicao, resultado[2])
+    return resultado
+
+async def _disputar_variantes_async(session, domain: str, urls: List[str], meta: Dict, timeout: int,
+                                    cache: CacheHTTP) -> Tuple:
+    """
+    Disputa entre as variantes de URL: (url, resultado, transitória, medição parcial, gravação pendente)
+    
+    Cada variante começa ATRASO_VARIANTE depois da anterior (ou assim que ela
+    falha), na mesma sessão; a primeira com ads.txt válido vence e as que
+    ainda estão em andamento são canceladas.
+    """
+    parciais = {url: nova_medicao(domain) for url in urls}
+    gravacoes = {url: [] for url in urls}
+    tarefas = {}
+    concluidas = {}
+    vencedora = None
+    try:
+        while vencedora is None and (len(tarefas) < len(urls) or len(concluidas) < len(tarefas)):
+            if len(tarefas) < len(urls):
+                url = urls[len(tarefas)]
+                meta_url = meta if meta and meta.get('url') == url else None
+                tarefa = asyncio.create_task(_baixar_adstxt_async(session, domain, url, meta_url, timeout, cache,
+                                                                  parciais[url], gravacoes[url]))
+                tarefas[tarefa] = url
+            
+            em_voo = [tarefa for tarefa, url in tarefas.items() if url not in concluidas]
+            prontas, _ = await asyncio.wait(em_voo, timeout=ATRASO_VARIANTE if len(tarefas) < len(urls) else None,
+                                            return_when=asyncio.FIRST_COMPLETED)
+            for tarefa in prontas:
+                concluidas[tarefas[tarefa]] = tarefa.result()
+            # Entre variantes que terminaram juntas vale a ordem de preferência
+            vencedora = next((url for url in urls if url in concluidas and _adstxt_valido(concluidas[url][0])), None)
+    finally:
+        perdedoras = [tarefa for tarefa in tarefas if not tarefa.done()]
+        for tarefa in perdedoras:
+            tarefa.cancel()
+        if perdedoras:
+            await asyncio.gather(*perdedoras, return_exceptions=True)
+    
+    url = vencedora or _escolher_variante(urls, concluidas)
+    return (url, *concluidas[url], parciais[url], gravacoes[url])
+
+async def _coletar_variantes_async(session, domain: str, meta: Dict, timeout: int, cache: CacheHTTP,
+                                   medicao: Dict,
+                                   variantes: MemoVariantes) -> Tuple[Tuple[bool, Dict[str, List[str]], str], bool]:
+    """Uma tentativa de coletar_adstxt_async: a URL memorizada e, se ela falhar de vez, a disputa das demais"""
+    urls = variantes_adstxt(domain)
+    memorizada = variantes.url(domain) if variantes is not None else None
+    if memorizada:
+        escolha = await _disputar_variantes_async(session, domain, [memorizada], meta, timeout, cache)
+        if escolha[1][0] or escolha[2]:
+            return _aplicar_variante(domain, escolha, cache, medicao, variantes)
+        urls = [url for url in urls if url != memorizada]
+    escolha = await _disputar_variantes_async(session, domain, urls, meta, timeout, cache)
+    return _aplicar_variante(domain, escolha, cache, medicao, variantes)
+
+async def _baixar_adstxt_async(session, domain: str, url: str, meta: Dict, timeout: int, cache: CacheHTTP,
+                               medicao: Dict,
+                               gravacao: List = None) -> Tuple[Tuple[bool, Dict[str, List[str]], str], bool]:
+    """
+    Uma requisição de coletar_adstxt_async (gravacao como em _baixar_adstxt)
+    
+    DNS, conexão e espera são medidos pelo TraceConfig da sessão.
+    """
+    headers = cache.cabecalhos_condicionais(meta) if cache else {}
+    medicao['retry_after'] = None
+    try:
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout),
+                               trace_request_ctx=medicao) as response:
+            if response.status == 304 and meta:
+                sellers = cache.servir(domain, revalidado=True)
+                if sellers is None:
+                    return (False, {}, "304 sem cópia em cache"), False
+                return (True, sellers, ""), False
+            if response.status != 200:
+                medicao['retry_after'] = ler_retry_after(response.headers.get('Retry-After'))
+                return (False, {}, f"HTTP {response.status}"), response.status in STATUS_TRANSITORIOS
+            
+            erro = verificar_cabecalhos(response.headers)
+            if erro:
+                return (False, {}, erro), False
+            
+            inicio_corpo = time.time()
+            parser = ParserAdsTxt(guardar_corpo=cache is not None)
+            async for bloco in response.content.iter_chunked(TAMANHO_BLOCO):
+                if not parser.alimentar(bloco):
+                    return (False, {}, parser.erro), False
+            sellers = parser.finalizar()
+            marcar_fase(medicao, 'corpo', inicio_corpo, time.time() - inicio_corpo)
+            
+            if cache and gravacao is not None:
+                gravacao.append((url, parser.corpo, response.headers, sellers))
+            elif cache:
+                cache.armazenar(domain, url, parser.corpo, response.headers, sellers)
+            return (True, sellers, ""), False
+    except asyncio.TimeoutError:
+        return (False, {}, "Timeout"), False
+    except aiohttp.ClientSSLError as e:
+        return (False, {}, str(e)[:100]), False
+    except aiohttp.ClientConnectionError as e:
+        return (False, {}, str(e)[:100]), not erro_de_dns(e)
+    except Exception as e:
+        return (False, {}, str(e)[:100]), False
+
+async def _coletar_sites_async(sites: Iterable[Dict], ao_concluir: Callable,
+                               max_concorrencia: int, max_por_host: int, timeout: int,
+                               cache: CacheHTTP, instrumentacao: Instrumentacao = None,
+                               escalonador: EscalonadorCortesia = None, variantes: MemoVariantes = None):
+    """
+    Distribui os sites entre max_concorrencia tarefas que compartilham uma sessão keep-alive.
+    
+    Com escalonador, as tentativas são disparadas por ele (limites por grupo
+    de hospedagem) em vez de pelas tarefas fixas.
+    """
+    # Com escalonador, o agrupamento por hospedagem já resolve cada domínio: o conector reaproveita
+    resolvedor = ResolvedorCompartilhado() if escalonador is not None else None
+    connector = aiohttp.TCPConnector(limit=max_concorrencia,
+                                     limit_per_host=max_por_host,
+                                     ttl_dns_cache=300,
+                                     resolver=resolvedor)
+    # Fila limitada: a lista de sites é consumida aos poucos, sem criar uma tarefa por domínio
+    fila = asyncio.Queue(maxsize=2 * max_concorrencia)
+    
+    # Os ganchos de DNS/conexão custam em cada requisição: só quando a latência por fase foi pedida
+    trace_configs = [criar_trace_config()] if instrumentacao and instrumentacao.latencia else None
+    
+    async with aiohttp.ClientSession(connector=connector, headers={'User-Agent': USER_AGENT},
+                                     trace_configs=trace_configs) as session:
+        
+        if escalonador is not None:
+            # Estado por domínio entre tentativas: metadados do cache e medição de latência
+            metas = {}
+            medicoes = {}
+            
+            def imediato(site):
+                resultado, metas[site['domain']] = _consultar_cache(site['domain'], cache, instrumentacao)
+                return resultado
+            
+            async def tentativa(site, n):
+                domain = site['domain']
+                medicao = medicoes.setdefault(domain, nova_medicao(domain))
+                medicao['tentativas'] = n
+                resultado, transitoria = await _coletar_variantes_async(session, domain, metas.get(domain), timeout,
+                                                                        cache, medicao, variantes)
+                return resultado, transitoria, medicao['retry_after']
+            
+            def concluir(site, resultado):
+                resolvedor.esquecer(site['domain'])
+                metas.pop(site['domain'], None)
+                medicao = medicoes.pop(site['domain'], None)
+                if medicao is not None and instrumentacao:
+                    medicao['total'] = time.time() - medicao['inicio']
+                    instrumentacao.registrar_requisicao(medicao, resultado[2])
+                ao_concluir(site, resultado)
+            
+            await escalonador.executar(sites, tentativa, concluir, imediato, resolvedor)
+            return
+        
+        async def trabalhador():
+            while True:
+                site = await fila.get()
+                if site is None:
+                    return
+                resultado = await coletar_adstxt_async(session, site['domain'], timeout, cache, instrumentacao,
+                                                       variantes=variantes)
+                ao_concluir(site, resultado)
+        
+        async def produtor():
+            if hasattr(sites, '__aiter__'):
+                async for site in sites:
+                    await fila.put(site)
+            else:
+                for site in sites:
+                    await fila.put(site)
+            for _ in range(max_concorrencia):
+                await fila.put(None)
+        
+        trabalhadores = [asyncio.create_task(trabalhador()) for _ in range(max_concorrencia)]
+        await asyncio.gather(produtor(), *trabalhadores)
+
+def coletar_sites(sites: Iterable[Dict], ao_concluir: Callable,
+                  max_concorrencia: int = 64, max_por_host: int = 2, timeout: int = 15,
+                  cache: CacheHTTP = None, instrumentacao: Instrumentacao = None,
+                  cortesia: bool = True, taxa_por_grupo: float = TAXA_POR_GRUPO,
+                  variantes: MemoVariantes = None, chave_grupos: str = 'grupos_hospedagem') -> Dict:
+    """
+    Coleta ads.txt de vários sites em paralelo.
+    
+    ao_concluir(site, (sucesso, sellers, erro)) é chamado à medida que cada
+    domínio termina (ordem de conclusão, não a ordem de entrada). Com aiohttp,
+    sites também pode ser um iterável assíncrono. Com instrumentacao, a
+    latência de cada domínio (por fase) e as retentativas são registradas.
+    Com cortesia (padrão), os domínios são agrupados por hospedagem e cada
+    grupo tem taxa e concorrência próprias (EscalonadorCortesia); retorna o
+    resumo de vazão por grupo. As variantes de URL (https/http, com e sem
+    www.) disputam cada domínio; com variantes, a vencedora é memorizada e
+    usada direto nas próximas coletas (quem chama grava com variantes.salvar()).
+    O resumo dos grupos vai para a instrumentação em chave_grupos.
+    """
+    if not HAS_AIOHTTP:
+        for site in sites:
+            ao_concluir(site, coletar_adstxt(site['domain'], timeout, cache, instrumentacao, variantes=variantes))
+        return None
+    
+    escalonador = EscalonadorCortesia(max_concorrencia, taxa=taxa_por_grupo) if cortesia else None
+    asyncio.run(_coletar_sites_async(sites, ao_concluir, max_concorrencia, max_por_host, timeout, cache,
+                                     instrumentacao, escalonador, variantes))
+    if escalonador is None:
+        return None
+    resumo = escalonador.resumo()
+    if instrumentacao:
+        instrumentacao.registrar_grupos(resumo, chave_grupos)
+    return resumo
+
+# ============================================================================
+# CHECKPOINT DA COLETA
+# ============================================================================
+
+def registro_coleta(site: Dict, resultado: Tuple[bool, Dict[str, List[str]], str], url_adstxt: str = None) -> Dict:
+    """
+    Entrada de sites_data de um site a partir do resultado da coleta (e da URL que serviu o ads.txt)
+    
+    As referências a outros ads.txt saem de sellers para o campo referencias.
+    """
+    sucesso, sellers, erro = resultado
+    if sucesso:
+        registro = {
+            'domain': site['domain'],
+            'cat': site['cat'],
+            'sucesso': True,
+            'sellers': {tipo: sellers[tipo] for tipo in TIPOS_RELACAO},
+            'n_direct_raw': len(sellers['DIRECT']),
+            'n_reseller_raw': len(sellers['RESELLER'])
+        }
+        if url_adstxt:
+            registro['url_adstxt'] = url_adstxt
+        if sellers.get('referencias'):
+            registro['referencias'] = sellers['referencias']
+        return registro
+    return {
+        'domain': site['domain'],
+        'cat': site['cat'],
+        'sucesso': False,
+        'erro': erro
+    }
+
+class CheckpointColeta:
+    """
+    Log append-only (JSONL) com o resultado de cada domínio assim que termina.
+    
+    Uma coleta interrompida pode ser retomada pulando os sites já coletados
+    com sucesso (as falhas são tentadas de novo e o registro mais recente de
+    cada site prevalece), e as etapas de análise podem partir de um
+    checkpoint completo sem rede (com sucessos e falhas).
+    """
+    
+    def __init__(self, caminho: str = 'coleta_checkpoint.jsonl', retomar: bool = False):
+        self.caminho = caminho
+        if not retomar and os.path.exists(caminho):
+            os.remove(caminho)
+        self._arquivo = None
+    
+    def carregar(self) -> Dict[str, Dict]:
+        """Sites já coletados (nome -> registro); ignora uma última linha truncada"""
+        concluidos = {}
+        if not os.path.exists(self.caminho):
+            return concluidos
+        with open(self.caminho, 'r', encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    continue
+                concluidos[registro.pop('name')] = registro
+        return concluidos
+    
+    def registrar(self, nome: str, data: Dict):
+        if self._arquivo is None:
+            # Garante que uma linha truncada por interrupção não se cole à próxima
+            precisa_quebra = False
+            if os.path.exists(self.caminho) and os.path.getsize(self.caminho) > 0:
+                with open(self.caminho, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    precisa_quebra = f.read(1) != b'\n'
+            self._arquivo = open(self.caminho, 'a', encoding='utf-8')
+            if precisa_quebra:
+                self._arquivo.write('\n')
+        
+        self._arquivo.write(json.dumps({'name': nome, **data}, ensure_ascii=False) + '\n')
+        self._arquivo.flush()
+    
+    def fechar(self):
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+# ============================================================================
+# MATRIZ DE INCIDÊNCIA SITE × SELLER
+# ============================================================================
+
+class DicionarioSellers:
+    """Dicionário global seller ("dominio#publisher_id") -> id inteiro"""
+    
+    def __init__(self, sellers: Iterable[str] = ()):
+        self.ids = {}
+        self.sellers = []
+        for seller in sellers:
+            self.codificar(seller)
+    
+    def __len__(self) -> int:
+        return len(self.sellers)
+    
+    def codificar(self, seller: str) -> int:
+        seller_id = self.ids.get(seller)
+        if seller_id is None:
+            seller_id = self.ids[seller] = len(self.sellers)
+            self.sellers.append(seller)
+        return seller_id
+    
+    def codificar_lista(self, sellers: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.codificar(s) for s in sellers), dtype=np.int32)
+    
+    def decodificar(self, ids: Iterable[int]) -> List[str]:
+        return [self.sellers[i] for i in ids]
+
+class ConstrutorIncidencia:
+    """
+    Monta as matrizes CSR site × seller (uma por tipo de relação), um site por vez.
+    
+    Cada site guarda apenas um array int32 de ids por tipo. Sellers repetidos
+    no mesmo ads.txt são somados: o valor da célula é a multiplicidade,
+    como nas listas originais.
+    """
+    
+    def __init__(self, dicionario: DicionarioSellers = None):
+        self.dicionario = dicionario if dicionario is not None else DicionarioSellers()
+        self.sites = []
+        self.dominios = []
+        self.categorias = []
+        self._ids = {tipo: [] for tipo in TIPOS_RELACAO}
+    
+    def adicionar_site(self, nome: str, domain: str, cat: str, sellers: Dict[str, List[str]]):
+        self.sites.append(nome)
+        self.dominios.append(domain)
+        self.categorias.append(cat)
+        for tipo in TIPOS_RELACAO:
+            self._ids[tipo].append(self.dicionario.codificar_lista(sellers.get(tipo, [])))
+    
+    def finalizar(self) -> Dict:
+        n_sites = len(self.sites)
+        n_sellers = len(self.dicionario)
+        incidencia = {
+            'sites': self.sites,
+            'indice_sites': {nome: i for i, nome in enumerate(self.sites)},
+            'dominios': self.dominios,
+            'categorias': np.array(self.categorias, dtype=object),
+            'dicionario': self.dicionario,
+            'ordem': {},
+            'primeira': {}
+        }
+        
+        for tipo in TIPOS_RELACAO:
+            tamanhos = [len(ids) for ids in self._ids[tipo]]
+            colunas = np.concatenate(self._ids[tipo]) if n_sites else np.zeros(0, dtype=np.int32)
+            linhas = np.repeat(np.arange(n_sites, dtype=np.int32), tamanhos)
+            
+            matriz = sparse.csr_matrix((np.ones(len(colunas), dtype=np.int32), (linhas, colunas)),
+                                       shape=(n_sites, n_sellers))
+            matriz.sum_duplicates()
+            incidencia[tipo] = matriz
+            
+            # Ordem de primeira aparição (percorrendo os sites em ordem), para
+            # reproduzir a ordem em que as análises por dicionário listavam os sellers
+            unicos, primeira = np.unique(colunas, return_index=True)
+            incidencia['ordem'][tipo] = unicos[np.argsort(primeira, kind='stable')]
+            
+            # Site (linha) e posição na lista do site da primeira aparição de cada seller (-1: ausente)
+            inicios = np.concatenate([[0], np.cumsum(tamanhos, dtype=np.int64)[:-1]]) if n_sites else np.zeros(0)
+            primeira_site = np.full(n_sellers, -1, dtype=np.int32)
+            primeira_posicao = np.full(n_sellers, -1, dtype=np.int32)
+            primeira_site[unicos] = linhas[primeira]
+            primeira_posicao[unicos] = primeira - inicios[linhas[primeira]]
+            incidencia['primeira'][tipo] = (primeira_site, primeira_posicao)
+        
+        return incidencia
+
+def construir_incidencia(sites_data: Dict, dicionario: DicionarioSellers = None) -> Dict:
+    """Matrizes site × seller (DIRECT e RESELLER) dos sites com ads.txt válido"""
+    construtor = ConstrutorIncidencia(dicionario)
+    for nome, data in sites_data.items():
+        if data['sucesso']:
+            construtor.adicionar_site(nome, data['domain'], data['cat'], data['sellers'])
+    return construtor.finalizar()
+
+def sellers_do_site(incidencia: Dict, nome: str) -> Dict[str, np.ndarray]:
+    """Ids distintos de sellers de um site, por tipo de relação"""
+    i = incidencia['indice_sites'][nome]
+    return {tipo: incidencia[tipo].indices[incidencia[tipo].indptr[i]:incidencia[tipo].indptr[i + 1]]
+            for tipo in TIPOS_RELACAO}
+
+def mascara_pools(incidencia: Dict, dark_pools: Dict) -> np.ndarray:
+    """Máscara booleana sobre os ids de sellers: True para sellers em dark pools"""
+    mascara = np.zeros(len(incidencia['dicionario']), dtype=bool)
+    ids = incidencia['dicionario'].ids
+    mascara[[ids[seller] for seller in dark_pools if seller in ids]] = True
+    return mascara
+
+# ============================================================================
+# COLETA MULTIPROCESSO (SHARDS)
+# ============================================================================
+
+def _trabalhador_shard(indice: int, fila_entrada, fila_saida, opcoes: Dict):
+    """
+    Processo trabalhador: coleta e parseia com asyncio os domínios da fila compartilhada.
+    
+    Cada resultado volta como arrays de ids de um dicionário local; as strings
+    de sellers só viajam na primeira vez que o trabalhador as encontra.
+    """
+    dicionario = DicionarioSellers()
+    enviados = 0
+    cache = CacheHTTP(opcoes['cache_dir']) if opcoes.get('cache_dir') else None
+    instrumentacao = (Instrumentacao(repassar=True, latencia=opcoes.get('latencia', False))
+                      if opcoes.get('instrumentar') else None)
+    # O memo é só lido aqui; variantes novas vão ao coordenador, que grava o arquivo
+    variantes = MemoVariantes(opcoes['variantes']) if opcoes.get('variantes') else None
+    
+    def ao_concluir(site, resultado):
+        nonlocal enviados
+        sucesso, sellers, erro = resultado
+        registro = {'trabalhador': indice, 'site': site, 'sucesso': sucesso, 'erro': erro}
+        if instrumentacao:
+            registro['medicao'] = instrumentacao.pendentes.pop(site['domain'], None)
+        if variantes is not None:
+            registro['variante'] = variantes.novos.pop(site['domain'], None)
+        if sucesso:
+            registro['ids'] = {tipo: dicionario.codificar_lista(sellers[tipo]) for tipo in TIPOS_RELACAO}
+            registro['novos'] = dicionario.sellers[enviados:]
+            registro['referencias'] = sellers.get('referencias', [])
+            enviados = len(dicionario)
+        fila_saida.put(registro)
+    
+    def receber(site):
+        # Avisa o coordenador antes de coletar: se este processo morrer, o site é dado como falho
+        fila_saida.put({'trabalhador': indice, 'recebido': site})
+        return site
+    
+    def fonte():
+        for site in iter(fila_entrada.get, None):
+            yield receber(site)
+    
+    async def fonte_async():
+        loop = asyncio.get_running_loop()
+        while True:
+            site = await loop.run_in_executor(None, fila_entrada.get)
+            if site is None:
+                return
+            yield receber(site)
+    
+    coletar_sites(fonte_async() if HAS_AIOHTTP else fonte(), ao_concluir,
+                  opcoes['max_concorrencia'], opcoes['max_por_host'], opcoes['timeout'], cache, instrumentacao,
+                  opcoes['cortesia'], opcoes['taxa_por_grupo'], variantes)
+    fila_saida.put({'trabalhador': indice, 'fim': True})
+
+def coletar_sites_multiprocesso(sites: Iterable[Dict], ao_concluir: Callable, n_processos: int = None,
+                                max_concorrencia: int = 64, max_por_host: int = 2, timeout: int = 15,
+                                cache_dir: str = None, dicionario: DicionarioSellers = None,
+                                instrumentacao: Instrumentacao = None, cortesia: bool = True,
+                                taxa_por_grupo: float = TAXA_POR_GRUPO,
+                                variantes: MemoVariantes = None) -> DicionarioSellers:
+    """
+    Versão de coletar_sites dividida entre n_processos trabalhadores.
+    
+    Os domínios são distribuídos por uma fila compartilhada (quem termina
+    primeiro pega o próximo). Se um trabalhador morrer, os sites que ele já
+    tinha pegado vão para ao_concluir como falhas; um erro ao ler sites é
+    relançado aqui depois que os trabalhadores terminam. O coordenador traduz os ids locais de cada
+    trabalhador para o dicionário global e entrega a ao_concluir sellers cujas
+    strings são as do dicionário (uma cópia por seller, não por site).
+    Retorna o dicionário global, reaproveitável em construir_incidencia.
+    As medições de latência dos trabalhadores são agregadas em instrumentacao.
+    Cada trabalhador tem seu escalonador de cortesia; a taxa por grupo é
+    dividida entre eles para que a soma respeite taxa_por_grupo. Os
+    trabalhadores partem do arquivo de variantes e as vencedoras novas são
+    registradas em variantes.
+    """
+    n_processos = n_processos or os.cpu_count() or 1
+    dicionario = dicionario if dicionario is not None else DicionarioSellers()
+    opcoes = {'max_concorrencia': max_concorrencia, 'max_por_host': max_por_host,
+              'timeout': timeout, 'cache_dir': cache_dir, 'instrumentar': instrumentacao is not None,
+              'latencia': instrumentacao is not None and instrumentacao.latencia,
+              'cortesia': cortesia, 'taxa_por_grupo': taxa_por_grupo / n_processos,
+              'variantes': variantes.caminho if variantes is not None else None}
+    
+    fila_entrada = multiprocessing.Queue(maxsize=2 * n_processos * max_concorrencia)
+    fila_saida = multiprocessing.Queue()
+    processos = [multiprocessing.Process(target=_trabalhador_shard, args=(i, fila_entrada, fila_saida, opcoes),
+                                         daemon=True)
+                 for i in range(n_processos)]
+    for processo in processos:
+        processo.start()
+    
+    erro_entrada = []
+    
+    def alimentar():
+        # Os sentinelas vão mesmo se a leitura falhar, senão os trabalhadores esperam para sempre
+        try:
+            for site in sites:
+                fila_entrada.put(site)
+        except Exception as e:
+            erro_entrada.append(e)
+        finally:
+            for _ in processos:
+                fila_entrada.put(None)
+    
+    threading.Thread(target=alimentar, daemon=True).start()
+    
+    def chave(site):
+        return site.get('name', site['domain'])
+    
+    # Tradução id local -> id global e sites em coleta, por trabalhador
+    traducao = [np.zeros(0, dtype=np.int32) for _ in processos]
+    em_coleta = [{} for _ in processos]
+    ativos = set(range(n_processos))
+    try:
+        while ativos:
+            try:
+                registro = fila_saida.get(timeout=1.0)
+            except queue.Empty:
+                for i in list(ativos):
+                    if not processos[i].is_alive() and processos[i].exitcode != 0:
+                        erro = f"trabalhador {i} terminou com código {processos[i].exitcode}"
+                        print(f"AVISO: {erro} ({len(em_coleta[i])} sites perdidos)")
+                        ativos.discard(i)
+                        for site in em_coleta[i].values():
+                            ao_concluir(site, (False, {}, erro))
+                        em_coleta[i].clear()
+                continue
+            
+            i = registro['trabalhador']
+            if registro.get('fim'):
+                ativos.discard(i)
+                continue
+            if 'recebido' in registro:
+                em_coleta[i][chave(registro['recebido'])] = registro['recebido']
+                continue
+            em_coleta[i].pop(chave(registro['site']), None)
+            
+            if instrumentacao and registro.get('medicao'):
+                medicao = registro['medicao']
+                instrumentacao.registrar_requisicao(medicao, medicao.pop('status'))
+            if variantes is not None and registro.get('variante'):
+                variantes.registrar(registro['site']['domain'], registro['variante'])
+            if registro['sucesso']:
+                if registro['novos']:
+                    traducao[i] = np.concatenate([traducao[i], dicionario.codificar_lista(registro['novos'])])
+                sellers = {tipo: dicionario.decodificar(traducao[i][ids]) for tipo, ids in registro['ids'].items()}
+                sellers['referencias'] = registro['referencias']
+                resultado = (True, sellers, "")
+            else:
+                resultado = (False, {}, registro['erro'])
+            ao_concluir(registro['site'], resultado)
+    finally:
+        for processo in processos:
+            if processo.is_alive():
+                processo.terminate()
+            processo.join()
+    
+    if erro_entrada:
+        raise erro_entrada[0]
+    return dicionario
+
+# ============================================================================
+# FRONTEIRA DE REFERÊNCIAS (subdomain=, OWNERDOMAIN=, MANAGERDOMAIN=, ...)
+# ============================================================================
+
+PROFUNDIDADE_REFERENCIAS = 2          # saltos a partir dos sites da lista
+MAX_DOMINIOS_REFERENCIAS = 10000      # domínios seguidos por execução
+
+class FronteiraReferencias:
+    """
+    Coleta recursiva dos ads.txt apontados pelas referências dos sites.
+    
+    Cada domínio entra na fronteira uma única vez por execução (os da própria
+    lista de sites já contam como vistos e o resultado deles é reaproveitado),
+    até profundidade_maxima saltos a partir dos sites. A coleta é a mesma dos
+    sites (concorrente, com cache, variantes de URL e cortesia), alimentada à
+    medida que as respostas trazem novas referências. Um domínio reencontrado
+    mais perto de um site passa a valer com a profundidade menor.
+    """
+    
+    def __init__(self, profundidade_maxima: int = PROFUNDIDADE_REFERENCIAS,
+                 max_dominios: int = MAX_DOMINIOS_REFERENCIAS):
+        self.profundidade_maxima = profundidade_maxima
+        self.max_dominios = max_dominios
+        self.profundidade = {}   # domínio -> menor profundidade em que foi referenciado
+        self.resultados = {}     # domínio -> {'sucesso', 'sellers', 'referencias'} ou {'sucesso', 'erro'}
+        self.seguidos = 0
+        self.descartados = 0
+        self.por_diretiva = Counter()
+        self._fila = deque()
+        self._em_andamento = 0
+        self._mudou = None
+    
+    def _descobrir(self, referencias: List[str], profundidade: int):
+        if profundidade > self.profundidade_maxima:
+            return
+        for referencia in referencias:
+            diretiva, _, dominio = referencia.partition('=')
+            anterior = self.profundidade.get(dominio)
+            if anterior is not None and anterior <= profundidade:
+                continue
+            if anterior is None:
+                if self.seguidos >= self.max_dominios:
+                    self.descartados += 1
+                    continue
+                self.seguidos += 1
+                self.por_diretiva[diretiva] += 1
+                self.profundidade[dominio] = profundidade
+                self._fila.append({'domain': dominio})
+                continue
+            
+            # Já visto mais longe: se já foi coletado, as referências dele também ficam mais perto
+            self.profundidade[dominio] = profundidade
+            resultado = self.resultados.get(dominio)
+            if resultado is not None and resultado['sucesso']:
+                self._descobrir(resultado.get('referencias', []), profundidade + 1)
+        if self._mudou is not None:
+            self._mudou.set()
+    
+    def _concluir(self, site: Dict, resultado: Tuple[bool, Dict[str, List[str]], str]):
+        domain = site['domain']
+        sucesso, sellers, erro = resultado
+        if sucesso:
+            self.resultados[domain] = {
+                'sucesso': True,
+                'sellers': {tipo: sellers[tipo] for tipo in TIPOS_RELACAO},
+                'referencias': sellers.get('referencias', [])
+            }
+            self._descobrir(self.resultados[domain]['referencias'], self.profundidade[domain] + 1)
+        else:
+            self.resultados[domain] = {'sucesso': False, 'erro': erro}
+        self._em_andamento -= 1
+        if self._mudou is not None:
+            self._mudou.set()
+    
+    def _fonte(self) -> Iterator[Dict]:
+        # Coleta sequencial: cada domínio termina (e enfileira o que referencia) antes do próximo
+        while self._fila:
+            self._em_andamento += 1
+            yield self._fila.popleft()
     
-    for linha in linhas:
-        linha = linha.strip()
-        if not linha or linha.startswith('#'):
-            continue
+    async def _fonte_async(self):
+        # Só termina quando a fila está vazia e nenhuma coleta em andamento pode trazer referências
+        self._mudou = asyncio.Event()
+        while self._fila or self._em_andamento:
+            if not self._fila:
+                self._mudou.clear()
+                await self._mudou.wait()
+                continue
+            self._em_andamento += 1
+            yield self._fila.popleft()
+    
+    def seguir(self, sites_data: Dict, coletar: Callable):
+        """
+        Segue as referências dos sites coletados.
+        
+        coletar(sites, ao_concluir) é a função de coleta (ex.: coletar_sites
+        com cache e variantes); com aiohttp recebe um iterável assíncrono.
+        """
+        for data in sites_data.values():
+            self.profundidade[data['domain']] = 0
+            self.resultados[data['domain']] = data
+        for data in sites_data.values():
+            if data['sucesso']:
+                self._descobrir(data.get('referencias', []), 1)
+        if self._fila:
+            coletar(self._fonte_async() if HAS_AIOHTTP else self._fonte(), self._concluir)
+    
+    def anexar(self, sites_data: Dict) -> List[str]:
+        """
+        Grava em cada site os sellers dos ads.txt alcançados a partir dele.
         
-        partes = [p.strip() for p in linha.split(',')]
-        if len(partes) >= 3:
-            domain = partes[0].lower().replace('www.', '')
-            publisher_id = partes[1]
-            relacao = partes[2].upper()
+        sellers_descobertos é uma lista de {'domain', 'cadeia', 'DIRECT',
+        'RESELLER'}, em que cadeia são as referências ("diretiva=dominio")
+        seguidas desde o site, pelo caminho mais curto. Retorna os nomes dos
+        sites alterados.
+        """
+        alterados = []
+        for nome, data in sites_data.items():
+            descobertos = []
+            vistos = {data['domain']}
+            fila = deque((referencia, [referencia]) for referencia in data.get('referencias', []))
+            while fila:
+                referencia, cadeia = fila.popleft()
+                dominio = referencia.partition('=')[2]
+                if dominio in vistos:
+                    continue
+                vistos.add(dominio)
+                alvo = self.resultados.get(dominio)
+                if alvo is None or not alvo['sucesso']:
+                    continue
+                descobertos.append({'domain': dominio, 'cadeia': cadeia,
+                                    **{tipo: alvo['sellers'][tipo] for tipo in TIPOS_RELACAO}})
+                if len(cadeia) < self.profundidade_maxima:
+                    fila.extend((proxima, cadeia + [proxima]) for proxima in alvo.get('referencias', []))
             
-            if relacao in ['DIRECT', 'RESELLER']:
-                seller_id = f"{domain}#{publisher_id}"
-                sellers[relacao].append(seller_id)
+            if descobertos:
+                data['sellers_descobertos'] = descobertos
+                alterados.append(nome)
+            elif data.pop('sellers_descobertos', None) is not None:
+                alterados.append(nome)
+        return alterados
     
-    return sellers
+    def resumo(self) -> Dict:
+        coletados = [d for d, p in self.profundidade.items() if p > 0 and d in self.resultados]
+        return {
+            'profundidade_maxima': self.profundidade_maxima,
+            'dominios_seguidos': self.seguidos,
+            'com_adstxt': sum(1 for d in coletados if self.resultados[d]['sucesso']),
+            'descartados_pelo_limite': self.descartados,
+            'por_diretiva': dict(self.por_diretiva.most_common()),
+            'por_profundidade': dict(sorted(Counter(self.profundidade[d] for d in coletados).items()))
+        }
 
 # ============================================================================
 # ANÁLISE 1: DARK POOLS
 # ============================================================================
 
-def identificar_dark_pools(sites_data: Dict, grupos_editoriais: Dict) -> Dict:
+def identificar_dark_pools(sites_data: Dict, grupos_editoriais: Dict, incidencia: Dict = None) -> Dict:
     """Identifica sellers DIRECT compartilhados (dark pools)"""
     
+    if incidencia is not None:
+        return identificar_dark_pools_vetorizado(incidencia, grupos_editoriais)
+    
     # Mapear seller -> lista de sites
     seller_to_sites = defaultdict(list)
     
@@ -162,32 +2033,103 @@ def identificar_dark_pools(sites_data: Dict, grupos_editoriais: Dict) -> Dict:
     dark_pools = {}
     
     for seller, sites in seller_to_sites.items():
-        if len(sites) < 2:
-            continue
-        
-        # Verificar se são do mesmo grupo editorial
-        mesmo_grupo = False
-        for grupo, dominios in grupos_editoriais.items():
-            sites_dominios = {sites_data[s]['domain'] for s in sites if s in sites_data}
-            if sites_dominios.issubset(dominios):
-                mesmo_grupo = True
-                break
-        
-        if not mesmo_grupo:
-            categorias = list({sites_data[s]['cat'] for s in sites if s in sites_data})
-            
-            # Classificar pool
-            if len(categorias) == 1:
-                tipo = f"homogeneo_{categorias[0]}"
-            else:
-                tipo = "misto_" + "_".join(sorted(categorias))
-            
-            dark_pools[seller] = {
-                'sites': sites,
-                'n_sites': len(sites),
-                'categorias': categorias,
-                'tipo': tipo
-            }
+        pool = _classificar_pool(sites, sites_data, grupos_editoriais)
+        if pool is not None:
+            dark_pools[seller] = pool
+    
+    return dark_pools
+
+def _classificar_pool(sites: List[str], sites_data: Dict, grupos_editoriais: Dict) -> Dict:
+    """Pool de um seller a partir de seus sites (None se não compartilhado ou do mesmo grupo)"""
+    if len(sites) < 2:
+        return None
+    
+    # Verificar se são do mesmo grupo editorial
+    sites_dominios = {sites_data[s]['domain'] for s in sites if s in sites_data}
+    for grupo, dominios in grupos_editoriais.items():
+        if sites_dominios.issubset(dominios):
+            return None
+    
+    categorias = list({sites_data[s]['cat'] for s in sites if s in sites_data})
+    
+    return {
+        'sites': sites,
+        'n_sites': len(sites),
+        'categorias': categorias,
+        'tipo': _tipo_pool(categorias)
+    }
+
+def _tipo_pool(categorias: List[str]) -> str:
+    """homogeneo_<cat> com uma categoria; misto_<cats em ordem> com várias"""
+    if len(categorias) == 1:
+        return f"homogeneo_{categorias[0]}"
+    return "misto_" + "_".join(sorted(categorias))
+
+def _classificar_categorias(codigos: np.ndarray, categorias: np.ndarray) -> Dict[int, Tuple[List[str], str]]:
+    """Traduz cada combinação de categorias (bitmask) em (categorias, tipo do pool)"""
+    tipos = {}
+    for codigo in np.unique(codigos).tolist():
+        cats = [str(c) for k, c in enumerate(categorias) if codigo >> k & 1]
+        tipos[codigo] = (cats, _tipo_pool(cats))
+    return tipos
+
+def identificar_dark_pools_vetorizado(incidencia: Dict, grupos_editoriais: Dict) -> Dict:
+    """
+    Mesma saída de identificar_dark_pools, calculada sobre a matriz DIRECT.
+    
+    Compartilhamento vem da soma das colunas; a exclusão por grupo editorial
+    e o tipo do pool vêm de produtos da matriz por máscaras de sites
+    (uma por grupo, uma por categoria), sem montar conjuntos por seller.
+    """
+    direct = incidencia['DIRECT']
+    n_sites, n_sellers = direct.shape
+    
+    # Ocorrências por seller, contando repetições como as listas originais
+    ocorrencias = np.asarray(direct.sum(axis=0)).ravel()
+    
+    presenca = direct.copy()
+    presenca.data = np.ones_like(presenca.data)
+    presenca_t = presenca.T.tocsr()
+    
+    # Seller do mesmo grupo editorial: nenhum de seus sites está fora do grupo
+    dominios = np.array(incidencia['dominios'], dtype=object)
+    mesmo_grupo = np.zeros(n_sellers, dtype=bool)
+    for dominios_grupo in grupos_editoriais.values():
+        fora_do_grupo = (~np.isin(dominios, list(dominios_grupo))).astype(np.int32)
+        mesmo_grupo |= (presenca_t @ fora_do_grupo) == 0
+    
+    # Pools na ordem de primeira aparição dos sellers
+    ordem = incidencia['ordem']['DIRECT']
+    pools_ids = ordem[(ocorrencias[ordem] >= 2) & ~mesmo_grupo[ordem]]
+    
+    # Categorias de cada pool: colunas não nulas da linha do pool em sellers × categorias
+    # (índices esparsos, sem bitmask: as categorias vêm do CSV e não têm limite de quantidade)
+    categorias, cat_site = np.unique(incidencia['categorias'].astype(str), return_inverse=True)
+    mascara_cat = sparse.csr_matrix((np.ones(n_sites, dtype=np.int32), (np.arange(n_sites), cat_site)),
+                                    shape=(n_sites, len(categorias)))
+    cat_pools = (presenca_t[pools_ids] @ mascara_cat).tocsr()
+    cat_pools.sort_indices()
+    tipos = {}
+    
+    direct_csc = direct.tocsc()
+    sites = np.array(incidencia['sites'], dtype=object)
+    sellers = incidencia['dicionario'].sellers
+    
+    dark_pools = {}
+    for k, j in enumerate(pools_ids.tolist()):
+        inicio, fim = direct_csc.indptr[j], direct_csc.indptr[j + 1]
+        sites_pool = sites[np.repeat(direct_csc.indices[inicio:fim], direct_csc.data[inicio:fim])].tolist()
+        chave = tuple(cat_pools.indices[cat_pools.indptr[k]:cat_pools.indptr[k + 1]].tolist())
+        if chave not in tipos:
+            cats = [str(categorias[c]) for c in chave]
+            tipos[chave] = (cats, _tipo_pool(cats))
+        cats, tipo = tipos[chave]
+        dark_pools[sellers[j]] = {
+            'sites': sites_pool,
+            'n_sites': int(ocorrencias[j]),
+            'categorias': list(cats),
+            'tipo': tipo
+        }
     
     return dark_pools
 
@@ -195,42 +2137,96 @@ def identificar_dark_pools(sites_data: Dict, grupos_editoriais: Dict) -> Dict:
 # ANÁLISE 2: MÉTRICAS POR SITE
 # ============================================================================
 
-def calcular_metricas_site(sellers: Dict, dark_pools: Dict) -> Dict:
-    """Calcula exposição e opacidade de um site"""
+def calcular_metricas_site(sellers: Dict, dark_pools) -> Dict:
+    """
+    Calcula exposição e opacidade de um site
+    
+    Aceita sellers como strings com dark_pools = dict de pools (ou o conjunto
+    de suas chaves, já montado), ou como ids (sellers_do_site) com
+    dark_pools = máscara booleana (mascara_pools).
+    """
     
-    sellers_direct = set(sellers['DIRECT'])
-    sellers_reseller = set(sellers['RESELLER'])
+    if isinstance(dark_pools, np.ndarray):
+        # A máscara é indexada direto pelos ids do site (sem montar o conjunto de pools)
+        ids_direct = np.unique(sellers['DIRECT'])
+        n_direct = len(ids_direct)
+        n_reseller = len(np.unique(sellers['RESELLER']))
+        n_pools = int(np.count_nonzero(dark_pools[ids_direct]))
+    else:
+        sellers_direct = set(sellers['DIRECT'])
+        sellers_pools = dark_pools if isinstance(dark_pools, (set, frozenset)) else dark_pools.keys()
+        n_direct = len(sellers_direct)
+        n_reseller = len(set(sellers['RESELLER']))
+        n_pools = sum(1 for seller in sellers_direct if seller in sellers_pools)
     
     # Exposição a dark pools
-    if sellers_direct:
-        sellers_em_pools = sellers_direct.intersection(set(dark_pools.keys()))
-        exposicao = (len(sellers_em_pools) / len(sellers_direct)) * 100
+    if n_direct:
+        exposicao = (n_pools / n_direct) * 100
     else:
         exposicao = 0.0
     
     # Opacidade
-    total = len(sellers_direct) + len(sellers_reseller)
+    total = n_direct + n_reseller
     if total > 0:
-        opacidade = (len(sellers_reseller) / total) * 100
+        opacidade = (n_reseller / total) * 100
     else:
         opacidade = 0.0
     
     return {
-        'n_direct': len(sellers_direct),
-        'n_reseller': len(sellers_reseller),
+        'n_direct': n_direct,
+        'n_reseller': n_reseller,
         'exposicao': round(exposicao, 2),
         'opacidade': round(opacidade, 2),
-        'n_pools': len(sellers_em_pools) if sellers_direct else 0
+        'n_pools': n_pools
+    }
+
+def calcular_metricas_lote(incidencia: Dict, mascara: np.ndarray) -> Dict[str, Dict]:
+    """
+    calcular_metricas_site para todos os sites de uma vez.
+    
+    mascara é o índice de pertinência a pools (mascara_pools): n_pools de
+    cada site sai de um único produto da matriz DIRECT (binária) pela máscara.
+    """
+    direct = incidencia['DIRECT']
+    n_direct = np.diff(direct.indptr)
+    n_reseller = np.diff(incidencia['RESELLER'].indptr)
+    
+    presenca = sparse.csr_matrix((np.ones(len(direct.indices), dtype=np.int32), direct.indices, direct.indptr),
+                                 shape=direct.shape)
+    n_pools = presenca @ mascara.astype(np.int32)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exposicao = np.where(n_direct > 0, (n_pools / n_direct) * 100, 0.0)
+        total = n_direct + n_reseller
+        opacidade = np.where(total > 0, (n_reseller / total) * 100, 0.0)
+    
+    return {
+        nome: {
+            'n_direct': int(n_direct[i]),
+            'n_reseller': int(n_reseller[i]),
+            'exposicao': round(float(exposicao[i]), 2),
+            'opacidade': round(float(opacidade[i]), 2),
+            'n_pools': int(n_pools[i])
+        }
+        for i, nome in enumerate(incidencia['sites'])
     }
 
 # ============================================================================
 # ANÁLISE 3: ESTATÍSTICAS POR CATEGORIA
 # ============================================================================
 
-def calcular_estatisticas_categoria(sites_data: Dict, dark_pools: Dict) -> Dict:
+def calcular_estatisticas_categoria(sites_data: Dict, dark_pools: Dict, incidencia: Dict = None) -> Dict:
     """Calcula estatísticas agregadas por categoria"""
     
     stats_cat = {}
+    sellers_pools = set(dark_pools)
+    
+    # Com a matriz de incidência, as métricas de todos os sites saem de uma passada
+    if incidencia is not None:
+        metricas = calcular_metricas_lote(incidencia, mascara_pools(incidencia, dark_pools))
+        for nome, metricas_site in metricas.items():
+            if 'metricas' not in sites_data[nome]:
+                sites_data[nome]['metricas'] = metricas_site
     
     for cat in ['FC', 'HP', 'MS']:
         sites_cat = [s for s in sites_data.values() if s['cat'] == cat and s['sucesso']]
@@ -242,7 +2238,7 @@ def calcular_estatisticas_categoria(sites_data: Dict, dark_pools: Dict) -> Dict:
         # Calcular métricas para cada site
         for site in sites_cat:
             if 'metricas' not in site:
-                site['metricas'] = calcular_metricas_site(site['sellers'], dark_pools)
+                site['metricas'] = calcular_metricas_site(site['sellers'], sellers_pools)
         
         # Agregar
         n_directs = [s['metricas']['n_direct'] for s in sites_cat]
@@ -329,6 +2325,190 @@ def executar_testes_estatisticos(sites_data: Dict) -> Dict:
     
     return testes
 
+# ============================================================================
+# ANÁLISE 4b: TESTES POR REAMOSTRAGEM (BOOTSTRAP E PERMUTAÇÃO)
+# ============================================================================
+
+N_REAMOSTRAS = 10000
+ELEMENTOS_POR_BLOCO = 2_000_000   # reamostras × observações materializadas por vez
+
+def _tarefas_reamostragem(n_reamostras: int, n_observacoes: int, semente) -> List[Tuple[int, object]]:
+    """Divide n_reamostras em blocos de índices que cabem na memória, cada um com sua semente"""
+    por_bloco = max(1, ELEMENTOS_POR_BLOCO // max(n_observacoes, 1))
+    tamanhos = [min(por_bloco, n_reamostras - i) for i in range(0, n_reamostras, por_bloco)]
+    if not isinstance(semente, np.random.SeedSequence):
+        semente = np.random.SeedSequence(semente)
+    return list(zip(tamanhos, semente.spawn(len(tamanhos))))
+
+def _reamostrar_bloco(tarefa) -> np.ndarray:
+    """
+    Um bloco de reamostras, sorteado como matriz de índices (reamostras × n).
+    
+    'bootstrap': média e mediana de cada grupo (colunas: médias, depois medianas);
+    'diferenca_medias': permutação dos rótulos, média do 1º grupo - média do 2º;
+    'kruskal': permutação dos rótulos, H sobre os postos (valores já em postos).
+    """
+    tipo, grupos, tamanho, semente = tarefa
+    rng = np.random.default_rng(semente)
+    
+    if tipo == 'bootstrap':
+        medias, medianas = [], []
+        for valores in grupos:
+            amostras = valores[rng.integers(0, len(valores), (tamanho, len(valores)))]
+            medias.append(amostras.mean(axis=1))
+            medianas.append(np.median(amostras, axis=1))
+        return np.column_stack(medias + medianas)
+    
+    todos = np.concatenate(grupos)
+    permutacoes = rng.random((tamanho, len(todos))).argsort(axis=1)
+    
+    if tipo == 'diferenca_medias':
+        n_a = len(grupos[0])
+        soma_a = todos[permutacoes[:, :n_a]].sum(axis=1)
+        return soma_a / n_a - (todos.sum() - soma_a) / (len(todos) - n_a)
+    
+    # kruskal: grupos já contêm os postos da amostra combinada
+    inicio = 0
+    soma = np.zeros(tamanho)
+    for valores in grupos:
+        fim = inicio + len(valores)
+        soma += todos[permutacoes[:, inicio:fim]].sum(axis=1) ** 2 / len(valores)
+        inicio = fim
+    return soma
+
+def _executar_blocos(tarefas: List, n_processos: int) -> np.ndarray:
+    if n_processos > 1 and len(tarefas) > 1:
+        with multiprocessing.Pool(n_processos) as pool:
+            partes = pool.map(_reamostrar_bloco, tarefas)
+    else:
+        partes = [_reamostrar_bloco(t) for t in tarefas]
+    return np.concatenate(partes)
+
+def _intervalo(valores: np.ndarray) -> List[float]:
+    return [round(float(v), 4) for v in np.percentile(valores, [2.5, 97.5])]
+
+def _bootstrap_grupos(grupos: List[np.ndarray], nomes: List[str], n_reamostras: int,
+                      n_processos: int, semente) -> Dict:
+    """IC 95% percentil (bootstrap) de média e mediana de cada grupo e das diferenças 1º - 2º"""
+    tarefas = [('bootstrap', grupos, t, s)
+               for t, s in _tarefas_reamostragem(n_reamostras, sum(map(len, grupos)), semente)]
+    reamostras = _executar_blocos(tarefas, n_processos)
+    k = len(grupos)
+    
+    resultado = {}
+    for g, nome in enumerate(nomes):
+        resultado[f'media_{nome}'] = {'observado': round(float(np.mean(grupos[g])), 4),
+                                      'ic95': _intervalo(reamostras[:, g])}
+        resultado[f'mediana_{nome}'] = {'observado': round(float(np.median(grupos[g])), 4),
+                                        'ic95': _intervalo(reamostras[:, k + g])}
+    if k == 2:
+        resultado['diferenca_medias'] = {
+            'observado': round(float(np.mean(grupos[0]) - np.mean(grupos[1])), 4),
+            'ic95': _intervalo(reamostras[:, 0] - reamostras[:, 1])
+        }
+        resultado['diferenca_medianas'] = {
+            'observado': round(float(np.median(grupos[0]) - np.median(grupos[1])), 4),
+            'ic95': _intervalo(reamostras[:, 2] - reamostras[:, 3])
+        }
+    return resultado
+
+def teste_permutacao_medias(a: np.ndarray, b: np.ndarray, n_reamostras: int = N_REAMOSTRAS,
+                            n_processos: int = 1, semente=42) -> Dict:
+    """
+    Teste de permutação bilateral para a diferença de médias.
+    
+    Exato (todas as divisões dos rótulos) quando o nº de combinações não passa
+    de n_reamostras; senão Monte Carlo com p = (1 + extremos) / (1 + reamostras).
+    """
+    todos = np.concatenate([a, b])
+    observado = float(a.mean() - b.mean())
+    n_combinacoes = math.comb(len(todos), len(a))
+    
+    if n_combinacoes <= n_reamostras:
+        indices = np.array(list(itertools.combinations(range(len(todos)), len(a))), dtype=np.int64)
+        soma_a = todos[indices].sum(axis=1)
+        nulos = soma_a / len(a) - (todos.sum() - soma_a) / len(b)
+        extremos = int(np.sum(np.abs(nulos) >= abs(observado) - 1e-12))
+        p, metodo, n = extremos / len(nulos), 'exata', len(nulos)
+    else:
+        tarefas = [('diferenca_medias', [a, b], t, s)
+                   for t, s in _tarefas_reamostragem(n_reamostras, len(todos), semente)]
+        nulos = _executar_blocos(tarefas, n_processos)
+        extremos = int(np.sum(np.abs(nulos) >= abs(observado) - 1e-12))
+        p, metodo, n = (1 + extremos) / (1 + len(nulos)), 'monte_carlo', len(nulos)
+    
+    return {'observado': round(observado, 4), 'p': round(p, 4), 'permutacao': metodo, 'n_permutacoes': n}
+
+def teste_permutacao_kruskal(grupos: List[np.ndarray], n_reamostras: int = N_REAMOSTRAS,
+                             n_processos: int = 1, semente=42) -> Dict:
+    """Kruskal-Wallis com p por permutação dos rótulos (H com correção de empates, como scipy)"""
+    todos = np.concatenate(grupos)
+    n = len(todos)
+    postos = stats.rankdata(todos)
+    _, empates = np.unique(todos, return_counts=True)
+    correcao = 1 - (empates ** 3 - empates).sum() / (n ** 3 - n) if n > 1 else 1.0
+    
+    limites = np.cumsum([0] + [len(g) for g in grupos])
+    grupos_postos = [postos[limites[i]:limites[i + 1]] for i in range(len(grupos))]
+    
+    def estatistica_h(soma):
+        return (12 / (n * (n + 1)) * soma - 3 * (n + 1)) / correcao if correcao > 0 else np.zeros_like(soma)
+    
+    observado = float(estatistica_h(np.array(sum(g.sum() ** 2 / len(g) for g in grupos_postos))))
+    tarefas = [('kruskal', grupos_postos, t, s) for t, s in _tarefas_reamostragem(n_reamostras, n, semente)]
+    nulos = estatistica_h(_executar_blocos(tarefas, n_processos))
+    extremos = int(np.sum(nulos >= observado - 1e-9))
+    
+    return {
+        'H': round(observado, 4),
+        'p': round((1 + extremos) / (1 + len(nulos)), 4),
+        'permutacao': 'monte_carlo',
+        'n_permutacoes': len(nulos)
+    }
+
+def executar_testes_reamostragem(sites_data: Dict, n_reamostras: int = N_REAMOSTRAS,
+                                 n_processos: int = 1, semente: int = 42) -> Dict:
+    """
+    Versão por reamostragem de executar_testes_estatisticos.
+    
+    Para exposição e opacidade (FC vs MS): ICs bootstrap de médias, medianas
+    e diferenças, e teste de permutação da diferença de médias. Para sellers
+    DIRECT (FC, HP, MS): ICs bootstrap por categoria e Kruskal-Wallis com p
+    por permutação. Todas as reamostras são matrizes de índices sorteadas
+    em blocos, opcionalmente em n_processos processos.
+    """
+    por_cat = {cat: [s for s in sites_data.values() if s['cat'] == cat and s['sucesso']]
+               for cat in ['FC', 'HP', 'MS']}
+    sementes = iter(np.random.SeedSequence(semente).spawn(16))
+    
+    testes = {}
+    for metrica in ['exposicao', 'opacidade']:
+        a = np.array([s['metricas'][metrica] for s in por_cat['FC']], dtype=float)
+        b = np.array([s['metricas'][metrica] for s in por_cat['MS']], dtype=float)
+        if len(a) and len(b):
+            permutacao = teste_permutacao_medias(a, b, n_reamostras, n_processos, next(sementes))
+            testes[metrica] = {
+                'grupos': ['FC', 'MS'],
+                'n': [len(a), len(b)],
+                **_bootstrap_grupos([a, b], ['FC', 'MS'], n_reamostras, n_processos, next(sementes)),
+                'permutacao_diferenca_medias': permutacao,
+                'significativo': bool(permutacao['p'] < 0.05)
+            }
+    
+    sellers = [np.array([s['metricas']['n_direct'] for s in por_cat[cat]], dtype=float) for cat in ['FC', 'HP', 'MS']]
+    if all(len(g) for g in sellers):
+        kruskal = teste_permutacao_kruskal(sellers, n_reamostras, n_processos, next(sementes))
+        testes['sellers_entre_categorias'] = {
+            'grupos': ['FC', 'HP', 'MS'],
+            'n': [len(g) for g in sellers],
+            **_bootstrap_grupos(sellers, ['FC', 'HP', 'MS'], n_reamostras, n_processos, next(sementes)),
+            'permutacao_kruskal': kruskal,
+            'significativo': bool(kruskal['p'] < 0.05)
+        }
+    
+    testes['n_reamostras'] = n_reamostras
+    return testes
+
 # ============================================================================
 # ANÁLISE 5: DARK POOLS POR TIPO
 # ============================================================================
@@ -355,18 +2535,830 @@ def analisar_composicao_pools(dark_pools: Dict) -> Dict:
         ]
     }
 
+# ============================================================================
+# MODELO NULO: ALEATORIZAÇÕES QUE PRESERVAM GRAUS
+# ============================================================================
+
+# Desligado por padrão (é a etapa mais cara): --aleatorizacoes 1000 para testar
+N_ALEATORIZACOES = 0
+TROCAS_POR_ARESTA = 5
+
+# As trocas preservam o grau de cada seller, logo quem tem grau >= 2 (candidato
+# a pool) é o mesmo em toda aleatorização: o que varia é em quais sites ele está
+HIPOTESE_NULA = ("composição dos pools por tipo (categorias dos sites) e assortatividade por categoria; "
+                 "o nº total de pools é fixado pelos graus e só varia pela exclusão de grupos editoriais")
+
+_CONTEXTO_NULO = {}
+
+def _pertence(chaves_ordenadas: np.ndarray, consulta: np.ndarray) -> np.ndarray:
+    pos = np.searchsorted(chaves_ordenadas, consulta)
+    pos[pos == len(chaves_ordenadas)] = 0
+    return chaves_ordenadas[pos] == consulta
+
+def trocar_arestas(linhas: np.ndarray, colunas: np.ndarray, n_colunas: int, n_trocas: int,
+                   rng: np.random.Generator, lote: int = None) -> np.ndarray:
+    """
+    Trocas de tabuleiro (a,x),(b,y) -> (a,y),(b,x) em lotes vetorizados.
+    
+    Cada lote sorteia pares de arestas e aceita, de uma vez, as trocas que
+    não criam arestas repetidas; trocas do mesmo lote que disputam uma
+    aresta ou uma célula nova são descartadas. Graus de linhas e colunas
+    são preservados. Retorna as novas colunas (linhas não mudam).
+    """
+    colunas = colunas.copy()
+    n_arestas = len(linhas)
+    if n_arestas < 2:
+        return colunas
+    lote = lote or max(1, n_arestas // 4)
+    linhas64 = linhas.astype(np.int64)
+    
+    tentativas = 0
+    while tentativas < n_trocas:
+        m = min(lote, n_trocas - tentativas)
+        tentativas += m
+        chaves = np.sort(linhas64 * n_colunas + colunas)
+        
+        i = rng.integers(0, n_arestas, m)
+        j = rng.integers(0, n_arestas, m)
+        a, x = linhas64[i], colunas[i]
+        b, y = linhas64[j], colunas[j]
+        nova_ay = a * n_colunas + y
+        nova_bx = b * n_colunas + x
+        
+        ok = (a != b) & (x != y) & ~_pertence(chaves, nova_ay) & ~_pertence(chaves, nova_bx)
+        i, j, nova_ay, nova_bx = i[ok], j[ok], nova_ay[ok], nova_bx[ok]
+        
+        # Conflitos dentro do lote: cada aresta e cada célula nova em uma troca só
+        _, inv, cont = np.unique(np.concatenate([i, j]), return_inverse=True, return_counts=True)
+        livre = (cont[inv[:len(i)]] == 1) & (cont[inv[len(i):]] == 1)
+        _, inv, cont = np.unique(np.concatenate([nova_ay, nova_bx]), return_inverse=True, return_counts=True)
+        livre &= (cont[inv[:len(i)]] == 1) & (cont[inv[len(i):]] == 1)
+        
+        i, j = i[livre], j[livre]
+        colunas[i], colunas[j] = colunas[j], colunas[i].copy()
+    
+    return colunas
+
+def _estatisticas_bipartido(linhas: np.ndarray, colunas: np.ndarray, ctx: Dict) -> Tuple[np.ndarray, float]:
+    """
+    Contagem de pools por código de categorias e assortatividade por categoria
+    de uma incidência binária site × seller (arestas linhas, colunas).
+    
+    A assortatividade usa a projeção sites-sites ponderada pelo nº de sellers
+    em comum: mistura = Kᵀ·K - diag(ΣK), com K = sellers × categorias.
+    """
+    n_sellers = ctx['n_sellers']
+    n_cat = ctx['n_categorias']
+    cat_aresta = ctx['cat_site'][linhas]
+    
+    codigos = np.zeros(n_sellers, dtype=np.int64)
+    np.bitwise_or.at(codigos, colunas, np.left_shift(1, cat_aresta).astype(np.int64))
+    
+    pool = ctx['grau_seller'] >= 2
+    for fora in ctx['fora_grupos']:
+        pool &= np.bincount(colunas, weights=fora[linhas], minlength=n_sellers) > 0
+    contagens = np.bincount(codigos[pool], minlength=1 << n_cat)
+    
+    K = np.bincount(colunas.astype(np.int64) * n_cat + cat_aresta, minlength=n_sellers * n_cat)
+    K = K.reshape(n_sellers, n_cat).astype(float)
+    mistura = K.T @ K - np.diag(K.sum(axis=0))
+    total = mistura.sum()
+    if total == 0:
+        return contagens, np.nan
+    mistura /= total
+    soma_ab = float(mistura.sum(axis=1) @ mistura.sum(axis=0))
+    r = (float(np.trace(mistura)) - soma_ab) / (1 - soma_ab) if soma_ab != 1 else np.nan
+    return contagens, r
+
+def _iniciar_trabalhador_nulo(ctx: Dict):
+    _CONTEXTO_NULO.update(ctx)
+
+def _aleatorizacoes_lote(args) -> Tuple[np.ndarray, np.ndarray]:
+    """n aleatorizações independentes a partir de uma semente (executa no trabalhador)"""
+    n, semente = args
+    ctx = _CONTEXTO_NULO
+    rng = np.random.default_rng(semente)
+    n_trocas = ctx['trocas_por_aresta'] * len(ctx['linhas'])
+    
+    contagens = np.zeros((n, 1 << ctx['n_categorias']), dtype=np.int64)
+    assortatividade = np.zeros(n)
+    for k in range(n):
+        colunas = trocar_arestas(ctx['linhas'], ctx['colunas'], ctx['n_sellers'], n_trocas, rng)
+        contagens[k], assortatividade[k] = _estatisticas_bipartido(ctx['linhas'], colunas, ctx)
+    return contagens, assortatividade
+
+def _comparar_nulo(observado: float, nulos: np.ndarray) -> Dict:
+    """z-score e p-valores empíricos (bilateral e cauda superior, com correção +1)"""
+    nulos = nulos[~np.isnan(nulos)]
+    if len(nulos) == 0 or np.isnan(observado):
+        return {'observado': None, 'media_nula': None, 'dp_nula': None, 'z': None, 'p': None, 'p_acima': None}
+    media = float(nulos.mean())
+    dp = float(nulos.std(ddof=1)) if len(nulos) > 1 else 0.0
+    desvio = abs(observado - media)
+    return {
+        'observado': round(float(observado), 4),
+        'media_nula': round(media, 4),
+        'dp_nula': round(dp, 4),
+        'z': round((observado - media) / dp, 3) if dp > 0 else None,
+        'p': round(float((1 + np.sum(np.abs(nulos - media) >= desvio - 1e-12)) / (len(nulos) + 1)), 4),
+        'p_acima': round(float((1 + np.sum(nulos >= observado - 1e-12)) / (len(nulos) + 1)), 4)
+    }
+
+def testar_modelo_nulo(incidencia: Dict, grupos_editoriais: Dict, n_aleatorizacoes: int = N_ALEATORIZACOES,
+                       n_processos: int = 1, semente: int = 42,
+                       trocas_por_aresta: int = TROCAS_POR_ARESTA, n_lotes: int = None) -> Dict:
+    """
+    Significância dos dark pools contra aleatorizações da incidência DIRECT
+    que preservam o nº de sellers de cada site e de sites de cada seller.
+    
+    Para cada aleatorização recalcula os pools por tipo e a assortatividade
+    por categoria; reporta z-scores e p-valores empíricos. O que se testa é
+    a divisão por tipo, não a existência dos pools (ver HIPOTESE_NULA). A
+    incidência é tratada como binária (sellers repetidos no mesmo site contam
+    uma vez), inclusive no valor observado. As aleatorizações são divididas
+    em lotes com sementes independentes entre n_processos processos; os lotes
+    (padrão: 4 por processo) definem as sementes e, portanto, o resultado.
+    """
+    presenca = incidencia['DIRECT'].tocoo()
+    linhas = presenca.row.astype(np.int64)
+    colunas = presenca.col.astype(np.int64)
+    n_sites, n_sellers = incidencia['DIRECT'].shape
+    
+    categorias, cat_site = np.unique(incidencia['categorias'].astype(str), return_inverse=True)
+    dominios = np.array(incidencia['dominios'], dtype=object)
+    ctx = {
+        'linhas': linhas,
+        'colunas': colunas,
+        'n_sellers': n_sellers,
+        'n_categorias': len(categorias),
+        'cat_site': cat_site.astype(np.int64),
+        'grau_seller': np.bincount(colunas, minlength=n_sellers),
+        'fora_grupos': [(~np.isin(dominios, list(d))).astype(float) for d in grupos_editoriais.values()],
+        'trocas_por_aresta': trocas_por_aresta
+    }
+    
+    contagens_obs, assort_obs = _estatisticas_bipartido(linhas, colunas, ctx)
+    
+    # Lotes com sementes independentes (SeedSequence), um ou mais por processo
+    n_lotes = max(1, min(n_aleatorizacoes, n_lotes or 4 * max(n_processos, 1)))
+    tamanhos = [len(b) for b in np.array_split(np.arange(n_aleatorizacoes), n_lotes)]
+    sementes = np.random.SeedSequence(semente).spawn(n_lotes)
+    tarefas = [(t, s) for t, s in zip(tamanhos, sementes) if t > 0]
+    
+    if n_processos > 1:
+        with multiprocessing.Pool(n_processos, initializer=_iniciar_trabalhador_nulo, initargs=(ctx,)) as pool:
+            partes = pool.map(_aleatorizacoes_lote, tarefas)
+    else:
+        _iniciar_trabalhador_nulo(ctx)
+        partes = [_aleatorizacoes_lote(t) for t in tarefas]
+    
+    contagens_nulas = np.concatenate([p[0] for p in partes])
+    assort_nulas = np.concatenate([p[1] for p in partes])
+    
+    # Códigos de categorias -> tipo do pool (somando códigos do mesmo tipo)
+    tipos = _classificar_categorias(np.arange(1, 1 << len(categorias)), categorias)
+    por_tipo = {}
+    for codigo, (_, tipo) in sorted(tipos.items()):
+        obs, nulos = por_tipo.get(tipo, (0, 0))
+        por_tipo[tipo] = (obs + contagens_obs[codigo], nulos + contagens_nulas[:, codigo])
+    
+    return {
+        'n_aleatorizacoes': int(n_aleatorizacoes),
+        'testa': HIPOTESE_NULA,
+        'trocas_por_aresta': trocas_por_aresta,
+        'total_pools': int(contagens_obs.sum()),
+        'por_tipo': {tipo: _comparar_nulo(obs, nulos) for tipo, (obs, nulos) in por_tipo.items()
+                     if obs > 0 or np.any(nulos > 0)},
+        'assortatividade': _comparar_nulo(assort_obs, assort_nulas)
+    }
+
+# ============================================================================
+# ARMAZENAMENTO COLUNAR (.npz)
+# ============================================================================
+
+ARQUIVO_COLUNAR = 'resultados_colunares.npz'
+CAMPOS_METRICAS = ('n_direct', 'n_reseller', 'exposicao', 'opacidade', 'n_pools')
+
+def _empacotar_textos(textos: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Coluna de strings como (bytes UTF-8 concatenados, offsets), sem dtype object"""
+    codificados = [t.encode('utf-8') for t in textos]
+    offsets = np.zeros(len(codificados) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in codificados], out=offsets[1:])
+    return np.frombuffer(b''.join(codificados), dtype=np.uint8), offsets
+
+def _desempacotar_textos(dados: np.ndarray, offsets: np.ndarray) -> List[str]:
+    blob = dados.tobytes()
+    limites = offsets.tolist()
+    return [blob[limites[i]:limites[i + 1]].decode('utf-8') for i in range(len(limites) - 1)]
+
+def _gravar_textos(colunas: Dict, nome: str, textos: Iterable[str]):
+    colunas[nome], colunas[nome + '.offsets'] = _empacotar_textos(textos)
+
+def _gravar_categorica(colunas: Dict, nome: str, valores: List[str]) -> List[str]:
+    """Coluna codificada por dicionário: códigos int32 + vocabulário ordenado (retornado)"""
+    vocab, codigos = np.unique(np.array(valores, dtype=str), return_inverse=True)
+    colunas[nome] = codigos.astype(np.int32)
+    _gravar_textos(colunas, nome + '.vocab', vocab.tolist())
+    return vocab.tolist()
+
+def ler_textos(arquivo, nome: str) -> List[str]:
+    return _desempacotar_textos(arquivo[nome], arquivo[nome + '.offsets'])
+
+def ler_categorica(arquivo, nome: str) -> List[str]:
+    vocab = ler_textos(arquivo, nome + '.vocab')
+    return [vocab[c] for c in arquivo[nome].tolist()]
+
+def salvar_resultados_colunares(caminho: str, sites_data: Dict, incidencia: Dict,
+                                dark_pools: Dict, resumo: Dict):
+    """
+    Grava os resultados em um .npz com uma tabela por entidade:
+    
+    sites.*        uma linha por site (ordem da entrada), métricas em colunas
+    sellers.vocab  dicionário seller -> id usado pela incidência e pelos pools
+    incidencia.*   arrays CSR (indptr/indices/data) e ordem, por tipo
+    pools.*        um pool por linha: id do seller, n_sites, tipo e categorias (CSR)
+    indice.*       incidência DIRECT por seller (CSC) e site/posição da primeira
+                   aparição de cada seller: o índice invertido de --incremental
+    descobertos.*  sellers_descobertos: uma linha por (site, domínio alcançado),
+                   com a cadeia de referências e os sellers em CSR sobre um
+                   vocabulário próprio (ficam fora da incidência e dos pools)
+    resumo.json    metadata, estatísticas, testes e composição (pequenos)
+    
+    Os sites de cada pool não são gravados: são a coluna do seller na
+    incidência DIRECT. Strings ficam em blocos UTF-8 com offsets, para que
+    np.load funcione sem pickle e cada coluna seja lida só quando acessada.
+    """
+    colunas = {}
+    nomes = list(sites_data)
+    n = len(nomes)
+    
+    # Tabela de sites
+    _gravar_textos(colunas, 'sites.nome', nomes)
+    _gravar_textos(colunas, 'sites.domain', (sites_data[s]['domain'] for s in nomes))
+    _gravar_textos(colunas, 'sites.erro', (sites_data[s].get('erro') or '' for s in nomes))
+    _gravar_textos(colunas, 'sites.url_adstxt', (sites_data[s].get('url_adstxt') or '' for s in nomes))
+    vocab_cat = _gravar_categorica(colunas, 'sites.cat', [sites_data[s]['cat'] for s in nomes])
+    colunas['sites.sucesso'] = np.array([bool(sites_data[s]['sucesso']) for s in nomes], dtype=bool)
+    colunas['sites.n_direct_raw'] = np.array([sites_data[s].get('n_direct_raw', 0) for s in nomes], dtype=np.int64)
+    colunas['sites.n_reseller_raw'] = np.array([sites_data[s].get('n_reseller_raw', 0) for s in nomes], dtype=np.int64)
+    
+    linha = np.full(n, -1, dtype=np.int64)
+    for i, nome in enumerate(nomes):
+        linha[i] = incidencia['indice_sites'].get(nome, -1)
+    colunas['sites.linha'] = linha
+    
+    colunas['sites.tem_metricas'] = np.array(['metricas' in sites_data[s] for s in nomes], dtype=bool)
+    for campo in CAMPOS_METRICAS:
+        dtype = np.float64 if campo in ('exposicao', 'opacidade') else np.int64
+        colunas[f'sites.metricas.{campo}'] = np.array(
+            [sites_data[s].get('metricas', {}).get(campo, 0) for s in nomes], dtype=dtype)
+    
+    # Sellers descobertos pelas referências
+    descobertos = [(i, d) for i, s in enumerate(nomes) for d in sites_data[s].get('sellers_descobertos', ())]
+    colunas['descobertos.site'] = np.array([i for i, _ in descobertos], dtype=np.int64)
+    _gravar_textos(colunas, 'descobertos.domain', (d['domain'] for _, d in descobertos))
+    _gravar_textos(colunas, 'descobertos.cadeia', (' '.join(d['cadeia']) for _, d in descobertos))
+    vocab_descobertos = DicionarioSellers()
+    for tipo in TIPOS_RELACAO:
+        ids = [vocab_descobertos.codificar_lista(d[tipo]) for _, d in descobertos]
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in ids], out=indptr[1:])
+        colunas[f'descobertos.{tipo}.indptr'] = indptr
+        colunas[f'descobertos.{tipo}.indices'] = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32)
+    _gravar_textos(colunas, 'descobertos.sellers.vocab', vocab_descobertos.sellers)
+    
+    # Sellers e incidência
+    dicionario = incidencia['dicionario']
+    _gravar_textos(colunas, 'sellers.vocab', dicionario.sellers)
+    for tipo in TIPOS_RELACAO:
+        matriz = incidencia[tipo]
+        colunas[f'incidencia.{tipo}.indptr'] = matriz.indptr.astype(np.int64)
+        colunas[f'incidencia.{tipo}.indices'] = matriz.indices.astype(np.int32)
+        colunas[f'incidencia.{tipo}.data'] = matriz.data.astype(np.int32)
+        colunas[f'incidencia.{tipo}.ordem'] = np.asarray(incidencia['ordem'][tipo], dtype=np.int32)
+    
+    # Índice seller -> sites e primeira aparição, lidos sob demanda pela próxima execução incremental
+    if 'primeira' in incidencia:
+        por_seller = incidencia['DIRECT'].tocsc()
+        colunas['indice.DIRECT.indptr'] = por_seller.indptr.astype(np.int64)
+        colunas['indice.DIRECT.indices'] = por_seller.indices.astype(np.int32)
+        colunas['indice.DIRECT.data'] = por_seller.data.astype(np.int32)
+        primeira_site, primeira_posicao = incidencia['primeira']['DIRECT']
+        colunas['indice.DIRECT.primeira_site'] = primeira_site.astype(np.int32)
+        colunas['indice.DIRECT.primeira_posicao'] = primeira_posicao.astype(np.int32)
+    
+    # Pools (categorias como listas CSR de índices no vocabulário de sites.cat)
+    indice_cat = {cat: k for k, cat in enumerate(vocab_cat)}
+    pools = list(dark_pools.items())
+    colunas['pools.seller'] = np.array([dicionario.ids[s] for s, _ in pools], dtype=np.int32)
+    colunas['pools.n_sites'] = np.array([p['n_sites'] for _, p in pools], dtype=np.int64)
+    colunas['pools.categorias.indptr'] = np.cumsum([0] + [len(p['categorias']) for _, p in pools],
+                                                   dtype=np.int64)
+    colunas['pools.categorias.indices'] = np.array([indice_cat[c] for _, p in pools for c in p['categorias']],
+                                                   dtype=np.int32)
+    _gravar_categorica(colunas, 'pools.tipo', [p['tipo'] for _, p in pools])
+    
+    colunas['resumo.json'] = np.frombuffer(
+        json.dumps(resumo, cls=CodificadorNumpy, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+    
+    np.savez_compressed(caminho, **colunas)
+
+def abrir_resultados_colunares(caminho: str = ARQUIVO_COLUNAR):
+    """Abre o .npz sem carregar nada: cada coluna é lida ao ser acessada"""
+    return np.load(caminho, allow_pickle=False)
+
+def carregar_incidencia_colunar(arquivo, tipos: Tuple[str, ...] = TIPOS_RELACAO) -> Dict:
+    """Reconstrói o dicionário de incidência (só os tipos pedidos) a partir do .npz"""
+    linhas = arquivo['sites.linha']
+    validos = np.flatnonzero(linhas >= 0)
+    validos = validos[np.argsort(linhas[validos], kind='stable')]
+    
+    nomes = ler_textos(arquivo, 'sites.nome')
+    dominios = ler_textos(arquivo, 'sites.domain')
+    cats = ler_categorica(arquivo, 'sites.cat')
+    dicionario = DicionarioSellers(ler_textos(arquivo, 'sellers.vocab'))
+    
+    sites = [nomes[i] for i in validos.tolist()]
+    incidencia = {
+        'sites': sites,
+        'indice_sites': {nome: i for i, nome in enumerate(sites)},
+        'dominios': [dominios[i] for i in validos.tolist()],
+        'categorias': np.array([cats[i] for i in validos.tolist()], dtype=object),
+        'dicionario': dicionario,
+        'ordem': {}
+    }
+    for tipo in tipos:
+        incidencia[tipo] = sparse.csr_matrix(
+            (arquivo[f'incidencia.{tipo}.data'], arquivo[f'incidencia.{tipo}.indices'],
+             arquivo[f'incidencia.{tipo}.indptr']),
+            shape=(len(sites), len(dicionario)))
+        incidencia['ordem'][tipo] = arquivo[f'incidencia.{tipo}.ordem']
+    return incidencia
+
+def carregar_sites_colunar(arquivo, campos: Iterable[str] = ('domain', 'cat', 'erro', 'url_adstxt', 'n_direct_raw',
+                                                            'n_reseller_raw', 'metricas'),
+                           incidencia: Dict = None) -> Dict:
+    """
+    sites_data a partir da tabela de sites, lendo só as colunas de campos.
+    
+    Com incidencia (os dois tipos), reconstrói também 'sellers' com as
+    multiplicidades originais; a ordem dentro de cada lista não é preservada.
+    """
+    campos = set(campos)
+    nomes = ler_textos(arquivo, 'sites.nome')
+    sucesso = arquivo['sites.sucesso'].tolist()
+    colunas = {}
+    if 'domain' in campos:
+        colunas['domain'] = ler_textos(arquivo, 'sites.domain')
+    if 'cat' in campos:
+        colunas['cat'] = ler_categorica(arquivo, 'sites.cat')
+    if 'erro' in campos:
+        colunas['erro'] = ler_textos(arquivo, 'sites.erro')
+    # Arquivos anteriores às variantes de URL não têm a coluna
+    if 'url_adstxt' in campos and 'sites.url_adstxt' in arquivo.files:
+        colunas['url_adstxt'] = ler_textos(arquivo, 'sites.url_adstxt')
+    for campo in ('n_direct_raw', 'n_reseller_raw'):
+        if campo in campos:
+            colunas[campo] = arquivo[f'sites.{campo}'].tolist()
+    if 'metricas' in campos:
+        tem_metricas = arquivo['sites.tem_metricas'].tolist()
+        metricas = {campo: arquivo[f'sites.metricas.{campo}'].tolist() for campo in CAMPOS_METRICAS}
+    
+    sites_data = {}
+    for i, nome in enumerate(nomes):
+        data = {}
+        for campo in ('domain', 'cat'):
+            if campo in colunas:
+                data[campo] = colunas[campo][i]
+        data['sucesso'] = sucesso[i]
+        
+        if not sucesso[i]:
+            if 'erro' in colunas:
+                data['erro'] = colunas['erro'][i]
+            sites_data[nome] = data
+            continue
+        
+        if incidencia is not None:
+            linha = incidencia['indice_sites'][nome]
+            data['sellers'] = {}
+            for tipo in TIPOS_RELACAO:
+                matriz = incidencia[tipo]
+                inicio, fim = matriz.indptr[linha], matriz.indptr[linha + 1]
+                ids = np.repeat(matriz.indices[inicio:fim], matriz.data[inicio:fim])
+                data['sellers'][tipo] = incidencia['dicionario'].decodificar(ids.tolist())
+        if 'url_adstxt' in colunas and colunas['url_adstxt'][i]:
+            data['url_adstxt'] = colunas['url_adstxt'][i]
+        for campo in ('n_direct_raw', 'n_reseller_raw'):
+            if campo in colunas:
+                data[campo] = colunas[campo][i]
+        if 'metricas' in campos and tem_metricas[i]:
+            data['metricas'] = {campo: metricas[campo][i] for campo in CAMPOS_METRICAS}
+        sites_data[nome] = data
+    
+    return sites_data
+
+def carregar_descobertos_colunar(arquivo) -> Dict[str, List[Dict]]:
+    """sellers_descobertos por nome de site ({} em arquivos anteriores às referências)"""
+    if 'descobertos.site' not in arquivo.files:
+        return {}
+    nomes = ler_textos(arquivo, 'sites.nome')
+    dominios = ler_textos(arquivo, 'descobertos.domain')
+    cadeias = ler_textos(arquivo, 'descobertos.cadeia')
+    vocab = ler_textos(arquivo, 'descobertos.sellers.vocab')
+    csr = {tipo: (arquivo[f'descobertos.{tipo}.indptr'].tolist(), arquivo[f'descobertos.{tipo}.indices'].tolist())
+           for tipo in TIPOS_RELACAO}
+    
+    por_site = defaultdict(list)
+    for k, i in enumerate(arquivo['descobertos.site'].tolist()):
+        registro = {'domain': dominios[k], 'cadeia': cadeias[k].split(' ')}
+        for tipo, (indptr, indices) in csr.items():
+            registro[tipo] = [vocab[j] for j in indices[indptr[k]:indptr[k + 1]]]
+        por_site[nomes[i]].append(registro)
+    return dict(por_site)
+
+def carregar_pools_colunar(arquivo, incidencia: Dict = None) -> Dict:
+    """Dark pools do .npz; com incidencia (DIRECT), inclui a lista de sites de cada pool"""
+    sellers = ler_textos(arquivo, 'sellers.vocab') if incidencia is None else incidencia['dicionario'].sellers
+    vocab_cat = ler_textos(arquivo, 'sites.cat.vocab')
+    tipos = ler_categorica(arquivo, 'pools.tipo')
+    ids = arquivo['pools.seller'].tolist()
+    n_sites = arquivo['pools.n_sites'].tolist()
+    if 'pools.categorias' in arquivo.files:
+        # .npz anterior, com as categorias em bitmask
+        codigos = arquivo['pools.categorias'].tolist()
+        cats_pools = [[c for b, c in enumerate(vocab_cat) if codigo >> b & 1] for codigo in codigos]
+    else:
+        indptr = arquivo['pools.categorias.indptr'].tolist()
+        indices = arquivo['pools.categorias.indices'].tolist()
+        cats_pools = [[vocab_cat[c] for c in indices[indptr[k]:indptr[k + 1]]] for k in range(len(ids))]
+    
+    if incidencia is not None:
+        direct_csc = incidencia['DIRECT'].tocsc()
+        nomes_sites = np.array(incidencia['sites'], dtype=object)
+    
+    dark_pools = {}
+    for k, j in enumerate(ids):
+        pool = {}
+        if incidencia is not None:
+            inicio, fim = direct_csc.indptr[j], direct_csc.indptr[j + 1]
+            pool['sites'] = nomes_sites[np.repeat(direct_csc.indices[inicio:fim],
+                                                  direct_csc.data[inicio:fim])].tolist()
+        pool['n_sites'] = n_sites[k]
+        pool['categorias'] = cats_pools[k]
+        pool['tipo'] = tipos[k]
+        dark_pools[sellers[j]] = pool
+    return dark_pools
+
+def carregar_resultados_colunares(caminho: str = ARQUIVO_COLUNAR) -> Dict:
+    """Resultados completos (mesma estrutura do JSON) reconstruídos a partir do .npz"""
+    with abrir_resultados_colunares(caminho) as arquivo:
+        resumo = json.loads(arquivo['resumo.json'].tobytes().decode('utf-8'))
+        incidencia = carregar_incidencia_colunar(arquivo)
+        sites_data = carregar_sites_colunar(arquivo, incidencia=incidencia)
+        for nome, descobertos in carregar_descobertos_colunar(arquivo).items():
+            sites_data[nome]['sellers_descobertos'] = descobertos
+        dark_pools = carregar_pools_colunar(arquivo, incidencia)
+    
+    return {
+        'metadata': resumo['metadata'],
+        'sites': sites_data,
+        'dark_pools': {
+            'total': len(dark_pools),
+            'pools': dark_pools,
+            'composicao': resumo['composicao']
+        },
+        'estatisticas': resumo['estatisticas'],
+        'testes': resumo['testes'],
+        'testes_reamostragem': resumo.get('testes_reamostragem', {})
+    }
+
+# ============================================================================
+# ATUALIZAÇÃO INCREMENTAL (RECOLETA)
+# ============================================================================
+
+def impressao_grupos(grupos_editoriais: Dict) -> str:
+    """Hash dos grupos editoriais, gravado no metadata: o snapshot só serve a --incremental com os mesmos grupos"""
+    conteudo = json.dumps({grupo: sorted(dominios) for grupo, dominios in grupos_editoriais.items()},
+                          sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:16]
+
+class IndiceInvertido:
+    """
+    Índice seller -> {site: nº de ocorrências} dos sellers DIRECT, com a primeira aparição de cada seller.
+    
+    Do .npz vêm a incidência DIRECT por seller (CSC) e o site/posição da
+    primeira aparição: cada seller é lido dos arrays só quando consultado e
+    o que a recoleta altera fica em dicionários por cima deles, sem remontar
+    o índice a cada execução. de_sites monta tudo a partir das listas de
+    sellers (snapshot em JSON ou .npz sem o índice).
+    """
+    
+    def __init__(self, dicionario: DicionarioSellers, sites: List[str], indptr: np.ndarray = None,
+                 indices: np.ndarray = None, data: np.ndarray = None, primeira_site: np.ndarray = None,
+                 primeira_posicao: np.ndarray = None):
+        self.dicionario = dicionario
+        self.sites = sites
+        self._indptr = indptr
+        self._indices = indices
+        self._data = data
+        self._primeira_site = primeira_site
+        self._primeira_posicao = primeira_posicao
+        self._alterados = {}
+        self._primeira = {}
+    
+    @classmethod
+    def do_arquivo(cls, arquivo, incidencia: Dict) -> 'IndiceInvertido':
+        """Índice gravado por salvar_resultados_colunares (None se o .npz não o tem)"""
+        if 'indice.DIRECT.indptr' not in arquivo.files:
+            return None
+        return cls(incidencia['dicionario'], incidencia['sites'],
+                   *(arquivo[f'indice.DIRECT.{coluna}'] for coluna in
+                     ('indptr', 'indices', 'data', 'primeira_site', 'primeira_posicao')))
+    
+    @classmethod
+    def de_sites(cls, sites_data: Dict) -> 'IndiceInvertido':
+        indice = cls(DicionarioSellers(), [])
+        for nome, data in sites_data.items():
+            if not data.get('sucesso'):
+                continue
+            for posicao, seller in enumerate(data['sellers']['DIRECT']):
+                sites = indice._alterados.setdefault(seller, {})
+                sites[nome] = sites.get(nome, 0) + 1
+                indice._primeira.setdefault(seller, (nome, posicao))
+        return indice
+    
+    def sites_de(self, seller: str) -> Dict[str, int]:
+        """{site: ocorrências} do seller (não alterar: use atualizar)"""
+        sites = self._alterados.get(seller)
+        if sites is not None:
+            return sites
+        j = self.dicionario.ids.get(seller)
+        if j is None or self._indptr is None:
+            return {}
+        inicio, fim = self._indptr[j], self._indptr[j + 1]
+        return {self.sites[i]: vezes for i, vezes in
+                zip(self._indices[inicio:fim].tolist(), self._data[inicio:fim].tolist())}
+    
+    def atualizar(self, seller: str, nome: str, vezes: int):
+        """Ocorrências do seller no site nome (0 remove)"""
+        sites = self._alterados.get(seller)
+        if sites is None:
+            sites = self._alterados[seller] = dict(self.sites_de(seller))
+        if vezes:
+            sites[nome] = vezes
+        else:
+            sites.pop(nome, None)
+    
+    def primeira(self, seller: str) -> Tuple[str, int]:
+        """(site, posição na lista DIRECT do site) da primeira aparição; None se o seller não aparece"""
+        if seller in self._primeira:
+            return self._primeira[seller]
+        j = self.dicionario.ids.get(seller)
+        if j is None or self._primeira_site is None or self._primeira_site[j] < 0:
+            return None
+        return self.sites[self._primeira_site[j]], int(self._primeira_posicao[j])
+    
+    def definir_primeira(self, seller: str, primeira: Tuple[str, int]):
+        self._primeira[seller] = primeira
+
+def carregar_snapshot(caminho: str = ARQUIVO_COLUNAR) -> Dict:
+    """
+    Carrega os resultados de uma execução anterior (.npz colunar ou JSON completo).
+    
+    Do .npz com índice invertido vêm só as tabelas de sites e pools, a
+    incidência DIRECT (para comparar cada site) e o índice: as listas de
+    sellers não são remontadas. .npz sem o índice (anterior a ele) é lido por
+    inteiro. JSON gravado com --json resumo não tem as listas de sellers que a
+    comparação precisa: levanta ValueError.
+    """
+    if caminho.endswith('.npz'):
+        with abrir_resultados_colunares(caminho) as arquivo:
+            if 'indice.DIRECT.indptr' in arquivo.files:
+                resumo = json.loads(arquivo['resumo.json'].tobytes().decode('utf-8'))
+                incidencia = carregar_incidencia_colunar(arquivo, tipos=('DIRECT',))
+                return {
+                    'metadata': resumo['metadata'],
+                    'sites': carregar_sites_colunar(arquivo),
+                    'dark_pools': {'pools': carregar_pools_colunar(arquivo, incidencia)},
+                    'incidencia': incidencia,
+                    'indice': IndiceInvertido.do_arquivo(arquivo, incidencia)
+                }
+        return carregar_resultados_colunares(caminho)
+    with open(caminho, 'r', encoding='utf-8') as f:
+        anterior = json.load(f)
+    if any(data.get('sucesso') and 'sellers' not in data for data in anterior['sites'].values()):
+        raise ValueError(f"{caminho} não tem as listas de sellers (JSON gravado com --json resumo); "
+                         f"use o {ARQUIVO_COLUNAR} ou um JSON gravado com --json completo")
+    return anterior
+
+def motivo_analise_completa(anterior: Dict, sites_data: Dict, grupos_editoriais: Dict) -> str:
+    """Por que o snapshot não serve à atualização incremental ('' se serve)"""
+    if anterior['metadata'].get('grupos_editoriais') != impressao_grupos(grupos_editoriais):
+        return "grupos editoriais diferentes dos do snapshot (ou snapshot sem a impressão dos grupos)"
+    # A ordem dos pools reaproveitada do snapshot supõe os sites em comum na mesma ordem relativa
+    posicao = {nome: i for i, nome in enumerate(sites_data)}
+    em_comum = [posicao[nome] for nome in anterior['sites'] if nome in posicao]
+    if any(b < a for a, b in zip(em_comum, em_comum[1:])):
+        return "a ordem dos sites mudou desde o snapshot"
+    return ""
+
+def _direct_do_site(data: Dict) -> Counter:
+    """Multiconjunto de sellers DIRECT de um site (vazio se a coleta falhou)"""
+    if not data.get('sucesso'):
+        return Counter()
+    return Counter(data['sellers']['DIRECT'])
+
+def _direct_anterior(anterior: Dict, nome: str) -> Counter:
+    """_direct_do_site no snapshot: das listas (JSON) ou da linha do site na incidência DIRECT (.npz)"""
+    data = anterior['sites'].get(nome, {})
+    if not data.get('sucesso') or 'sellers' in data:
+        return _direct_do_site(data)
+    incidencia = anterior['incidencia']
+    i = incidencia['indice_sites'][nome]
+    direct = incidencia['DIRECT']
+    inicio, fim = direct.indptr[i], direct.indptr[i + 1]
+    sellers = incidencia['dicionario'].sellers
+    return Counter({sellers[j]: vezes for j, vezes in
+                    zip(direct.indices[inicio:fim].tolist(), direct.data[inicio:fim].tolist())})
+
+def _inserir_ordenado(lista: List, item, chave: Callable):
+    """Insere item em lista já ordenada por chave (chave calculada só nos elementos visitados)"""
+    valor = chave(item)
+    inicio, fim = 0, len(lista)
+    while inicio < fim:
+        meio = (inicio + fim) // 2
+        if chave(lista[meio]) <= valor:
+            inicio = meio + 1
+        else:
+            fim = meio
+    lista.insert(inicio, item)
+
+def atualizar_incremental(anterior: Dict, sites_data: Dict, grupos_editoriais: Dict) -> Tuple[Dict, Dict]:
+    """
+    Recalcula dark pools e métricas só onde a recoleta mudou algo.
+    
+    Compara o DIRECT de cada site com o snapshot anterior, aplica as
+    diferenças no índice seller -> sites do snapshot (IndiceInvertido),
+    reclassifica apenas os sellers tocados e recalcula as métricas apenas dos
+    sites afetados (os demais herdam 'metricas' do snapshot). Os pools ficam
+    na ordem da análise completa (primeira aparição) reposicionando só os que
+    surgiram ou cuja primeira aparição pode ter mudado. Supõe os mesmos grupos
+    editoriais e a mesma ordem relativa dos sites (motivo_analise_completa).
+    Retorna (dark_pools, mudancas).
+    """
+    sites_anteriores = anterior['sites']
+    pools_anteriores = anterior['dark_pools']['pools']
+    indice = anterior.get('indice') or IndiceInvertido.de_sites(sites_anteriores)
+    
+    # 1. Diferenças por site, aplicadas no índice invertido
+    sites_alterados = []
+    sellers_tocados = set()
+    sellers_reposicionar = set()
+    for nome in list(sites_data) + [n for n in sites_anteriores if n not in sites_data]:
+        novo = sites_data.get(nome, {})
+        antigo = sites_anteriores.get(nome, {})
+        direct_novo = _direct_do_site(novo)
+        direct_antigo = _direct_anterior(anterior, nome)
+        
+        mudou_site = (novo.get('domain'), novo.get('cat')) != (antigo.get('domain'), antigo.get('cat'))
+        if direct_novo == direct_antigo and not mudou_site:
+            continue
+        
+        sites_alterados.append(nome)
+        afetados = set(direct_novo) | set(direct_antigo)
+        # Com a lista do site mudada, a posição da primeira aparição de qualquer seller dela pode mudar
+        sellers_reposicionar |= afetados
+        if not mudou_site:
+            afetados = {s for s in afetados if direct_novo[s] != direct_antigo[s]}
+        
+        for seller in afetados:
+            indice.atualizar(seller, nome, direct_novo[seller])
+        sellers_tocados |= afetados
+    
+    # 2. Reclassificar apenas os sellers tocados
+    posicao = {nome: i for i, nome in enumerate(sites_data)}
+    dark_pools = dict(pools_anteriores)
+    mudancas = {'surgiram': [], 'desapareceram': [], 'alterados': [], 'sites_alterados': sites_alterados}
+    
+    for seller in sorted(sellers_tocados):
+        ocorrencias = sorted(indice.sites_de(seller).items(), key=lambda x: posicao[x[0]])
+        sites = [nome for nome, vezes in ocorrencias for _ in range(vezes)]
+        pool = _classificar_pool(sites, sites_data, grupos_editoriais)
+        antes = dark_pools.get(seller)
+        
+        if pool is None:
+            if antes is not None:
+                del dark_pools[seller]
+                mudancas['desapareceram'].append(seller)
+        elif antes is None:
+            dark_pools[seller] = pool
+            mudancas['surgiram'].append(seller)
+        else:
+            dark_pools[seller] = pool
+            if (antes['sites'], antes['tipo']) != (pool['sites'], pool['tipo']):
+                mudancas['alterados'].append({
+                    'seller': seller,
+                    'antes': {'n_sites': antes['n_sites'], 'tipo': antes['tipo']},
+                    'depois': {'n_sites': pool['n_sites'], 'tipo': pool['tipo']}
+                })
+    
+    # 3. Reavaliar métricas: sites alterados + sites de pools que surgiram/desapareceram
+    reavaliar = set(sites_alterados)
+    for seller in mudancas['surgiram'] + mudancas['desapareceram']:
+        reavaliar.update(indice.sites_de(seller))
+    
+    sellers_pools = set(dark_pools)
+    for nome, data in sites_data.items():
+        if not data['sucesso'] or 'metricas' in data:
+            continue
+        if nome in reavaliar or 'metricas' not in sites_anteriores.get(nome, {}):
+            data['metricas'] = calcular_metricas_site(data['sellers'], sellers_pools)
+        else:
+            data['metricas'] = sites_anteriores[nome]['metricas']
+    
+    mudancas['sites_reavaliados'] = len(reavaliar)
+    
+    # 4. Ordem da análise completa (primeira aparição do seller no DIRECT, site a site): os pools
+    # do snapshot já estão nela; só os reposicionados têm a primeira aparição refeita e são inseridos
+    reposicionar = [seller for seller in sellers_reposicionar if seller in dark_pools]
+    posicoes_na_lista = {}
+    for seller in reposicionar:
+        nome = min(indice.sites_de(seller), key=posicao.__getitem__)
+        if nome not in posicoes_na_lista:
+            posicoes_na_lista[nome] = {}
+            for k, s in enumerate(sites_data[nome]['sellers']['DIRECT']):
+                posicoes_na_lista[nome].setdefault(s, k)
+        indice.definir_primeira(seller, (nome, posicoes_na_lista[nome][seller]))
+    
+    def chave(seller):
+        nome, posicao_na_lista = indice.primeira(seller)
+        return posicao[nome], posicao_na_lista
+    
+    mover = set(reposicionar)
+    ordem = [seller for seller in pools_anteriores if seller in dark_pools and seller not in mover]
+    for seller in sorted(mover, key=chave):
+        _inserir_ordenado(ordem, seller, chave)
+    return {seller: dark_pools[seller] for seller in ordem}, mudancas
+
 # ============================================================================
 # PIPELINE PRINCIPAL
 # ============================================================================
 
-def executar_analise_completa():
-    """Executa toda a análise e salva resultados"""
+def executar_analise_completa(cache: CacheHTTP = None, anterior: Dict = None,
+                              checkpoint: CheckpointColeta = None, retomar: bool = False,
+                              offline: bool = False, sites: Iterable[Dict] = None,
+                              grupos_editoriais: Dict = None, n_processos: int = 1,
+                              exportar_json: str = 'resumo', json_compacto: bool = False,
+                              comprimir: bool = False, jsonl: bool = False,
+                              n_aleatorizacoes: int = N_ALEATORIZACOES, n_reamostras: int = N_REAMOSTRAS,
+                              historico: RepositorioSnapshots = None,
+                              instrumentacao: Instrumentacao = None, cortesia: bool = True,
+                              taxa_por_grupo: float = TAXA_POR_GRUPO, variantes: MemoVariantes = None,
+                              profundidade_referencias: int = PROFUNDIDADE_REFERENCIAS):
+    """
+    Executa toda a análise e salva resultados (incremental se houver snapshot anterior)
+    
+    Com checkpoint, cada site coletado é gravado no log; retomar pula os sites
+    já coletados com sucesso (as falhas registradas são recoletadas) e offline
+    usa apenas o checkpoint, com sucessos e falhas, sem acessar a rede (nos
+    dois casos, só os sites da lista atual, na ordem dela).
+    sites pode ser um iterável em streaming (ler_lista_sites); padrão: SITES.
+    Com n_processos > 1 a coleta é dividida entre processos trabalhadores.
+    Os resultados vão para o .npz colunar; exportar_json escolhe o JSON
+    adicional: 'resumo' (sem as listas de sellers), 'completo' ou 'nenhum',
+    gravado em streaming (json_compacto sem indentação, comprimir em .gz);
+    jsonl grava também um registro por site e por pool. n_aleatorizacoes
+    controla o modelo nulo dos pools e n_reamostras os testes por
+    bootstrap/permutação (0 desliga cada um). Com historico, cada ads.txt
+    coletado é registrado no repositório de snapshots (execução = início).
+    Tempo e memória de cada etapa e a latência da coleta vão para
+    metadata['instrumentacao'] (instrumentacao padrão: sem tracemalloc, sem
+    latência por fase e sem trace); nos arquivos gravados ela vai até a etapa
+    composicao, e o metadata retornado inclui também a gravação (salvar).
+    cortesia e taxa_por_grupo controlam o escalonador da coleta por grupo de
+    hospedagem (ver coletar_sites). Com variantes, a URL que serviu o ads.txt
+    de cada site vai para o registro (url_adstxt) e o memo é gravado ao fim
+    da coleta. As referências dos ads.txt (subdomain=, OWNERDOMAIN=, ...) são
+    seguidas até profundidade_referencias saltos (0 desliga) e os sellers
+    encontrados vão para sellers_descobertos de cada site, fora da análise.
+    Montada a incidência, as listas de sellers saem de sites_data (ficam só
+    com exportar_json='completo').
+    """
+    if sites is None:
+        sites = SITES
+    if grupos_editoriais is None:
+        grupos_editoriais = GRUPOS_EDITORIAIS
+    if instrumentacao is None:
+        instrumentacao = Instrumentacao()
+    total_entrada = len(sites) if hasattr(sites, '__len__') else None
     
     print("="*80)
     print("ANÁLISE DARK POOLING - EXECUÇÃO COMPLETA")
     print("="*80)
-    print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"Sites a analisar: {len(SITES)}")
+    inicio = datetime.now()
+    execucao = inicio.isoformat(timespec='seconds')
+    print(f"Início: {inicio.strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Sites a analisar: {total_entrada if total_entrada is not None else 'lista em streaming'}")
     print()
     
     # ========================================
@@ -374,46 +3366,128 @@ def executar_analise_completa():
     # ========================================
     print("[1/5] Coletando ads.txt...")
     print("-"*80)
+    instrumentacao.etapa('coleta')
     
     sites_data = {}
+    coletados = {}
+    if checkpoint and (retomar or offline):
+        coletados = checkpoint.carregar()
+        print(f"Checkpoint: {len(coletados)} sites já coletados")
+        if not offline:
+            # Falhas registradas (timeout, 5xx, ...) são tentadas de novo; só os sucessos são pulados
+            coletados = {nome: data for nome, data in coletados.items() if data['sucesso']}
+            print(f"  {len(coletados)} com sucesso; as falhas serão recoletadas")
+    
+    # Posição de cada site na entrada, registrada à medida que a lista é lida
+    ordem = {}
+    
+    def pendentes(sites):
+        # Sites do checkpoint entram em sites_data só se estão na lista atual
+        for site in sites:
+            nome = site['name']
+            ordem.setdefault(nome, len(ordem))
+            if nome in coletados:
+                sites_data[nome] = coletados[nome]
+            else:
+                yield site
+    
+    def registrar_historico(site, resultado):
+        if historico:
+            sucesso, sellers, erro = resultado
+            historico.registrar(site['domain'], sellers if sucesso else None,
+                                cache.corpo(site['domain']) if cache and sucesso else None,
+                                execucao=execucao, erro=erro)
     
-    for i, site in enumerate(SITES, 1):
+    def coletar_referencias(fonte, ao_concluir):
+        # Os ads.txt das referências também vão para o histórico e para a instrumentação
+        def concluir(site, resultado):
+            registrar_historico(site, resultado)
+            ao_concluir(site, resultado)
+        coletar_sites(fonte, concluir, cache=cache, instrumentacao=instrumentacao, cortesia=cortesia,
+                      taxa_por_grupo=taxa_por_grupo, variantes=variantes,
+                      chave_grupos='grupos_hospedagem_referencias')
+    
+    def registrar_coleta(site, resultado):
         nome = site['name']
         domain = site['domain']
-        cat = site['cat']
-        
-        print(f"{i:2}/{len(SITES)} {nome:40}", end=" ", flush=True)
-        
-        sucesso, linhas, erro = coletar_adstxt(domain)
+        sucesso, sellers, erro = resultado
         
+        sites_data[nome] = registro_coleta(site, resultado, variantes.url(domain) if variantes is not None else None)
         if sucesso:
-            sellers = parsear_adstxt(linhas)
-            n_direct = len(sellers['DIRECT'])
-            n_reseller = len(sellers['RESELLER'])
+            status = f"✓ ({sites_data[nome]['n_direct_raw']} DIRECT, {sites_data[nome]['n_reseller_raw']} RESELLER)"
+            if cache and domain in cache.servidos:
+                status += " [cache]"
+        else:
+            status = f"✗ {erro}"
+        
+        if checkpoint:
+            checkpoint.registrar(nome, sites_data[nome])
+        registrar_historico(site, resultado)
+        progresso = f"{len(sites_data):2}/{total_entrada}" if total_entrada is not None else f"{len(sites_data):6}"
+        print(f"{progresso} {nome:40} {status}", flush=True)
+    
+    dicionario = None
+    resumo_referencias = None
+    if offline:
+        for _ in pendentes(sites):
+            pass
+    else:
+        try:
+            if n_processos > 1:
+                dicionario = coletar_sites_multiprocesso(pendentes(sites), registrar_coleta, n_processos,
+                                                         cache_dir=cache.diretorio if cache else None,
+                                                         instrumentacao=instrumentacao, cortesia=cortesia,
+                                                         taxa_por_grupo=taxa_por_grupo, variantes=variantes)
+            else:
+                coletar_sites(pendentes(sites), registrar_coleta, cache=cache, instrumentacao=instrumentacao,
+                              cortesia=cortesia, taxa_por_grupo=taxa_por_grupo, variantes=variantes)
             
-            sites_data[nome] = {
-                'domain': domain,
-                'cat': cat,
-                'sucesso': True,
-                'sellers': sellers,
-                'n_direct_raw': n_direct,
-                'n_reseller_raw': n_reseller
-            }
+            # Restaurar a ordem da lista de entrada (a coleta termina fora de ordem)
+            sites_data = {nome: sites_data[nome]
+                          for nome in sorted(sites_data, key=lambda n: ordem.get(n, len(ordem)))}
             
-            print(f"✓ ({n_direct} DIRECT, {n_reseller} RESELLER)")
-        else:
-            sites_data[nome] = {
-                'domain': domain,
-                'cat': cat,
-                'sucesso': False,
-                'erro': erro
-            }
-            print(f"✗ {erro}")
+            if profundidade_referencias > 0:
+                fronteira = FronteiraReferencias(profundidade_referencias)
+                fronteira.seguir(sites_data, coletar_referencias)
+                alterados = fronteira.anexar(sites_data)
+                # O checkpoint fica com a versão final dos sites (a última linha de cada nome vale)
+                if checkpoint:
+                    for nome in alterados:
+                        checkpoint.registrar(nome, sites_data[nome])
+                resumo_referencias = fronteira.resumo()
+                print(f"Referências seguidas: {resumo_referencias['dominios_seguidos']} domínios "
+                      f"({resumo_referencias['com_adstxt']} com ads.txt), "
+                      f"{len(alterados)} sites com sellers descobertos")
+        finally:
+            if checkpoint:
+                checkpoint.fechar()
+            if variantes is not None:
+                variantes.salvar()
+            if historico:
+                historico.fechar()
+    
+    total_sites = len(sites_data)
     
     # Resumo coleta
     sucesso_total = sum(1 for s in sites_data.values() if s['sucesso'])
     print()
-    print(f"Taxa de sucesso: {sucesso_total}/{len(SITES)} ({100*sucesso_total/len(SITES):.1f}%)")
+    print(f"Taxa de sucesso: {sucesso_total}/{total_sites} ({100*sucesso_total/max(total_sites, 1):.1f}%)")
+    
+    resumo_coleta = instrumentacao.resumo().get('coleta', {})
+    latencia = resumo_coleta.get('latencia', {}).get('total', {})
+    if latencia.get('n'):
+        print(f"Latência por domínio: p50={latencia['p50_ms']:.0f}ms p95={latencia['p95_ms']:.0f}ms "
+              f"máx={latencia['max_ms']:.0f}ms")
+    if resumo_coleta.get('variantes_vencedoras'):
+        print("Variantes de URL: " + ", ".join(f"{variante} {n}"
+                                               for variante, n in resumo_coleta['variantes_vencedoras'].items()))
+    if resumo_coleta.get('grupos_hospedagem'):
+        grupos = resumo_coleta['grupos_hospedagem']
+        print(f"Grupos de hospedagem: {grupos['n_grupos']}")
+        for chave, grupo in list(grupos['grupos'].items())[:5]:
+            print(f"  {chave:20} {grupo['dominios']:5} domínios, {grupo['vazao_dominios_s'] or 0:.1f} dom/s, "
+                  f"concorrência final {grupo['concorrencia_final']}, {grupo['http_429']} × 429, "
+                  f"{grupo['timeouts']} timeouts")
     
     # ========================================
     # ETAPA 2: IDENTIFICAR DARK POOLS
@@ -421,8 +3495,31 @@ def executar_analise_completa():
     print()
     print("[2/5] Identificando dark pools...")
     print("-"*80)
+    instrumentacao.etapa('dark_pools')
     
-    dark_pools = identificar_dark_pools(sites_data, GRUPOS_EDITORIAIS)
+    def descartar_sellers():
+        # Montada a incidência, as listas de strings de cada site só servem ao JSON completo
+        if exportar_json != 'completo':
+            for data in sites_data.values():
+                data.pop('sellers', None)
+    
+    mudancas = None
+    if anterior is not None:
+        motivo = motivo_analise_completa(anterior, sites_data, grupos_editoriais)
+        if motivo:
+            print(f"AVISO: {motivo}. Executando análise completa")
+            anterior = None
+    if anterior is not None:
+        # Modo incremental: só sellers e sites tocados pela recoleta são refeitos
+        incidencia = None
+        dark_pools, mudancas = atualizar_incremental(anterior, sites_data, grupos_editoriais)
+        print(f"Sites alterados desde o snapshot: {len(mudancas['sites_alterados'])}")
+        print(f"Pools: +{len(mudancas['surgiram'])} -{len(mudancas['desapareceram'])} "
+              f"~{len(mudancas['alterados'])}")
+    else:
+        incidencia = construir_incidencia(sites_data, dicionario)
+        descartar_sellers()
+        dark_pools = identificar_dark_pools(sites_data, grupos_editoriais, incidencia)
     
     print(f"Dark pools identificados: {len(dark_pools):,}")
     
@@ -432,8 +3529,9 @@ def executar_analise_completa():
     print()
     print("[3/5] Calculando métricas por site...")
     print("-"*80)
+    instrumentacao.etapa('metricas')
     
-    stats_cat = calcular_estatisticas_categoria(sites_data, dark_pools)
+    stats_cat = calcular_estatisticas_categoria(sites_data, dark_pools, incidencia)
     
     for cat in ['FC', 'HP', 'MS']:
         if stats_cat[cat]['n'] > 0:
@@ -447,6 +3545,7 @@ def executar_analise_completa():
     print()
     print("[4/5] Executando testes estatísticos...")
     print("-"*80)
+    instrumentacao.etapa('testes')
     
     testes = executar_testes_estatisticos(sites_data)
     
@@ -454,18 +3553,43 @@ def executar_analise_completa():
         print(f"{nome}: {resultado['teste']} p={resultado['p']:.4f} "
               f"{'*' if resultado['significativo'] else '(ns)'}")
     
+    testes_reamostragem = {}
+    if n_reamostras > 0:
+        testes_reamostragem = executar_testes_reamostragem(sites_data, n_reamostras, n_processos)
+        for nome, resultado in testes_reamostragem.items():
+            if nome == 'n_reamostras':
+                continue
+            permutacao = resultado.get('permutacao_diferenca_medias') or resultado['permutacao_kruskal']
+            print(f"{nome}: permutação ({permutacao['permutacao']}, {permutacao['n_permutacoes']}) "
+                  f"p={permutacao['p']:.4f} {'*' if resultado['significativo'] else '(ns)'}")
+    
     # ========================================
     # ETAPA 5: ANALISAR COMPOSIÇÃO POOLS
     # ========================================
     print()
     print("[5/5] Analisando composição de pools...")
     print("-"*80)
+    instrumentacao.etapa('composicao')
     
     composicao = analisar_composicao_pools(dark_pools)
     
     for tipo, count in sorted(composicao['por_tipo'].items(), key=lambda x: x[1], reverse=True):
         print(f"{tipo}: {count} pools")
     
+    # Significância contra o modelo nulo (no modo incremental a incidência é montada aqui)
+    if incidencia is None:
+        incidencia = construir_incidencia(sites_data)
+        descartar_sellers()
+    if n_aleatorizacoes > 0 and incidencia['DIRECT'].nnz > 0:
+        nulo = testar_modelo_nulo(incidencia, grupos_editoriais, n_aleatorizacoes, n_processos)
+        composicao['modelo_nulo'] = nulo
+        print(f"Modelo nulo ({n_aleatorizacoes} aleatorizações que preservam graus):")
+        print(f"  testa: {nulo['testa']}")
+        for tipo, r in nulo['por_tipo'].items():
+            if r['observado'] is not None:
+                print(f"  {tipo}: obs={r['observado']:.0f} nulo={r['media_nula']:.1f}±{r['dp_nula']:.1f} "
+                      f"z={r['z'] if r['z'] is not None else 'NA'} p={r['p']:.4f}")
+    
     # ========================================
     # SALVAR RESULTADOS
     # ========================================
@@ -473,22 +3597,23 @@ def executar_analise_completa():
     print("="*80)
     print("SALVANDO RESULTADOS...")
     print("="*80)
+    # A instrumentação gravada cobre as etapas já encerradas; a própria gravação só entra no retorno
+    instrumentacao.encerrar()
     
-    # Contar sellers únicos totais
-    all_direct = set()
-    all_reseller = set()
-    for site in sites_data.values():
-        if site['sucesso']:
-            all_direct.update(site['sellers']['DIRECT'])
-            all_reseller.update(site['sellers']['RESELLER'])
+    # Contar sellers únicos totais (colunas não vazias de cada matriz)
+    n_direct_unicos = len(incidencia['ordem']['DIRECT'])
+    n_reseller_unicos = len(incidencia['ordem']['RESELLER'])
     
     resultados = {
         'metadata': {
             'timestamp': datetime.now().isoformat(),
-            'total_sites': len(SITES),
+            'total_sites': total_sites,
             'sites_com_adstxt': sucesso_total,
-            'sellers_direct_unicos': len(all_direct),
-            'sellers_reseller_unicos': len(all_reseller)
+            'sellers_direct_unicos': n_direct_unicos,
+            'sellers_reseller_unicos': n_reseller_unicos,
+            'referencias': resumo_referencias,
+            'grupos_editoriais': impressao_grupos(grupos_editoriais),
+            'instrumentacao': instrumentacao.resumo()
         },
         'sites': sites_data,
         'dark_pools': {
@@ -497,16 +3622,57 @@ def executar_analise_completa():
             'composicao': composicao
         },
         'estatisticas': stats_cat,
-        'testes': testes
+        'testes': testes,
+        'testes_reamostragem': testes_reamostragem
     }
+    instrumentacao.etapa('salvar')
+    
+    # Salvar tabelas colunares
+    salvar_resultados_colunares(ARQUIVO_COLUNAR, sites_data, incidencia, dark_pools, {
+        'metadata': resultados['metadata'],
+        'composicao': composicao,
+        'estatisticas': stats_cat,
+        'testes': testes,
+        'testes_reamostragem': testes_reamostragem
+    })
+    print(f"✓ {ARQUIVO_COLUNAR}")
     
-    # Salvar JSON
-    # Converter tipos numpy para Python
-    resultados_convertidos = converter_numpy_para_python(resultados)
+    # Salvar JSON (opcional; o resumo omite as listas de sellers de cada site)
+    def sites_exportados():
+        for nome, data in sites_data.items():
+            if exportar_json == 'completo':
+                yield nome, data
+                continue
+            resumo_site = {k: v for k, v in data.items() if k not in ('sellers', 'sellers_descobertos')}
+            if 'sellers_descobertos' in data:
+                resumo_site['sellers_descobertos'] = [
+                    {'domain': d['domain'], 'cadeia': d['cadeia'],
+                     'n_direct': len(d['DIRECT']), 'n_reseller': len(d['RESELLER'])}
+                    for d in data['sellers_descobertos']
+                ]
+            yield nome, resumo_site
     
-    with open('resultados_completos.json', 'w', encoding='utf-8') as f:
-        json.dump(resultados_convertidos, f, indent=2, ensure_ascii=False)
-    print("✓ resultados_completos.json")
+    if exportar_json != 'nenhum':
+        # Escrita em streaming, seção por seção (tipos numpy convertidos pelo encoder)
+        escritor = EscritorJSON('resultados_completos.json', compacto=json_compacto, comprimir=comprimir)
+        with escritor:
+            escritor.secao('metadata', resultados['metadata'])
+            escritor.secao_mapeamento('sites', sites_exportados())
+            escritor.secao('dark_pools', resultados['dark_pools'])
+            escritor.secao('estatisticas', stats_cat)
+            escritor.secao('testes', testes)
+            escritor.secao('testes_reamostragem', testes_reamostragem)
+        print(f"✓ {os.path.basename(escritor.arquivo.name)}")
+    
+    if jsonl:
+        for caminho, chave, itens in (('resultados_sites.jsonl', 'site', sites_exportados()),
+                                      ('resultados_pools.jsonl', 'seller', dark_pools.items())):
+            print(f"✓ {os.path.basename(salvar_jsonl(caminho, chave, itens, comprimir))}")
+    
+    if mudancas is not None:
+        with open('mudancas_dark_pools.json', 'w', encoding='utf-8') as f:
+            json.dump(mudancas, f, indent=2, ensure_ascii=False)
+        print("✓ mudancas_dark_pools.json")
     
     # Salvar relatório texto
     with open('relatorio_executivo.txt', 'w', encoding='utf-8') as f:
@@ -515,10 +3681,10 @@ def executar_analise_completa():
         f.write("="*80 + "\n\n")
         
         f.write("AMOSTRA:\n")
-        f.write(f"  Sites analisados: {len(SITES)}\n")
-        f.write(f"  Com ads.txt válido: {sucesso_total} ({100*sucesso_total/len(SITES):.1f}%)\n")
-        f.write(f"  Sellers DIRECT únicos: {len(all_direct):,}\n")
-        f.write(f"  Sellers RESELLER únicos: {len(all_reseller):,}\n\n")
+        f.write(f"  Sites analisados: {total_sites}\n")
+        f.write(f"  Com ads.txt válido: {sucesso_total} ({100*sucesso_total/max(total_sites, 1):.1f}%)\n")
+        f.write(f"  Sellers DIRECT únicos: {n_direct_unicos:,}\n")
+        f.write(f"  Sellers RESELLER únicos: {n_reseller_unicos:,}\n\n")
         
         f.write("DARK POOLS:\n")
         f.write(f"  Total identificados: {len(dark_pools):,}\n")
@@ -526,6 +3692,16 @@ def executar_analise_completa():
             f.write(f"    {tipo}: {count}\n")
         f.write("\n")
         
+        if 'modelo_nulo' in composicao:
+            nulo = composicao['modelo_nulo']
+            f.write(f"MODELO NULO ({nulo['n_aleatorizacoes']} aleatorizações, graus preservados, incidência binária):\n")
+            f.write(f"  Testa: {nulo['testa']}\n")
+            for tipo, r in list(nulo['por_tipo'].items()) + [('assortatividade', nulo['assortatividade'])]:
+                if r['observado'] is not None:
+                    f.write(f"    {tipo}: obs={r['observado']} nulo={r['media_nula']}±{r['dp_nula']} "
+                            f"z={r['z']} p={r['p']}\n")
+            f.write("\n")
+        
         f.write("ESTATÍSTICAS POR CATEGORIA:\n")
         for cat in ['FC', 'HP', 'MS']:
             if stats_cat[cat]['n'] > 0:
@@ -542,6 +3718,18 @@ def executar_analise_completa():
             f.write(f"  {nome}: p={resultado['p']:.4f} ")
             f.write(f"{'(significativo)' if resultado['significativo'] else '(não significativo)'}\n")
         
+        if testes_reamostragem:
+            f.write(f"\n  Reamostragem ({testes_reamostragem['n_reamostras']} reamostras):\n")
+            for nome, resultado in testes_reamostragem.items():
+                if nome == 'n_reamostras':
+                    continue
+                permutacao = resultado.get('permutacao_diferenca_medias') or resultado['permutacao_kruskal']
+                f.write(f"  {nome}: p(permutação {permutacao['permutacao']})={permutacao['p']:.4f}")
+                if 'diferenca_medias' in resultado:
+                    f.write(f", diferença de médias FC-MS={resultado['diferenca_medias']['observado']} "
+                            f"IC95%={resultado['diferenca_medias']['ic95']}")
+                f.write("\n")
+        
         f.write("\n\nTOP 10 SELLERS MAIS COMPARTILHADOS:\n")
         for i, seller_data in enumerate(composicao['top_20_sellers'][:10], 1):
             f.write(f"  {i:2}. {seller_data['seller']:50} ({seller_data['n_sites']} sites)\n")
@@ -555,10 +3743,20 @@ def executar_analise_completa():
     print(f"Fim: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print()
     print("Arquivos gerados:")
-    print("  - resultados_completos.json (todos os dados)")
+    print(f"  - {ARQUIVO_COLUNAR} (todos os dados, colunar)")
+    if exportar_json != 'nenhum':
+        print(f"  - resultados_completos.json ({exportar_json})")
     print("  - relatorio_executivo.txt (resumo legível)")
     print()
     
+    instrumentacao.finalizar()
+    resultados['metadata']['instrumentacao'] = instrumentacao.resumo()
+    print("Tempo por etapa:")
+    for etapa, medida in instrumentacao.etapas.items():
+        memoria = f", pico alocado {medida['pico_alocado_mb']:.1f} MB" if 'pico_alocado_mb' in medida else ''
+        print(f"  {etapa:12} {medida['tempo_s']:9.2f} s  (RSS {medida.get('rss_mb', 0):.0f} MB{memoria})")
+    print()
+    
     return resultados
 
 # ============================================================================
@@ -566,10 +3764,96 @@ def executar_analise_completa():
 # ============================================================================
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Análise de dark pooling em ads.txt")
+    parser.add_argument('--incremental', nargs='?', const=ARQUIVO_COLUNAR, metavar='SNAPSHOT',
+                        help=f"recalcula só o que mudou desde o snapshot (padrão: {ARQUIVO_COLUNAR}; "
+                             "aceita também um resultados_completos.json completo)")
+    parser.add_argument('--checkpoint', default='coleta_checkpoint.jsonl',
+                        help="log da coleta, gravado a cada domínio concluído")
+    parser.add_argument('--resume', action='store_true',
+                        help="retoma a coleta pulando os domínios já coletados com sucesso no checkpoint (as falhas são recoletadas)")
+    parser.add_argument('--offline', action='store_true',
+                        help="não coleta: analisa o que já está no checkpoint")
+    parser.add_argument('--sites', metavar='ARQUIVO',
+                        help="CSV/TSV (.gz) com domínio, categoria e nome, lido em streaming (padrão: SITES)")
+    parser.add_argument('--grupos', metavar='ARQUIVO',
+                        help="CSV/TSV com grupo e domínio (padrão: GRUPOS_EDITORIAIS)")
+    parser.add_argument('--categoria-padrao', default='NA',
+                        help="categoria para linhas de --sites sem categoria")
+    parser.add_argument('--processos', type=int, default=1,
+                        help="divide a coleta (fila compartilhada), o modelo nulo e as reamostragens entre N processos")
+    parser.add_argument('--aleatorizacoes', type=int, default=N_ALEATORIZACOES,
+                        help="aleatorizações do modelo nulo da composição dos pools (padrão 0: desligado; ex.: 1000)")
+    parser.add_argument('--historico', default='historico_adstxt', metavar='DIRETORIO',
+                        help="repositório de snapshots onde cada ads.txt coletado é guardado")
+    parser.add_argument('--sem-historico', action='store_true',
+                        help="não registra a coleta no repositório de snapshots")
+    parser.add_argument('--reamostras', type=int, default=N_REAMOSTRAS,
+                        help="reamostras dos testes por bootstrap/permutação (0 desliga)")
+    parser.add_argument('--json', choices=('resumo', 'completo', 'nenhum'), default='resumo',
+                        help="JSON exportado além do .npz: resumo sem listas de sellers (padrão), completo ou nenhum")
+    parser.add_argument('--json-compacto', action='store_true',
+                        help="JSON sem indentação")
+    parser.add_argument('--gzip', action='store_true',
+                        help="grava os JSON/JSONL comprimidos (.gz)")
+    parser.add_argument('--jsonl', action='store_true',
+                        help="exporta também resultados_sites.jsonl e resultados_pools.jsonl (um registro por linha)")
+    parser.add_argument('--sem-cortesia', action='store_true',
+                        help="coleta sem o escalonador por grupo de hospedagem (só os limites de conexões)")
+    parser.add_argument('--taxa-por-grupo', type=float, default=TAXA_POR_GRUPO,
+                        help=f"requisições/s por grupo de hospedagem (padrão: {TAXA_POR_GRUPO})")
+    parser.add_argument('--variantes', default='variantes_adstxt.json', metavar='ARQUIVO',
+                        help="memo da variante de URL (https/http, com ou sem www.) que serviu cada domínio")
+    parser.add_argument('--profundidade-referencias', type=int, default=PROFUNDIDADE_REFERENCIAS, metavar='N',
+                        help="saltos seguidos a partir de subdomain=/OWNERDOMAIN=/MANAGERDOMAIN=/"
+                             f"inventorypartnerdomain= (padrão: {PROFUNDIDADE_REFERENCIAS}; 0 desliga)")
+    parser.add_argument('--perfil-memoria', action='store_true',
+                        help="mede com tracemalloc o pico de memória alocada em cada etapa (mais lento)")
+    parser.add_argument('--latencia', action='store_true',
+                        help="mede DNS, conexão e espera de cada domínio da coleta (ganchos do aiohttp; ligado por --trace)")
+    parser.add_argument('--trace', metavar='ARQUIVO',
+                        help="grava etapas e requisições no formato de trace do Chrome (chrome://tracing, Perfetto)")
+    args = parser.parse_args()
+    
+    instrumentacao = Instrumentacao(memoria=args.perfil_memoria, trace=args.trace is not None,
+                                    latencia=args.latencia)
+    
     try:
-        resultados = executar_analise_completa()
+        anterior = None
+        if args.incremental:
+            if os.path.exists(args.incremental):
+                try:
+                    anterior = carregar_snapshot(args.incremental)
+                except ValueError as e:
+                    print(f"AVISO: {e}. Executando análise completa")
+            else:
+                print(f"AVISO: {args.incremental} não encontrado. Executando análise completa")
+        
+        sites = ler_lista_sites(args.sites, args.categoria_padrao) if args.sites else None
+        grupos = ler_grupos_editoriais(args.grupos) if args.grupos else None
+        
+        checkpoint = CheckpointColeta(args.checkpoint, retomar=args.resume or args.offline)
+        resultados = executar_analise_completa(cache=None if args.offline else CacheHTTP(), anterior=anterior, checkpoint=checkpoint,
+                                               retomar=args.resume, offline=args.offline,
+                                               sites=sites, grupos_editoriais=grupos,
+                                               n_processos=args.processos, exportar_json=args.json,
+                                               json_compacto=args.json_compacto, comprimir=args.gzip,
+                                               jsonl=args.jsonl, n_aleatorizacoes=args.aleatorizacoes,
+                                               n_reamostras=args.reamostras,
+                                               historico=None if args.sem_historico or args.offline
+                                               else RepositorioSnapshots(args.historico),
+                                               instrumentacao=instrumentacao, cortesia=not args.sem_cortesia,
+                                               taxa_por_grupo=args.taxa_por_grupo,
+                                               variantes=MemoVariantes(args.variantes),
+                                               profundidade_referencias=args.profundidade_referencias)
+        if args.trace:
+            instrumentacao.salvar_trace(args.trace)
+            print(f"✓ {args.trace}")
     except KeyboardInterrupt:
         print("\n\nInterrompido pelo usuário")
+        print(f"Coleta parcial salva em {args.checkpoint}; continue com --resume")
     except Exception as e:
         print(f"\n\nERRO: {e}")
         import traceback
@@ -8,18 +8,27 @@ pip install networkx python-louvain matplotlib
 EXECUÇÃO:
 1. Rode primeiro: python analise_completa_darkpools.py
 2. Depois rode: python analises_de_rede.py
+   (grafos grandes: --amostras-betweenness 512 --processos 8)
+Ou as duas partes juntas, recalculando só as etapas que mudaram:
+   python pipeline_dag.py --offline
 
-INPUT: resultados_completos.json
+INPUT: resultados_colunares.npz (ou resultados_completos.json de versões anteriores)
 OUTPUT: resultados_redes.json + figuras PNG
+CACHE: .cache_comunidades/ (partições de consenso, pela impressão do grafo)
 """
 
+import hashlib
 import json
+import multiprocessing
+import os
 import numpy as np
 import networkx as nx
 from networkx.algorithms import bipartite
 import matplotlib.pyplot as plt
-from collections import defaultdict
-from scipy import stats
+from collections import Counter, defaultdict
+from scipy import sparse, stats
+from scipy.sparse import csgraph
+from typing import Dict
 
 try:
     import community as community_louvain
@@ -31,91 +40,137 @@ except ImportError:
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 
-# ============================================================================
-# HELPERS
-# ============================================================================
-
-def converter_numpy_para_python(obj):
-    """Converte tipos numpy para tipos Python nativos (para JSON)"""
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.bool_):
-        return bool(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: converter_numpy_para_python(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [converter_numpy_para_python(item) for item in obj]
-    else:
-        return obj
+from analise_completa_darkpools import (ARQUIVO_COLUNAR, EscritorJSON, abrir_resultados_colunares,
+                                        carregar_incidencia_colunar, carregar_pools_colunar,
+                                        carregar_sites_colunar, construir_incidencia)
 
 # ============================================================================
 # CARREGAR RESULTADOS
 # ============================================================================
 
 def carregar_resultados():
-    """Carrega resultados do script principal"""
+    """
+    Carrega do script principal só o que as análises de rede usam.
+    
+    Do .npz colunar são lidas apenas as colunas necessárias (categoria,
+    sucesso, n_direct_raw, métricas, incidência DIRECT e ids dos pools).
+    Sem o .npz, cai para o resultados_completos.json de execuções antigas.
+    Retorna (sites_data, dark_pools_data, incidencia).
+    """
+    if os.path.exists(ARQUIVO_COLUNAR):
+        with abrir_resultados_colunares(ARQUIVO_COLUNAR) as arquivo:
+            incidencia = carregar_incidencia_colunar(arquivo, tipos=('DIRECT',))
+            sites_data = carregar_sites_colunar(arquivo, campos=('cat', 'n_direct_raw', 'metricas'))
+            pools = carregar_pools_colunar(arquivo)
+        return sites_data, {'total': len(pools), 'pools': pools}, incidencia
+    
     with open('resultados_completos.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
+        resultados = json.load(f)
+    sites_data = resultados['sites']
+    
+    # O JSON resumo não traz os sellers: o grafo usa então as listas de sites dos pools
+    tem_sellers = all('sellers' in data for data in sites_data.values() if data['sucesso'])
+    incidencia = construir_incidencia(sites_data) if tem_sellers else None
+    return sites_data, resultados['dark_pools'], incidencia
 
 # ============================================================================
 # ANÁLISE 1: VULNERABILIDADE
 # ============================================================================
 
-def analisar_vulnerabilidade(G, sites_data):
-    """Para cada SSP, quantos sites perderiam >50% sellers se SSP removido"""
+CENARIOS_REMOCAO = (1, 3, 5, 10)   # remover os k maiores SSPs ao mesmo tempo
+
+def matriz_site_ssp(G, sites, ssps, incidencia=None):
+    """
+    Matriz esparsa sites × SSPs com o nº de sellers DIRECT de cada site em cada SSP.
+    
+    Com a incidência, as colunas de sellers são somadas por domínio do SSP
+    (uma multiplicação por matriz de agregação seller -> SSP), contando
+    todas as entradas do ads.txt. Sem ela, cada aresta do grafo vale 1.
+    """
+    if incidencia is None:
+        return sparse.csr_matrix(bipartite.biadjacency_matrix(G, sites, ssps, weight=None), dtype=np.int64)
+    
+    posicao_ssp = {ssp: j for j, ssp in enumerate(ssps)}
+    sellers = incidencia['dicionario'].sellers
+    coluna = np.fromiter((posicao_ssp.get(s.split('#')[0], -1) for s in sellers), dtype=np.int64, count=len(sellers))
+    com_ssp = np.flatnonzero(coluna >= 0)
+    agregacao = sparse.csr_matrix((np.ones(len(com_ssp), dtype=np.int64), (com_ssp, coluna[com_ssp])),
+                                  shape=(len(sellers), len(ssps)))
+    
+    linhas = [incidencia['indice_sites'][site] for site in sites]
+    return (incidencia['DIRECT'][linhas].astype(np.int64) @ agregacao).tocsr()
+
+def analisar_vulnerabilidade(G, sites_data, incidencia=None, cenarios=CENARIOS_REMOCAO):
+    """
+    Para cada SSP, quantos sites perderiam >50% sellers se SSP removido
+    
+    A perda de cada site é (sellers DIRECT no SSP) / n_direct_raw, calculada
+    para todos os pares site × SSP de uma vez (matriz_site_ssp). Os cenários
+    removem juntos os k SSPs com mais sellers DIRECT, também em lote.
+    """
     
     ssps = [n for n, d in G.nodes(data=True) if d.get('tipo') == 'ssp']
-    sites = [n for n, d in G.nodes(data=True) if d.get('tipo') == 'site']
+    sites = [n for n, d in G.nodes(data=True) if d.get('tipo') == 'site' and n in sites_data]
     
-    vulnerabilidade = {}
+    contagens = matriz_site_ssp(G, sites, ssps, incidencia)
     
-    for ssp in ssps:
-        vulneraveis_fc = []
-        vulneraveis_ms = []
-        
-        for site in sites:
-            if site not in G or site not in sites_data:
-                continue
-            
-            # Total de sellers do site
-            total_sellers = sites_data[site].get('n_direct_raw', 0)
-            if total_sellers == 0:
-                continue
-            
-            # Sellers deste SSP
-            sellers_ssp = 0
-            if G.has_edge(site, ssp):
-                sellers_ssp = 1  # Simplificação: contamos 1 por aresta
-            
-            perda_percentual = sellers_ssp / total_sellers
-            
-            if perda_percentual > 0.5:
-                cat = sites_data[site]['cat']
-                if cat == 'FC':
-                    vulneraveis_fc.append((site, perda_percentual))
-                elif cat == 'MS':
-                    vulneraveis_ms.append((site, perda_percentual))
-        
-        if vulneraveis_fc or vulneraveis_ms:
-            vulnerabilidade[ssp] = {
-                'n_vulneraveis_fc': len(vulneraveis_fc),
-                'n_vulneraveis_ms': len(vulneraveis_ms),
-                'taxa_fc': len(vulneraveis_fc) / len([s for s in sites if sites_data.get(s, {}).get('cat') == 'FC']) if sites else 0,
-                'taxa_ms': len(vulneraveis_ms) / len([s for s in sites if sites_data.get(s, {}).get('cat') == 'MS']) if sites else 0
-            }
+    # Fração de sellers perdida por site × SSP (sites sem DIRECT ficam de fora)
+    total_sellers = np.array([sites_data[s].get('n_direct_raw', 0) for s in sites], dtype=float)
+    inverso = np.divide(1.0, total_sellers, out=np.zeros_like(total_sellers), where=total_sellers > 0)
+    perda = sparse.diags(inverso) @ contagens
+    vulneravel = (perda > 0.5).astype(np.int64)
+    
+    categorias = np.array([sites_data[s]['cat'] for s in sites], dtype=object)
+    eh_fc = (categorias == 'FC').astype(np.int64)
+    eh_ms = (categorias == 'MS').astype(np.int64)
+    total_fc = int(eh_fc.sum())
+    total_ms = int(eh_ms.sum())
+    
+    n_fc = vulneravel.T @ eh_fc
+    n_ms = vulneravel.T @ eh_ms
+    
+    vulnerabilidade = {}
+    for j in np.flatnonzero((n_fc > 0) | (n_ms > 0)).tolist():
+        vulnerabilidade[ssps[j]] = {
+            'n_vulneraveis_fc': int(n_fc[j]),
+            'n_vulneraveis_ms': int(n_ms[j]),
+            'taxa_fc': int(n_fc[j]) / total_fc if total_fc else 0,
+            'taxa_ms': int(n_ms[j]) / total_ms if total_ms else 0
+        }
     
     # Top SSPs por vulnerabilidade
     top_vuln = sorted(vulnerabilidade.items(), 
                      key=lambda x: x[1]['n_vulneraveis_fc'] + x[1]['n_vulneraveis_ms'], 
                      reverse=True)[:10]
     
+    # Cenários de remoção conjunta: uma coluna indicadora por k, perdas em um único produto
+    sellers_por_ssp = np.asarray(contagens.sum(axis=0)).ravel()
+    ranking = np.argsort(-sellers_por_ssp, kind='stable')
+    ks = [k for k in cenarios if 0 < k <= len(ssps)]
+    selecao = np.zeros((len(ssps), len(ks)))
+    for c, k in enumerate(ks):
+        selecao[ranking[:k], c] = 1
+    perda_cenarios = inverso[:, None] * (contagens @ selecao)
+    vulneravel_cenarios = perda_cenarios > 0.5
+    
+    cenarios_remocao = []
+    for c, k in enumerate(ks):
+        fc = int(vulneravel_cenarios[:, c] @ eh_fc)
+        ms = int(vulneravel_cenarios[:, c] @ eh_ms)
+        cenarios_remocao.append({
+            'k': k,
+            'ssps': [ssps[j] for j in ranking[:k].tolist()],
+            'n_vulneraveis_fc': fc,
+            'n_vulneraveis_ms': ms,
+            'taxa_fc': fc / total_fc if total_fc else 0,
+            'taxa_ms': ms / total_ms if total_ms else 0,
+            'perda_media': float(perda_cenarios[total_sellers > 0, c].mean()) if total_sellers.any() else 0.0
+        })
+    
     return {
         'completo': vulnerabilidade,
-        'top_10': [{'ssp': ssp, **data} for ssp, data in top_vuln]
+        'top_10': [{'ssp': ssp, **data} for ssp, data in top_vuln],
+        'cenarios_remocao': cenarios_remocao
     }
 
 # ============================================================================
@@ -188,11 +243,131 @@ def analisar_estrategias(sites_data):
 # ANÁLISE 3: BROKERS (BETWEENNESS)
 # ============================================================================
 
-def identificar_brokers(G, sites_data):
-    """Calcula betweenness centrality dos SSPs"""
+LIMITE_BETWEENNESS_EXATO = 2000   # nós; acima disso a betweenness é amostrada
+AMOSTRAS_BETWEENNESS = 512        # fontes (pivôs) sorteadas no modo aproximado
+
+_GRAFO_TRABALHADOR = {}
+
+def _iniciar_trabalhador_bc(indptr, indices):
+    _GRAFO_TRABALHADOR['indptr'] = indptr.tolist()
+    _GRAFO_TRABALHADOR['indices'] = indices.tolist()
+
+def _dependencias_fontes(fontes):
+    """
+    Brandes (grafo não ponderado) para um lote de fontes.
+    
+    Retorna a soma e a soma dos quadrados das dependências δ_s(v) de cada
+    nó sobre as fontes do lote (os quadrados alimentam o erro padrão).
+    """
+    indptr = _GRAFO_TRABALHADOR['indptr']
+    indices = _GRAFO_TRABALHADOR['indices']
+    n = len(indptr) - 1
+    soma = np.zeros(n)
+    soma_quadrados = np.zeros(n)
+    
+    for s in fontes:
+        sigma = [0] * n
+        dist = [-1] * n
+        predecessores = [[] for _ in range(n)]
+        sigma[s] = 1
+        dist[s] = 0
+        ordem = [s]
+        
+        # BFS: número de caminhos mínimos e predecessores
+        for v in ordem:
+            proxima = dist[v] + 1
+            for w in indices[indptr[v]:indptr[v + 1]]:
+                if dist[w] < 0:
+                    dist[w] = proxima
+                    ordem.append(w)
+                if dist[w] == proxima:
+                    sigma[w] += sigma[v]
+                    predecessores[w].append(v)
+        
+        # Acumulação das dependências em ordem reversa de distância
+        delta = [0.0] * n
+        for w in reversed(ordem):
+            coef = (1.0 + delta[w]) / sigma[w]
+            for v in predecessores[w]:
+                delta[v] += sigma[v] * coef
+        delta[s] = 0.0
+        
+        delta = np.array(delta)
+        soma += delta
+        soma_quadrados += delta * delta
+    
+    return soma, soma_quadrados
+
+def betweenness_amostrada(G, amostras: int = AMOSTRAS_BETWEENNESS, n_processos: int = 1, semente: int = 42):
+    """
+    Betweenness normalizada estimada a partir de pivôs sorteados (Brandes & Pich).
+    
+    Cada fonte sorteada contribui com suas dependências δ_s(v); a estimativa
+    é a média reescalada como em nx.betweenness_centrality(G, k=amostras).
+    O erro padrão de cada nó vem da variância amostral das dependências
+    (com correção para amostragem sem reposição); com amostras >= n o
+    resultado é exato e o erro é zero. As fontes são divididas em lotes
+    entre n_processos processos.
+    
+    Retorna (betweenness, erro_padrao), dicionários por nó.
+    """
+    nos = list(G.nodes())
+    n = len(nos)
+    if n == 0:
+        return {}, {}
+    
+    matriz = nx.to_scipy_sparse_array(G, nodelist=nos, weight=None, format='csr')
+    k = min(amostras, n)
+    fontes = np.random.default_rng(semente).choice(n, size=k, replace=False).tolist()
+    
+    if n_processos > 1 and k > 1:
+        lotes = [fontes[i::n_processos] for i in range(n_processos)]
+        with multiprocessing.Pool(n_processos, initializer=_iniciar_trabalhador_bc,
+                                  initargs=(matriz.indptr, matriz.indices)) as pool:
+            parciais = pool.map(_dependencias_fontes, [lote for lote in lotes if lote])
+        soma = sum(p[0] for p in parciais)
+        soma_quadrados = sum(p[1] for p in parciais)
+    else:
+        _iniciar_trabalhador_bc(matriz.indptr, matriz.indices)
+        soma, soma_quadrados = _dependencias_fontes(fontes)
+    
+    # Mesma escala de nx.betweenness_centrality(normalized=True, k=k)
+    escala = 1 / ((n - 1) * (n - 2)) if n > 2 else 1.0
+    fator = escala * n
+    media = soma / k
+    
+    if k > 1 and k < n:
+        variancia = np.maximum(soma_quadrados - k * media ** 2, 0) / (k - 1)
+        erro = fator * np.sqrt(variancia / k * (n - k) / (n - 1))
+    else:
+        erro = np.zeros(n)
+    
+    return dict(zip(nos, (fator * media).tolist())), dict(zip(nos, erro.tolist()))
+
+def identificar_brokers(G, sites_data, amostras: int = None, n_processos: int = 1,
+                        semente: int = 42, limite_exato: int = LIMITE_BETWEENNESS_EXATO):
+    """
+    Calcula betweenness centrality dos SSPs
+    
+    Exata (networkx) para grafos de até limite_exato nós, se amostras não
+    for informado; senão estimada por betweenness_amostrada, e cada broker
+    traz também o erro padrão da estimativa.
+    """
     
     # Betweenness de todos os nós
-    bc = nx.betweenness_centrality(G, normalized=True)
+    n_nos = G.number_of_nodes()
+    if amostras is None and n_nos <= limite_exato:
+        bc = nx.betweenness_centrality(G, normalized=True)
+        erro = None
+        metodo = {'metodo': 'exato', 'n_fontes': n_nos}
+    else:
+        n_fontes = min(amostras or AMOSTRAS_BETWEENNESS, n_nos)
+        bc, erro = betweenness_amostrada(G, n_fontes, n_processos, semente)
+        metodo = {
+            'metodo': 'amostrado' if n_fontes < n_nos else 'exato',
+            'n_fontes': n_fontes,
+            'erro_padrao_max': float(max(erro.values(), default=0.0))
+        }
     
     # Filtrar apenas SSPs
     bc_ssps = {node: bc[node] for node in G.nodes() 
@@ -216,50 +391,215 @@ def identificar_brokers(G, sites_data):
             'total_sites': len(vizinhos),
             'is_broker': n_fc >= 2 and n_ms >= 2
         })
+        if erro is not None:
+            brokers_info[-1]['erro_padrao'] = float(erro[ssp])
     
     # Contar brokers cross-editorial
     n_brokers = sum(1 for b in brokers_info if b['is_broker'])
     
     return {
         'top_10': brokers_info,
-        'n_brokers_cross_editorial': n_brokers
+        'n_brokers_cross_editorial': n_brokers,
+        'betweenness': metodo
     }
 
 # ============================================================================
 # ANÁLISE 4: INTEGRAÇÃO (ASSORTATIVITY + MODULARIDADE)
 # ============================================================================
 
-def analisar_integracao(G):
-    """Calcula assortativity e modularidade no grafo de projeção"""
+N_EXECUCOES_LOUVAIN = 50                        # execuções com sementes 0..N-1
+LIMIAR_CONSENSO = 0.5                           # fração mínima de coassociação
+DIRETORIO_CACHE_COMUNIDADES = '.cache_comunidades'
+
+_PROJECAO_TRABALHADOR = {}
+
+def _iniciar_trabalhador_louvain(G_proj):
+    _PROJECAO_TRABALHADOR['grafo'] = G_proj
+
+def _louvain_semente(semente: int):
+    """Uma execução do Louvain: (rótulos na ordem dos nós, modularidade)"""
+    G_proj = _PROJECAO_TRABALHADOR['grafo']
+    particao = community_louvain.best_partition(G_proj, random_state=semente)
+    return [particao[n] for n in G_proj.nodes()], community_louvain.modularity(particao, G_proj)
+
+def impressao_grafo(G_proj, *parametros) -> str:
+    """Hash do grafo ponderado (nós, arestas e pesos) e dos parâmetros da análise"""
+    h = hashlib.sha1()
+    h.update(json.dumps(parametros).encode('utf-8'))
+    for no in sorted(G_proj.nodes()):
+        h.update(f"n|{no}\n".encode('utf-8'))
+    for u, v, peso in sorted((min(u, v), max(u, v), d.get('weight', 1)) for u, v, d in G_proj.edges(data=True)):
+        h.update(f"e|{u}|{v}|{peso}\n".encode('utf-8'))
+    return h.hexdigest()
+
+def louvain_consenso(G_proj, n_execucoes: int = N_EXECUCOES_LOUVAIN, n_processos: int = 1,
+                     limiar: float = LIMIAR_CONSENSO, cache_dir: str = DIRETORIO_CACHE_COMUNIDADES) -> Dict:
+    """
+    Partição de consenso de várias execuções do Louvain com sementes fixas.
+    
+    As execuções são distribuídas entre n_processos. A coassociação de cada
+    aresta da projeção é a fração das execuções que põem as duas pontas na
+    mesma comunidade; o consenso são as componentes conexas das arestas com
+    coassociação >= limiar. A estabilidade de uma comunidade é a coassociação
+    média entre todos os pares de seus membros (1.0 para sites isolados).
+    O resultado é guardado em cache_dir pela impressão do grafo.
+    """
+    chave = impressao_grafo(G_proj, n_execucoes, limiar)
+    caminho_cache = os.path.join(cache_dir, chave + '.json') if cache_dir else None
+    if caminho_cache and os.path.exists(caminho_cache):
+        with open(caminho_cache, 'r', encoding='utf-8') as f:
+            resultado = json.load(f)
+        resultado['cache'] = True
+        return resultado
+    
+    nos = list(G_proj.nodes())
+    sementes = list(range(n_execucoes))
+    if n_processos > 1:
+        with multiprocessing.Pool(n_processos, initializer=_iniciar_trabalhador_louvain,
+                                  initargs=(G_proj,)) as pool:
+            execucoes = pool.map(_louvain_semente, sementes)
+    else:
+        _iniciar_trabalhador_louvain(G_proj)
+        execucoes = [_louvain_semente(s) for s in sementes]
+    
+    rotulos = np.array([r for r, _ in execucoes], dtype=np.int64).reshape(n_execucoes, len(nos))
+    modularidades = np.array([m for _, m in execucoes])
+    
+    # Coassociação nas arestas da projeção e componentes acima do limiar
+    posicao = {no: i for i, no in enumerate(nos)}
+    arestas = np.array([(posicao[u], posicao[v]) for u, v in G_proj.edges()], dtype=np.int64).reshape(-1, 2)
+    coassociacao = (rotulos[:, arestas[:, 0]] == rotulos[:, arestas[:, 1]]).mean(axis=0)
+    fortes = arestas[coassociacao >= limiar]
+    consenso_grafo = sparse.csr_matrix((np.ones(len(fortes)), (fortes[:, 0], fortes[:, 1])),
+                                       shape=(len(nos), len(nos)))
+    _, componentes = csgraph.connected_components(consenso_grafo, directed=False)
+    
+    # Ids por tamanho decrescente (empate: primeiro nó na ordem do grafo)
+    tamanhos = np.bincount(componentes)
+    primeiro = np.full(len(tamanhos), len(nos))
+    np.minimum.at(primeiro, componentes, np.arange(len(nos)))
+    ordem = sorted(range(len(tamanhos)), key=lambda c: (-tamanhos[c], primeiro[c]))
+    novo_id = np.empty(len(tamanhos), dtype=np.int64)
+    novo_id[ordem] = np.arange(len(tamanhos))
+    componentes = novo_id[componentes]
+    
+    estabilidade = []
+    for c in range(len(tamanhos)):
+        membros = np.flatnonzero(componentes == c)
+        m = len(membros)
+        if m < 2:
+            estabilidade.append(1.0)
+            continue
+        pares_juntos = 0
+        for r in range(n_execucoes):
+            _, contagem = np.unique(rotulos[r, membros], return_counts=True)
+            pares_juntos += int((contagem * (contagem - 1) // 2).sum())
+        estabilidade.append(pares_juntos / (n_execucoes * m * (m - 1) / 2))
+    
+    particao = {no: int(componentes[i]) for i, no in enumerate(nos)}
+    resultado = {
+        'particao': particao,
+        'modularidade': float(community_louvain.modularity(particao, G_proj)) if G_proj.number_of_edges() else None,
+        'estabilidade': estabilidade,
+        'n_execucoes': n_execucoes,
+        'modularidade_execucoes': {
+            'media': float(modularidades.mean()),
+            'dp': float(modularidades.std()),
+            'min': float(modularidades.min()),
+            'max': float(modularidades.max())
+        },
+        'n_comunidades_execucoes': {
+            'media': float(np.mean([len(np.unique(r)) for r in rotulos])),
+            'min': int(min(len(np.unique(r)) for r in rotulos)),
+            'max': int(max(len(np.unique(r)) for r in rotulos))
+        }
+    }
     
-    # Criar grafo de projeção (sites conectados via SSPs)
-    sites_nodes = {n for n, d in G.nodes(data=True) if d.get('tipo') == 'site'}
-    G_proj = bipartite.weighted_projected_graph(G, sites_nodes)
+    if caminho_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(caminho_cache, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False)
+    resultado['cache'] = False
+    return resultado
+
+def projetar_sites(G, peso_minimo: int = 1):
+    """
+    Projeção ponderada sites-sites como produto esparso B·Bᵀ.
+    
+    B é a matriz binária sites × SSPs do grafo bipartido; o peso de cada
+    par é o nº de SSPs compartilhados (o mesmo de weighted_projected_graph).
+    Pares com peso < peso_minimo são descartados para manter a matriz esparsa.
+    Retorna (sites, matriz CSR simétrica sem diagonal).
+    """
+    sites = [n for n, d in G.nodes(data=True) if d.get('tipo') == 'site']
+    ssps = [n for n, d in G.nodes(data=True) if d.get('tipo') == 'ssp']
+    if not sites or not ssps:
+        return sites, sparse.csr_matrix((len(sites), len(sites)), dtype=np.int64)
+    
+    B = sparse.csr_matrix(bipartite.biadjacency_matrix(G, sites, ssps, weight=None), dtype=np.int64)
+    B.data[:] = 1
+    P = (B @ B.T).tocsr()
+    P.setdiag(0)
+    if peso_minimo > 1:
+        P.data[P.data < peso_minimo] = 0
+    P.eliminate_zeros()
+    return sites, P
+
+def assortatividade_categorica(P, categorias) -> float:
+    """
+    Assortatividade por atributo (como nx.attribute_assortativity_coefficient)
+    direto da matriz de projeção: matriz de mistura = Cᵀ·A·C, com A o padrão
+    de arestas de P e C o one-hot das categorias. None se não houver arestas.
+    """
+    valores, codigos = np.unique(np.asarray(categorias, dtype=str), return_inverse=True)
+    C = sparse.csr_matrix((np.ones(len(codigos)), (np.arange(len(codigos)), codigos)),
+                          shape=(len(codigos), len(valores)))
+    A = P.copy()
+    A.data = np.ones_like(A.data, dtype=float)
+    
+    mistura = (C.T @ A @ C).toarray()
+    total = mistura.sum()
+    if total == 0:
+        return None
+    mistura /= total
+    
+    soma_ab = float(mistura.sum(axis=1) @ mistura.sum(axis=0))
+    if soma_ab == 1:
+        return None
+    return (float(np.trace(mistura)) - soma_ab) / (1 - soma_ab)
+
+def analisar_integracao(G, peso_minimo: int = 1, n_execucoes: int = N_EXECUCOES_LOUVAIN,
+                        n_processos: int = 1, cache_dir: str = DIRETORIO_CACHE_COMUNIDADES):
+    """Calcula assortativity e modularidade no grafo de projeção"""
     
-    # Copiar atributo categoria
-    for node in G_proj.nodes():
-        if node in G:
-            G_proj.nodes[node]['categoria'] = G.nodes[node].get('categoria', 'Unknown')
+    # Projeção sites-sites (sites conectados via SSPs) como produto esparso
+    sites, P = projetar_sites(G, peso_minimo)
+    categorias = [G.nodes[n].get('categoria', 'Unknown') for n in sites]
     
     # Assortativity
-    try:
-        assortativity = nx.attribute_assortativity_coefficient(G_proj, 'categoria')
-    except:
-        assortativity = None
+    assortativity = assortatividade_categorica(P, categorias) if sites else None
+    
+    # Grafo networkx da projeção, só para o Louvain
+    G_proj = nx.from_scipy_sparse_array(P, edge_attribute='weight')
+    G_proj = nx.relabel_nodes(G_proj, dict(enumerate(sites)))
+    for node, cat in zip(sites, categorias):
+        G_proj.nodes[node]['categoria'] = cat
     
-    # Modularidade (Louvain)
+    # Modularidade (consenso de várias execuções do Louvain)
     modularidade = None
     comunidades = None
+    consenso = None
     
-    if HAS_LOUVAIN and len(G_proj.nodes()) > 0:
+    if HAS_LOUVAIN and len(G_proj.nodes()) > 0 and G_proj.number_of_edges() > 0:
         try:
-            partition = community_louvain.best_partition(G_proj)
-            modularidade = community_louvain.modularity(partition, G_proj)
+            consenso = louvain_consenso(G_proj, n_execucoes, n_processos, cache_dir=cache_dir)
+            modularidade = consenso['modularidade']
             
             # Analisar composição das comunidades
             comunidades_comp = defaultdict(lambda: {'FC': 0, 'HP': 0, 'MS': 0})
+            tamanhos = Counter(consenso['particao'].values())
             
-            for node, comm_id in partition.items():
+            for node, comm_id in consenso['particao'].items():
                 cat = G_proj.nodes[node].get('categoria', 'Unknown')
                 if cat in ['FC', 'HP', 'MS']:
                     comunidades_comp[comm_id][cat] += 1
@@ -267,10 +607,12 @@ def analisar_integracao(G):
             comunidades = [
                 {
                     'id': comm_id,
+                    'n_sites': tamanhos[comm_id],
                     'composicao': dict(comp),
-                    'tipo': 'mista' if len([c for c in comp.values() if c > 0]) > 1 else 'pura'
+                    'tipo': 'mista' if len([c for c in comp.values() if c > 0]) > 1 else 'pura',
+                    'estabilidade': round(consenso['estabilidade'][comm_id], 4)
                 }
-                for comm_id, comp in comunidades_comp.items()
+                for comm_id, comp in sorted(comunidades_comp.items())
             ]
             
         except Exception as e:
@@ -280,15 +622,18 @@ def analisar_integracao(G):
         'assortativity': float(assortativity) if assortativity is not None else None,
         'modularidade': float(modularidade) if modularidade is not None else None,
         'n_comunidades': len(comunidades) if comunidades else 0,
-        'comunidades': comunidades if comunidades else []
+        'comunidades': comunidades if comunidades else [],
+        'projecao': {'peso_minimo': peso_minimo, 'n_arestas': int(P.nnz // 2)},
+        'consenso': {k: consenso[k] for k in ('n_execucoes', 'modularidade_execucoes',
+                                              'n_comunidades_execucoes', 'cache')} if consenso else None
     }
 
 # ============================================================================
 # CONSTRUIR GRAFO BIPARTIDO
 # ============================================================================
 
-def construir_grafo_bipartido(sites_data, dark_pools_data):
-    """Constrói grafo bipartido sites-SSPs"""
+def construir_grafo_bipartido(sites_data, dark_pools_data, incidencia=None):
+    """Constrói grafo bipartido sites-SSPs (arestas lidas da matriz de incidência, se fornecida)"""
     
     G = nx.Graph()
     
@@ -303,6 +648,10 @@ def construir_grafo_bipartido(sites_data, dark_pools_data):
     # Adicionar SSPs e arestas via dark pools
     pools = dark_pools_data['pools']
     
+    if incidencia is not None:
+        direct = incidencia['DIRECT'].tocsc()
+        ids = incidencia['dicionario'].ids
+    
     for seller, pool_data in pools.items():
         ssp_domain = seller.split('#')[0]
         
@@ -310,8 +659,15 @@ def construir_grafo_bipartido(sites_data, dark_pools_data):
         if ssp_domain not in G:
             G.add_node(ssp_domain, bipartite=0, tipo='ssp')
         
+        # Sites do pool: coluna do seller na matriz ou lista salva no JSON
+        if incidencia is not None:
+            j = ids[seller]
+            sites_pool = [incidencia['sites'][i] for i in direct.indices[direct.indptr[j]:direct.indptr[j + 1]]]
+        else:
+            sites_pool = pool_data['sites']
+        
         # Adicionar arestas
-        for site in pool_data['sites']:
+        for site in sites_pool:
             if site in G:
                 G.add_edge(site, ssp_domain, seller_id=seller)
     
@@ -332,7 +688,8 @@ def construir_grafo_bipartido(sites_data, dark_pools_data):
 # PIPELINE PRINCIPAL
 # ============================================================================
 
-def executar_analises_rede():
+def executar_analises_rede(amostras_betweenness: int = None, n_processos: int = 1, peso_minimo: int = 1,
+                           n_execucoes_louvain: int = N_EXECUCOES_LOUVAIN):
     """Executa todas as 5 análises de rede"""
     
     print("="*80)
@@ -342,21 +699,22 @@ def executar_analises_rede():
     
     # Carregar resultados
     print("[1/6] Carregando resultados...")
-    resultados = carregar_resultados()
-    sites_data = resultados['sites']
-    dark_pools_data = resultados['dark_pools']
+    sites_data, dark_pools_data, incidencia = carregar_resultados()
     
     # Construir grafo
     print("[2/6] Construindo grafo bipartido...")
-    G, props_grafo = construir_grafo_bipartido(sites_data, dark_pools_data)
+    G, props_grafo = construir_grafo_bipartido(sites_data, dark_pools_data, incidencia)
     print(f"  Nós: {props_grafo['n_sites']} sites + {props_grafo['n_ssps']} SSPs")
     print(f"  Arestas: {props_grafo['n_arestas']}")
     print(f"  Densidade: {props_grafo['densidade']:.4f}")
     
     # Análises
     print("\n[3/6] Análise 1: Vulnerabilidade...")
-    vulnerabilidade = analisar_vulnerabilidade(G, sites_data)
+    vulnerabilidade = analisar_vulnerabilidade(G, sites_data, incidencia)
     print(f"  Top SSP vulnerável: {vulnerabilidade['top_10'][0]['ssp'] if vulnerabilidade['top_10'] else 'N/A'}")
+    for cenario in vulnerabilidade['cenarios_remocao']:
+        print(f"  Remover top {cenario['k']:2} SSPs: {cenario['n_vulneraveis_fc']} FC, "
+              f"{cenario['n_vulneraveis_ms']} MS vulneráveis")
     
     print("\n[4/6] Análise 2: Estratégias (K-means)...")
     estrategias = analisar_estrategias(sites_data)
@@ -365,15 +723,21 @@ def executar_analises_rede():
         print(f"  Qui-quadrado p={estrategias['teste_independencia']['p']:.4f}")
     
     print("\n[5/6] Análise 3: Brokers...")
-    brokers = identificar_brokers(G, sites_data)
+    brokers = identificar_brokers(G, sites_data, amostras_betweenness, n_processos)
+    print(f"  Betweenness: {brokers['betweenness']['metodo']} ({brokers['betweenness']['n_fontes']} fontes)")
     print(f"  Top broker: {brokers['top_10'][0]['ssp']} (BC={brokers['top_10'][0]['betweenness']:.4f})")
     print(f"  Brokers cross-editorial: {brokers['n_brokers_cross_editorial']}")
     
     print("\n[6/6] Análise 4: Integração...")
-    integracao = analisar_integracao(G)
+    integracao = analisar_integracao(G, peso_minimo, n_execucoes_louvain, n_processos)
     print(f"  Assortativity: {integracao['assortativity']:.4f}" if integracao['assortativity'] else "  Assortativity: N/A")
     print(f"  Modularidade: {integracao['modularidade']:.4f}" if integracao['modularidade'] else "  Modularidade: N/A")
     print(f"  Comunidades: {integracao['n_comunidades']}")
+    if integracao['consenso']:
+        consenso = integracao['consenso']
+        print(f"  Consenso de {consenso['n_execucoes']} execuções "
+              f"(modularidade {consenso['modularidade_execucoes']['media']:.4f} "
+              f"± {consenso['modularidade_execucoes']['dp']:.4f}){' [cache]' if consenso['cache'] else ''}")
     
     # Salvar resultados
     print()
@@ -389,11 +753,10 @@ def executar_analises_rede():
         'integracao': integracao
     }
     
-    # Converter tipos numpy para Python
-    resultados_rede_convertidos = converter_numpy_para_python(resultados_rede)
-    
-    with open('resultados_redes.json', 'w', encoding='utf-8') as f:
-        json.dump(resultados_rede_convertidos, f, indent=2, ensure_ascii=False)
+    # Tipos numpy são convertidos pelo encoder, seção por seção
+    with EscritorJSON('resultados_redes.json') as escritor:
+        for secao, valor in resultados_rede.items():
+            escritor.secao(secao, valor)
     
     print("✓ resultados_redes.json")
     print()
@@ -406,12 +769,26 @@ def executar_analises_rede():
 # ============================================================================
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Análises de rede sobre os resultados de dark pooling")
+    parser.add_argument('--amostras-betweenness', type=int, metavar='K',
+                        help=f"estima a betweenness com K fontes sorteadas (padrão: exata até "
+                             f"{LIMITE_BETWEENNESS_EXATO} nós, {AMOSTRAS_BETWEENNESS} fontes acima)")
+    parser.add_argument('--processos', type=int, default=1,
+                        help="divide a betweenness amostrada e as execuções do Louvain entre N processos")
+    parser.add_argument('--peso-minimo', type=int, default=1,
+                        help="descarta da projeção sites-sites pares com menos de N SSPs em comum")
+    parser.add_argument('--execucoes-louvain', type=int, default=N_EXECUCOES_LOUVAIN,
+                        help="execuções do Louvain (sementes 0..N-1) combinadas na partição de consenso")
+    args = parser.parse_args()
+    
     try:
-        import os
-        if not os.path.exists('resultados_completos.json'):
+        if not (os.path.exists(ARQUIVO_COLUNAR) or os.path.exists('resultados_completos.json')):
             print("ERRO: Execute primeiro 'python analise_completa_darkpools.py'")
         else:
-            resultados_rede = executar_analises_rede()
+            resultados_rede = executar_analises_rede(args.amostras_betweenness, args.processos, args.peso_minimo,
+                                                     args.execucoes_louvain)
     except Exception as e:
         print(f"\n\nERRO: {e}")
         import traceback
@@ -0,0 +1,476 @@
+"""
+BENCHMARK DO PIPELINE - ESCALA SINTÉTICA
+Mede tempo e pico de memória de cada etapa com dados sintéticos, sem rede
+
+O gerador é calibrado a partir de resultados_completos.json (nº de sellers
+DIRECT/RESELLER por site, categorias, SSPs e tamanho dos dark pools); sem o
+arquivo, usa PARAMETROS_PADRAO (a mesma calibração, pré-calculada sobre o
+resultados_completos.json do repositório).
+
+EXECUÇÃO:
+python benchmark_pipeline.py                                (100, 1k, 10k e 100k sites)
+python benchmark_pipeline.py --tamanhos 100 1000 --salvar-baseline
+python benchmark_pipeline.py --tolerancia 0.5               (compara com benchmark_baseline.json)
+
+OUTPUTS:
+- benchmark_resultados.json (tempo e pico de memória por tamanho e etapa)
+- benchmark_baseline.json (com --salvar-baseline)
+Sai com código 1 se alguma etapa regrediu em relação ao baseline.
+"""
+
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+from collections import Counter
+from datetime import datetime
+from scipy import sparse
+from typing import Callable, Dict, List, Tuple
+
+from analise_completa_darkpools import (GRUPOS_EDITORIAIS, ConstrutorIncidencia, DicionarioSellers,
+                                        calcular_estatisticas_categoria, identificar_dark_pools, parsear_adstxt)
+from analise_de_redes import analisar_integracao, construir_grafo_bipartido, identificar_brokers
+
+# ============================================================================
+# CONFIGURAÇÃO
+# ============================================================================
+
+TAMANHOS_PADRAO = (100, 1_000, 10_000, 100_000)
+
+# Maior nº de sites em que cada etapa roda; acima disso é registrada como pulada.
+# Parse e incidência consomem os sites um a um (como na coleta) e rodam em
+# qualquer tamanho; grafos networkx e projeções sites-sites (quase densas)
+# não cabem em memória de laptop a 100k sites.
+LIMITES_ETAPA = {
+    'parsear_adstxt': None,
+    'construir_incidencia': None,
+    'identificar_dark_pools': None,
+    'calcular_estatisticas_categoria': None,
+    'construir_grafo_bipartido': 10_000,
+    'identificar_brokers': 10_000,
+    'analisar_integracao': 1_000,
+}
+
+AMOSTRAS_BROKERS = 64        # fontes da betweenness amostrada (grafos acima do limite exato)
+EXECUCOES_LOUVAIN = 5
+
+# Saída de calibrar() sobre o resultados_completos.json do repositório (25 sites
+# com ads.txt, 406 dark pools), usada quando o arquivo não está disponível.
+# SSPs truncados aos 12 mais frequentes entre os sellers dos pools.
+PARAMETROS_PADRAO = {
+    'categorias': {'FC': 0.48, 'HP': 0.12, 'MS': 0.40},
+    'n_direct': [314, 0, 9, 1, 660, 15, 0, 0, 0, 174, 0, 1, 27, 114, 113, 18, 430, 61, 176, 34,
+                 269, 128, 50, 32, 189],
+    'n_reseller': [1188, 0, 56, 0, 2605, 36, 0, 0, 0, 709, 0, 0, 542, 387, 650, 0, 736, 171, 616, 292,
+                   1333, 409, 335, 91, 2120],
+    'frac_compartilhada': 0.49,
+    'pools_por_site': 16.24,
+    'expoente_zipf': 0.51,
+    'ssps': {'lijit.com': 23, 'google.com': 22, 'onetag.com': 21, 'rubiconproject.com': 18,
+             'pubmatic.com': 16, 'aps.amazon.com': 14, 'smartadserver.com': 13, 'triplelift.com': 13,
+             'sharethrough.com': 11, 'appnexus.com': 11, 'themediagrid.com': 10, 'indexexchange.com': 10}
+}
+
+# ============================================================================
+# CALIBRAÇÃO
+# ============================================================================
+
+def calibrar(caminho: str = 'resultados_completos.json') -> Dict:
+    """Parâmetros do gerador a partir dos resultados de uma execução real"""
+    if not os.path.exists(caminho):
+        print(f"AVISO: {caminho} não encontrado. Usando parâmetros padrão")
+        return dict(PARAMETROS_PADRAO)
+    
+    with open(caminho, 'r', encoding='utf-8') as f:
+        resultados = json.load(f)
+    
+    validos = [s for s in resultados['sites'].values() if s.get('sucesso')]
+    pools = resultados['dark_pools']['pools']
+    if not validos or not pools:
+        print("AVISO: resultados sem sites válidos ou sem pools. Usando parâmetros padrão")
+        return dict(PARAMETROS_PADRAO)
+    
+    categorias = Counter(s['cat'] for s in validos)
+    n_direct = [s['n_direct_raw'] for s in validos]
+    
+    # Tamanho dos pools por posto: inclinação log-log (lei de Zipf)
+    tamanhos = np.sort([p['n_sites'] for p in pools.values()])[::-1]
+    postos = np.arange(1, len(tamanhos) + 1)
+    expoente = -np.polyfit(np.log(postos), np.log(tamanhos), 1)[0] if len(tamanhos) > 1 else 1.0
+    
+    ssps = Counter(seller.split('#')[0] for seller in pools)
+    
+    return {
+        'categorias': {cat: n / len(validos) for cat, n in categorias.items()},
+        'n_direct': n_direct,
+        'n_reseller': [s['n_reseller_raw'] for s in validos],
+        'frac_compartilhada': min(sum(p['n_sites'] for p in pools.values()) / max(sum(n_direct), 1), 1.0),
+        'pools_por_site': len(pools) / len(validos),
+        'expoente_zipf': float(max(expoente, 0.1)),
+        'ssps': dict(ssps.most_common(200))
+    }
+
+# ============================================================================
+# GERADOR SINTÉTICO
+# ============================================================================
+
+class _SellersSinteticos:
+    """Sequência preguiçosa de nomes de sellers: 'ssp#b<id>', gerados só quando lidos"""
+    
+    def __init__(self, ssp_de: np.ndarray, ssps: List[str]):
+        self.ssp_de = ssp_de
+        self.ssps = ssps
+    
+    def __len__(self) -> int:
+        return len(self.ssp_de)
+    
+    def __getitem__(self, j: int) -> str:
+        return f"{self.ssps[self.ssp_de[j]]}#b{j}"
+    
+    def __iter__(self):
+        return (self[j] for j in range(len(self)))
+
+class _IdsSinteticos:
+    """Mapeamento seller -> id dos nomes sintéticos (o id está no próprio nome)"""
+    
+    def __init__(self, sellers: _SellersSinteticos):
+        self.sellers = sellers
+    
+    def get(self, seller: str, padrao=None):
+        try:
+            j = int(seller.rsplit('#b', 1)[1])
+        except (IndexError, ValueError):
+            return padrao
+        return j if 0 <= j < len(self.sellers) and self.sellers[j] == seller else padrao
+    
+    def __getitem__(self, seller: str) -> int:
+        j = self.get(seller)
+        if j is None:
+            raise KeyError(seller)
+        return j
+    
+    def __contains__(self, seller: str) -> bool:
+        return self.get(seller) is not None
+
+class DicionarioSintetico(DicionarioSellers):
+    """DicionarioSellers somente leitura sobre ids gerados, sem guardar as strings"""
+    
+    def __init__(self, ssp_de: np.ndarray, ssps: List[str]):
+        self.sellers = _SellersSinteticos(ssp_de, ssps)
+        self.ids = _IdsSinteticos(self.sellers)
+
+def _gerar_ids(n_entradas: np.ndarray, parametros: Dict, n_catalogo: int, proximo_id: int,
+               pesos: np.ndarray, rng: np.random.Generator) -> Tuple[np.ndarray, int]:
+    """
+    Ids de sellers de todas as entradas, site após site.
+    
+    Cada entrada vem do catálogo compartilhado (com prob. frac_compartilhada,
+    popularidade Zipf) ou é um seller novo, exclusivo do site.
+    """
+    total = int(n_entradas.sum())
+    compartilhada = rng.random(total) < parametros['frac_compartilhada']
+    ids = np.empty(total, dtype=np.int32)
+    ids[compartilhada] = rng.choice(n_catalogo, size=int(compartilhada.sum()), p=pesos)
+    n_novos = total - int(compartilhada.sum())
+    ids[~compartilhada] = proximo_id + np.arange(n_novos)
+    return ids, proximo_id + n_novos
+
+def gerar_amostra(n_sites: int, parametros: Dict, semente: int = 42) -> Dict:
+    """
+    Dados sintéticos de n_sites no formato do pipeline: sites_data (sem as
+    listas de sellers), incidência site × seller já montada e grupos editoriais.
+    """
+    rng = np.random.default_rng(semente)
+    
+    cats = list(parametros['categorias'])
+    cat_site = rng.choice(len(cats), size=n_sites, p=np.array(list(parametros['categorias'].values())) /
+                          sum(parametros['categorias'].values()))
+    escolha = rng.integers(0, len(parametros['n_direct']), n_sites)
+    n_direct = np.asarray(parametros['n_direct'])[escolha]
+    n_reseller = np.asarray(parametros['n_reseller'])[escolha]
+    
+    # Catálogo de sellers compartilháveis com popularidade Zipf
+    n_catalogo = max(10, int(parametros['pools_por_site'] * n_sites))
+    pesos = np.arange(1, n_catalogo + 1, dtype=float) ** -parametros['expoente_zipf']
+    pesos /= pesos.sum()
+    
+    ids_direct, proximo = _gerar_ids(n_direct, parametros, n_catalogo, n_catalogo, pesos, rng)
+    ids_reseller, proximo = _gerar_ids(n_reseller, parametros, n_catalogo, proximo, pesos, rng)
+    
+    ssps = list(parametros['ssps'])
+    peso_ssp = np.array(list(parametros['ssps'].values()), dtype=float)
+    ssp_de = rng.choice(len(ssps), size=proximo, p=peso_ssp / peso_ssp.sum()).astype(np.int16)
+    dicionario = DicionarioSintetico(ssp_de, ssps)
+    
+    nomes = [f"site{i:06d}" for i in range(n_sites)]
+    dominios = [f"site{i:06d}.com.br" for i in range(n_sites)]
+    categorias = [cats[c] for c in cat_site.tolist()]
+    
+    incidencia = {
+        'sites': nomes,
+        'indice_sites': {nome: i for i, nome in enumerate(nomes)},
+        'dominios': dominios,
+        'categorias': np.array(categorias, dtype=object),
+        'dicionario': dicionario,
+        'ordem': {}
+    }
+    for tipo, ids, tamanhos in (('DIRECT', ids_direct, n_direct), ('RESELLER', ids_reseller, n_reseller)):
+        linhas = np.repeat(np.arange(n_sites, dtype=np.int32), tamanhos)
+        matriz = sparse.csr_matrix((np.ones(len(ids), dtype=np.int32), (linhas, ids)), shape=(n_sites, proximo))
+        matriz.sum_duplicates()
+        incidencia[tipo] = matriz
+        unicos, primeira = np.unique(ids, return_index=True)
+        incidencia['ordem'][tipo] = unicos[np.argsort(primeira, kind='stable')]
+    
+    sites_data = {
+        nome: {
+            'domain': dominios[i],
+            'cat': categorias[i],
+            'sucesso': True,
+            'n_direct_raw': int(n_direct[i]),
+            'n_reseller_raw': int(n_reseller[i])
+        }
+        for i, nome in enumerate(nomes)
+    }
+    
+    # Grupos editoriais com o mesmo formato e tamanho dos reais, sobre sites sorteados
+    sorteio = iter(rng.permutation(n_sites).tolist())
+    grupos = {grupo: {dominios[next(sorteio)] for _ in dominios_grupo}
+              for grupo, dominios_grupo in GRUPOS_EDITORIAIS.items()
+              if len(dominios_grupo) <= n_sites}
+    
+    return {'sites_data': sites_data, 'incidencia': incidencia, 'grupos': grupos}
+
+def linhas_adstxt(amostra: Dict, nome: str) -> List[str]:
+    """Conteúdo sintético do ads.txt de um site, com comentários e campos opcionais"""
+    incidencia = amostra['incidencia']
+    i = incidencia['indice_sites'][nome]
+    sellers = incidencia['dicionario'].sellers
+    linhas = [f"# ads.txt de {amostra['sites_data'][nome]['domain']}", "contact=adops@exemplo.com.br"]
+    for tipo in ('DIRECT', 'RESELLER'):
+        matriz = incidencia[tipo]
+        inicio, fim = matriz.indptr[i], matriz.indptr[i + 1]
+        for j, vezes in zip(matriz.indices[inicio:fim].tolist(), matriz.data[inicio:fim].tolist()):
+            ssp, pub = sellers[j].split('#')
+            linhas.extend([f"{ssp}, {pub}, {tipo}, f08c47fec0942fa0"] * vezes)
+    return linhas
+
+# ============================================================================
+# MEDIÇÃO
+# ============================================================================
+
+def medir(preparar: Callable, executar: Callable, medir_memoria: bool = True) -> Dict:
+    """
+    Tempo de parede de executar(preparar()) e, numa segunda execução sob
+    tracemalloc, o pico de memória alocada (a preparação não entra na conta).
+    
+    Se preparar devolve um gerador, a produção de cada item entra na medição:
+    é o caso de parse e incidência, que consomem os sites um a um.
+    """
+    entrada = preparar()
+    gc.collect()
+    inicio = time.perf_counter()
+    executar(entrada)
+    medicao = {'tempo_s': round(time.perf_counter() - inicio, 4)}
+    
+    if medir_memoria:
+        entrada = preparar()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            executar(entrada)
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        medicao['pico_mb'] = round(pico / 1024 ** 2, 2)
+    
+    return medicao
+
+def etapas(amostra: Dict) -> List[Tuple[str, Callable, Callable]]:
+    """(nome, preparar, executar) de cada etapa, na ordem do pipeline"""
+    sites_data = amostra['sites_data']
+    incidencia = amostra['incidencia']
+    grupos = amostra['grupos']
+    estado = {}
+    
+    def pools():
+        if 'pools' not in estado:
+            estado['pools'] = identificar_dark_pools(sites_data, grupos, incidencia)
+        return estado['pools']
+    
+    def grafo():
+        if 'grafo' not in estado:
+            estado['grafo'], _ = construir_grafo_bipartido(sites_data, {'pools': pools()}, incidencia)
+        return estado['grafo']
+    
+    def sites_com_sellers():
+        # Gerador: um site por vez, como a coleta entrega ao ConstrutorIncidencia
+        dicionario = incidencia['dicionario']
+        for nome, data in sites_data.items():
+            i = incidencia['indice_sites'][nome]
+            sellers = {}
+            for tipo in ('DIRECT', 'RESELLER'):
+                m = incidencia[tipo]
+                ids = np.repeat(m.indices[m.indptr[i]:m.indptr[i + 1]], m.data[m.indptr[i]:m.indptr[i + 1]])
+                sellers[tipo] = [dicionario.sellers[j] for j in ids.tolist()]
+            yield nome, data['domain'], data['cat'], sellers
+    
+    def parsear_todos(corpos):
+        # Guarda só as contagens, como a coleta em streaming que descarta o texto
+        return [(len(s['DIRECT']), len(s['RESELLER'])) for s in map(parsear_adstxt, corpos)]
+    
+    def incidencia_em_streaming(completos):
+        construtor = ConstrutorIncidencia(DicionarioSellers())
+        for site in completos:
+            construtor.adicionar_site(*site)
+        return construtor.finalizar()
+    
+    def sem_metricas():
+        return {nome: {k: v for k, v in data.items() if k != 'metricas'} for nome, data in sites_data.items()}
+    
+    return [
+        ('parsear_adstxt',
+         lambda: (linhas_adstxt(amostra, nome) for nome in sites_data),
+         parsear_todos),
+        ('construir_incidencia',
+         sites_com_sellers,
+         incidencia_em_streaming),
+        ('identificar_dark_pools',
+         lambda: None,
+         lambda _: identificar_dark_pools(sites_data, grupos, incidencia)),
+        ('calcular_estatisticas_categoria',
+         lambda: (sem_metricas(), pools()),
+         lambda entrada: calcular_estatisticas_categoria(entrada[0], entrada[1], incidencia)),
+        ('construir_grafo_bipartido',
+         lambda: {'pools': pools()},
+         lambda dark_pools_data: construir_grafo_bipartido(sites_data, dark_pools_data, incidencia)),
+        ('identificar_brokers',
+         grafo,
+         lambda G: identificar_brokers(G, sites_data, AMOSTRAS_BROKERS if G.number_of_nodes() > 2000 else None)),
+        ('analisar_integracao',
+         grafo,
+         lambda G: analisar_integracao(G, n_execucoes=EXECUCOES_LOUVAIN, cache_dir=None)),
+    ]
+
+def executar_benchmark(tamanhos: List[int], parametros: Dict, medir_memoria: bool = True,
+                       semente: int = 42) -> Dict[str, Dict]:
+    """Mede todas as etapas em cada tamanho; etapas acima de LIMITES_ETAPA ficam como puladas"""
+    resultados = {}
+    for n in tamanhos:
+        print(f"\n[{n:,} sites] gerando amostra sintética...")
+        amostra = gerar_amostra(n, parametros, semente)
+        resultados[str(n)] = {}
+        for nome, preparar, executar in etapas(amostra):
+            limite = LIMITES_ETAPA.get(nome)
+            if limite is not None and n > limite:
+                resultados[str(n)][nome] = {'pulado': f"acima do limite de {limite:,} sites"}
+                print(f"  {nome:35} - pulado (limite {limite:,})")
+                continue
+            medicao = medir(preparar, executar, medir_memoria)
+            resultados[str(n)][nome] = medicao
+            memoria = f"  pico {medicao['pico_mb']:9.1f} MB" if 'pico_mb' in medicao else ''
+            print(f"  {nome:35} {medicao['tempo_s']:9.3f} s{memoria}", flush=True)
+        del amostra
+        gc.collect()
+    return resultados
+
+# ============================================================================
+# BASELINE E REGRESSÕES
+# ============================================================================
+
+def comparar_baseline(resultados: Dict, baseline: Dict, tolerancia: float = 0.25,
+                      minimo_s: float = 0.05, minimo_mb: float = 1.0) -> List[Dict]:
+    """
+    Etapas que pioraram mais que tolerancia (fração) em relação ao baseline.
+    
+    Diferenças abaixo de minimo_s / minimo_mb são tratadas como ruído.
+    """
+    regressoes = []
+    for tamanho, etapas_tamanho in resultados.items():
+        for etapa, atual in etapas_tamanho.items():
+            anterior = baseline.get('resultados', {}).get(tamanho, {}).get(etapa)
+            if not anterior or 'pulado' in atual or 'pulado' in anterior:
+                continue
+            for campo, minimo in (('tempo_s', minimo_s), ('pico_mb', minimo_mb)):
+                if campo not in atual or campo not in anterior:
+                    continue
+                if atual[campo] > anterior[campo] * (1 + tolerancia) and atual[campo] - anterior[campo] > minimo:
+                    regressoes.append({
+                        'tamanho': int(tamanho),
+                        'etapa': etapa,
+                        'medida': campo,
+                        'baseline': anterior[campo],
+                        'atual': atual[campo],
+                        'variacao': round(atual[campo] / anterior[campo] - 1, 3) if anterior[campo] else None
+                    })
+    return regressoes
+
+# ============================================================================
+# EXECUÇÃO
+# ============================================================================
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description="Benchmark sintético das etapas do pipeline")
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=list(TAMANHOS_PADRAO),
+                        help="nºs de sites a gerar (padrão: 100 1000 10000 100000)")
+    parser.add_argument('--resultados', default='resultados_completos.json',
+                        help="JSON de uma execução real usado na calibração")
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--salvar-baseline', action='store_true',
+                        help="grava esta execução como novo baseline")
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help="piora relativa aceita antes de acusar regressão (padrão: 0.25)")
+    parser.add_argument('--sem-memoria', action='store_true',
+                        help="mede só o tempo (sem a segunda execução sob tracemalloc)")
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+    
+    print("="*80)
+    print("BENCHMARK DO PIPELINE")
+    print("="*80)
+    
+    parametros = calibrar(args.resultados)
+    print(f"Calibração: {len(parametros['n_direct'])} sites de referência, "
+          f"{parametros['frac_compartilhada']:.0%} das entradas DIRECT compartilhadas, "
+          f"Zipf s={parametros['expoente_zipf']:.2f}")
+    
+    resultados = executar_benchmark(args.tamanhos, parametros, not args.sem_memoria, args.semente)
+    
+    saida = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'plataforma': {'python': platform.python_version(), 'sistema': platform.platform(),
+                       'processador': platform.processor() or platform.machine(), 'cpus': os.cpu_count()},
+        'semente': args.semente,
+        'resultados': resultados
+    }
+    
+    regressoes = []
+    if os.path.exists(args.baseline) and not args.salvar_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressoes = comparar_baseline(resultados, baseline, args.tolerancia)
+        saida['baseline'] = {'arquivo': args.baseline, 'gerado_em': baseline.get('gerado_em'),
+                             'tolerancia': args.tolerancia, 'regressoes': regressoes}
+    
+    with open('benchmark_resultados.json', 'w', encoding='utf-8') as f:
+        json.dump(saida, f, indent=2, ensure_ascii=False)
+    print("\n✓ benchmark_resultados.json")
+    
+    if args.salvar_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(saida, f, indent=2, ensure_ascii=False)
+        print(f"✓ {args.baseline}")
+    elif 'baseline' in saida:
+        if regressoes:
+            print(f"\n✗ {len(regressoes)} regressão(ões) em relação a {args.baseline}:")
+            for r in regressoes:
+                print(f"  {r['tamanho']:>7,} sites  {r['etapa']:35} {r['medida']}: "
+                      f"{r['baseline']} -> {r['atual']} (+{r['variacao']:.0%})")
+            sys.exit(1)
+        print(f"✓ Sem regressões em relação a {args.baseline} (tolerância {args.tolerancia:.0%})")
@@ -0,0 +1,338 @@
+"""
+INSTRUMENTAÇÃO DO PIPELINE
+Tempo e memória por etapa, latência da coleta por domínio e arquivo de trace
+
+MEDIDAS:
+- etapas: tempo de parede, RSS atual e pico do processo e, com tracemalloc,
+  pico de memória alocada por etapa
+- coleta: por domínio, DNS, conexão (TCP + handshake TLS: o aiohttp não
+  separa os dois), espera até os cabeçalhos e download do corpo, mais o nº
+  de retentativas e a variante de URL que serviu o ads.txt; o resumo traz
+  percentis e histogramas de cada fase
+
+O trace (--trace) usa o formato JSON de eventos do Chrome: abre em
+chrome://tracing ou https://ui.perfetto.dev
+"""
+
+import heapq
+import json
+import os
+import time
+import tracemalloc
+import numpy as np
+from collections import Counter
+from typing import Dict, List
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+FASES_REQUISICAO = ('dns', 'conexao', 'espera', 'corpo', 'total')
+PERCENTIS = (50, 90, 95, 99)
+
+# Limites superiores (ms) das faixas dos histogramas de latência; a última é aberta
+LIMITES_HISTOGRAMA_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000)
+
+MAIS_LENTOS = 20
+
+# ============================================================================
+# MEMÓRIA DO PROCESSO
+# ============================================================================
+
+def rss_mb() -> Dict[str, float]:
+    """RSS atual (Linux, /proc) e pico do processo até agora, em MB"""
+    medida = {}
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            medida['rss_mb'] = round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    if HAS_RESOURCE:
+        # ru_maxrss vem em KB no Linux e em bytes no macOS
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        medida['rss_pico_mb'] = round(pico / (1024 ** 2 if os.uname().sysname == 'Darwin' else 1024), 1)
+    return medida
+
+# ============================================================================
+# ESTATÍSTICAS DE LATÊNCIA
+# ============================================================================
+
+def resumir_latencias(valores_s: List[float]) -> Dict:
+    """
+    Percentis, média, máximo e histograma (em ms) de uma lista de durações em segundos.
+    
+    histograma[i] conta as durações até LIMITES_HISTOGRAMA_MS[i]; a última posição, as acima do último limite.
+    """
+    if not valores_s:
+        return {'n': 0}
+    ms = np.asarray(valores_s) * 1000
+    contagens = np.bincount(np.searchsorted(LIMITES_HISTOGRAMA_MS, ms), minlength=len(LIMITES_HISTOGRAMA_MS) + 1)
+    return {
+        'n': len(ms),
+        'media_ms': round(float(ms.mean()), 2),
+        **{f"p{p}_ms": round(float(v), 2) for p, v in zip(PERCENTIS, np.percentile(ms, PERCENTIS))},
+        'max_ms': round(float(ms.max()), 2),
+        'histograma': contagens.tolist()
+    }
+
+# ============================================================================
+# MEDIÇÃO DE UMA REQUISIÇÃO
+# ============================================================================
+
+def nova_medicao(domain: str) -> Dict:
+    """
+    Registro de latência de um domínio, preenchido durante a coleta.
+    
+    É um dict simples para atravessar filas entre processos: fases soma as
+    durações (s) de todas as tentativas e redirecionamentos (da variante de
+    URL escolhida, quando várias são disputadas); marcos guarda
+    [fase, início (epoch), duração] de cada trecho, usados só pelo trace;
+    total (preenchido ao concluir) é o tempo de parede do domínio, incluindo
+    falhas antes das fases e as esperas entre tentativas.
+    """
+    return {
+        'domain': domain,
+        'inicio': time.time(),
+        'fases': dict.fromkeys(FASES_REQUISICAO[:-1], 0.0),
+        'marcos': [],
+        'tentativas': 0,
+        'conexoes_reutilizadas': 0,
+        'origem': 'rede'
+    }
+
+def marcar_fase(medicao: Dict, fase: str, inicio: float, duracao: float):
+    """Soma duracao (s) à fase e guarda o trecho; inicio em segundos epoch"""
+    medicao['fases'][fase] += duracao
+    medicao['marcos'].append([fase, inicio, duracao])
+
+def somar_medicao(medicao: Dict, parcial: Dict):
+    """Soma à medição as fases, trechos e conexões reutilizadas de uma medição parcial (ex.: de uma variante)"""
+    for fase, duracao in parcial['fases'].items():
+        medicao['fases'][fase] += duracao
+    medicao['marcos'].extend(parcial['marcos'])
+    medicao['conexoes_reutilizadas'] += parcial['conexoes_reutilizadas']
+    medicao['retry_after'] = parcial.get('retry_after')
+
+def criar_trace_config():
+    """
+    TraceConfig do aiohttp que preenche a medição passada em
+    session.get(..., trace_request_ctx=medicao).
+    
+    Conexão = criação da conexão menos a resolução DNS; espera = da conexão
+    pronta (ou do início, com conexão reutilizada) até os cabeçalhos.
+    """
+    import aiohttp
+    
+    async def inicio_requisicao(session, ctx, params):
+        ctx.marcas = {}
+        ctx.pronta = time.time()
+    
+    async def inicio_dns(session, ctx, params):
+        ctx.marcas['dns'] = time.time()
+    
+    async def fim_dns(session, ctx, params):
+        inicio = ctx.marcas.pop('dns', None)
+        if inicio is None:
+            return
+        duracao = time.time() - inicio
+        ctx.marcas['dns_total'] = ctx.marcas.get('dns_total', 0.0) + duracao
+        if ctx.trace_request_ctx is not None:
+            marcar_fase(ctx.trace_request_ctx, 'dns', inicio, duracao)
+    
+    async def inicio_conexao(session, ctx, params):
+        ctx.marcas['conexao'] = time.time()
+        ctx.marcas['dns_total'] = 0.0
+    
+    async def fim_conexao(session, ctx, params):
+        medicao = ctx.trace_request_ctx
+        inicio = ctx.marcas.pop('conexao', None)
+        ctx.pronta = time.time()
+        if medicao is not None and inicio is not None:
+            dns = ctx.marcas.get('dns_total', 0.0)
+            marcar_fase(medicao, 'conexao', inicio + dns, max(ctx.pronta - inicio - dns, 0.0))
+    
+    async def conexao_reutilizada(session, ctx, params):
+        ctx.pronta = time.time()
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx['conexoes_reutilizadas'] += 1
+    
+    async def fim_requisicao(session, ctx, params):
+        medicao = ctx.trace_request_ctx
+        if medicao is not None:
+            marcar_fase(medicao, 'espera', ctx.pronta, time.time() - ctx.pronta)
+    
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(inicio_requisicao)
+    trace_config.on_dns_resolvehost_start.append(inicio_dns)
+    trace_config.on_dns_resolvehost_end.append(fim_dns)
+    trace_config.on_connection_create_start.append(inicio_conexao)
+    trace_config.on_connection_create_end.append(fim_conexao)
+    trace_config.on_connection_reuseconn.append(conexao_reutilizada)
+    trace_config.on_request_end.append(fim_requisicao)
+    trace_config.on_request_redirect.append(fim_requisicao)
+    return trace_config
+
+# ============================================================================
+# INSTRUMENTAÇÃO
+# ============================================================================
+
+class Instrumentacao:
+    """
+    Coleta as medidas de uma execução.
+    
+    Etapas são marcadas em sequência (etapa() encerra a anterior). Com
+    memoria=True o tracemalloc fica ligado e cada etapa registra o pico de
+    memória alocada (deixa o pipeline mais lento). Com latencia=True a coleta
+    instala criar_trace_config na sessão e mede DNS, conexão e espera de cada
+    domínio; sem ela só o tempo total e o download do corpo são medidos. Com
+    trace=True (que liga latencia) os eventos são guardados para
+    salvar_trace. Com repassar=True (trabalhadores da
+    coleta multiprocesso) as medições não são agregadas: ficam em pendentes
+    até serem enviadas ao coordenador.
+    """
+    
+    def __init__(self, memoria: bool = False, trace: bool = False, repassar: bool = False,
+                 latencia: bool = False):
+        self.memoria = memoria
+        self.trace = trace
+        self.latencia = latencia or trace
+        self.repassar = repassar
+        self.inicio = time.time()
+        self.etapas = {}
+        self._etapa_atual = None
+        self.eventos = []
+        self.pendentes = {}
+        
+        self.latencias = {fase: [] for fase in FASES_REQUISICAO}
+        self.retentativas = Counter()
+        self.por_origem = Counter()
+        self.por_status = Counter()
+        self.por_variante = Counter()
+        self.conexoes_reutilizadas = 0
+        self._mais_lentos = []
+        self.grupos = {}
+    
+    def etapa(self, nome: str):
+        """Encerra a etapa em andamento (se houver) e inicia nome"""
+        self.encerrar()
+        if self.memoria:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._etapa_atual = (nome, time.time(), time.perf_counter())
+    
+    def encerrar(self):
+        """Encerra a etapa em andamento"""
+        if self._etapa_atual is None:
+            return
+        nome, inicio, inicio_perf = self._etapa_atual
+        self._etapa_atual = None
+        
+        medida = {'tempo_s': round(time.perf_counter() - inicio_perf, 4), **rss_mb()}
+        if self.memoria and tracemalloc.is_tracing():
+            medida['pico_alocado_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 2)
+        self.etapas[nome] = medida
+        
+        if self.trace:
+            self.eventos.append({'name': nome, 'cat': 'etapa', 'ph': 'X', 'pid': 1, 'tid': 1,
+                                 'ts': self._us(inicio), 'dur': int(medida['tempo_s'] * 1e6), 'args': medida})
+    
+    def finalizar(self):
+        """Encerra a última etapa e desliga o tracemalloc"""
+        self.encerrar()
+        if self.memoria and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    
+    def registrar_requisicao(self, medicao: Dict, status: str):
+        """Agrega a medição de um domínio já concluído (status: 'ok' ou o erro)"""
+        if self.repassar:
+            medicao['status'] = status
+            self.pendentes[medicao['domain']] = medicao
+            return
+        
+        status = 'ok' if status in ('', 'ok') else status.split(':')[0][:40]
+        self.por_origem[medicao['origem']] += 1
+        self.por_status[status] += 1
+        if medicao['origem'] != 'rede':
+            return
+        
+        total = medicao.get('total', sum(medicao['fases'].values()))
+        # Fases que não chegaram a acontecer (ex.: falha de DNS) não entram nos percentis
+        ocorridas = {fase for fase, _, _ in medicao['marcos']}
+        for fase, duracao in medicao['fases'].items():
+            if fase in ocorridas:
+                self.latencias[fase].append(duracao)
+        self.latencias['total'].append(total)
+        self.retentativas[medicao['tentativas'] - 1] += 1
+        if medicao.get('variante'):
+            self.por_variante[medicao['variante']] += 1
+        self.conexoes_reutilizadas += medicao['conexoes_reutilizadas']
+        
+        registro = (total, medicao['domain'], {fase: round(d * 1000, 1) for fase, d in medicao['fases'].items()})
+        if len(self._mais_lentos) < MAIS_LENTOS:
+            heapq.heappush(self._mais_lentos, registro)
+        elif total > self._mais_lentos[0][0]:
+            heapq.heapreplace(self._mais_lentos, registro)
+        
+        if self.trace:
+            self._eventos_requisicao(medicao, status)
+    
+    def registrar_grupos(self, resumo: Dict, chave: str = 'grupos_hospedagem'):
+        """Resumo de vazão por grupo de hospedagem de uma coleta (sites ou referências), em chave"""
+        self.grupos[chave] = resumo
+    
+    def _eventos_requisicao(self, medicao: Dict, status: str):
+        # Eventos assíncronos (b/e): requisições simultâneas se sobrepõem livremente
+        identificador = f"0x{abs(hash(medicao['domain'])):x}"
+        fim = medicao['inicio'] + medicao.get('total', sum(medicao['fases'].values()))
+        base = {'cat': 'coleta', 'pid': 1, 'tid': 2, 'id': identificador}
+        self.eventos.append({**base, 'name': medicao['domain'], 'ph': 'b', 'ts': self._us(medicao['inicio']),
+                             'args': {'tentativas': medicao['tentativas'], 'status': status}})
+        for fase, inicio, duracao in medicao['marcos']:
+            self.eventos.append({**base, 'name': fase, 'ph': 'b', 'ts': self._us(inicio)})
+            self.eventos.append({**base, 'name': fase, 'ph': 'e', 'ts': self._us(inicio + duracao)})
+        self.eventos.append({**base, 'name': medicao['domain'], 'ph': 'e', 'ts': self._us(fim)})
+    
+    def _us(self, instante: float) -> int:
+        return int((instante - self.inicio) * 1e6)
+    
+    def resumo(self) -> Dict:
+        """Medidas agregadas, no formato gravado em metadata['instrumentacao']"""
+        resumo = {
+            'etapas': {nome: dict(medida) for nome, medida in self.etapas.items()},
+            'memoria_alocada_medida': self.memoria,
+            'latencia_por_fase_medida': self.latencia,
+            'processo': rss_mb()
+        }
+        if self.por_origem:
+            resumo['coleta'] = {
+                'dominios': sum(self.por_origem.values()),
+                'por_origem': dict(self.por_origem),
+                'por_status': dict(self.por_status.most_common()),
+                'retentativas': {
+                    'total': sum(n * vezes for n, vezes in self.retentativas.items()),
+                    'dominios_por_retentativas': {str(n): v for n, v in sorted(self.retentativas.items())}
+                },
+                'conexoes_reutilizadas': self.conexoes_reutilizadas,
+                'variantes_vencedoras': dict(self.por_variante.most_common()),
+                'limites_histograma_ms': list(LIMITES_HISTOGRAMA_MS),
+                'latencia': {fase: resumir_latencias(valores) for fase, valores in self.latencias.items()},
+                'mais_lentos': [
+                    {'domain': domain, 'total_ms': round(total * 1000, 1), 'fases_ms': fases}
+                    for total, domain, fases in sorted(self._mais_lentos, reverse=True)
+                ]
+            }
+            resumo['coleta'].update(self.grupos)
+        return resumo
+    
+    def salvar_trace(self, caminho: str):
+        """Grava os eventos no formato JSON de trace do Chrome/Perfetto"""
+        metadados = [
+            {'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'analise_dark_pools'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 1, 'args': {'name': 'etapas'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 2, 'args': {'name': 'coleta'}}
+        ]
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadados + self.eventos, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,569 @@
+"""
+PIPELINE EM GRAFO DE DEPENDÊNCIAS - ARTEFATOS MEMOIZADOS
+Executa as etapas dos dois scripts, da coleta à integração, como um DAG
+
+Cada etapa declara as etapas de que depende, seus parâmetros e as funções
+de análise que chama. A saída é guardada em .cache_pipeline/<etapa>/<chave>.pkl,
+com chave = hash do nome, do código (dessas funções e de tudo do projeto que
+elas usam, transitivamente: helpers, classes e constantes de módulo), dos
+parâmetros e do conteúdo de cada entrada. Mudar um parâmetro ou o código de
+uma etapa recalcula só ela e o que depende dela; se a nova saída for idêntica
+à anterior, as etapas seguintes continuam em cache. Com --processos N, etapas
+independentes (ex.: brokers, clustering e integração) rodam em paralelo, cada
+uma em um único processo.
+
+ETAPAS:
+coleta ─ incidencia ─ pools ─┬─ metricas ─┬─ testes
+                             │            └─ estrategias (clustering)
+                             ├─ composicao (modelo nulo)
+                             └─ grafo ─┬─ vulnerabilidade
+                                       ├─ brokers
+                                       └─ integracao
+
+A coleta acessa a rede e roda sempre (o cache HTTP evita baixar o que não
+mudou); com --offline ela lê do checkpoint os sites da lista, na ordem dela,
+e só roda se o arquivo ou a lista mudar.
+
+EXECUÇÃO:
+python pipeline_dag.py
+python pipeline_dag.py --offline --processos 4
+python pipeline_dag.py --offline --peso-minimo 2        (recalcula só integracao)
+python pipeline_dag.py --offline --forcar brokers
+python pipeline_dag.py --listar
+
+OUTPUTS: resultados_colunares.npz e resultados_redes.json, os mesmos dos
+dois scripts; metadata['pipeline'] registra o estado de cada etapa
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List
+
+from analise_completa_darkpools import (ARQUIVO_COLUNAR, GRUPOS_EDITORIAIS, N_ALEATORIZACOES, N_REAMOSTRAS,
+                                        PROFUNDIDADE_REFERENCIAS, SITES, CacheHTTP, CheckpointColeta, EscritorJSON,
+                                        FronteiraReferencias, MemoVariantes, analisar_composicao_pools,
+                                        calcular_estatisticas_categoria, calcular_metricas_lote, coletar_sites,
+                                        coletar_sites_multiprocesso, construir_incidencia,
+                                        executar_testes_estatisticos, executar_testes_reamostragem,
+                                        identificar_dark_pools, identificar_dark_pools_vetorizado,
+                                        impressao_grupos, ler_grupos_editoriais, ler_lista_sites, registro_coleta,
+                                        salvar_resultados_colunares, testar_modelo_nulo, trocar_arestas)
+from analise_de_redes import (N_EXECUCOES_LOUVAIN, analisar_estrategias, analisar_integracao,
+                              analisar_vulnerabilidade, betweenness_amostrada, construir_grafo_bipartido,
+                              identificar_brokers, louvain_consenso, projetar_sites)
+
+DIRETORIO_CACHE_PIPELINE = '.cache_pipeline'
+VERSOES_POR_ETAPA = 3        # artefatos guardados por etapa (os mais recentes)
+DIRETORIO_PROJETO = os.path.dirname(os.path.abspath(__file__))
+N_LOTES_MODELO_NULO = 16     # lotes do modelo nulo: definem as sementes, logo fixos (não seguem --processos)
+TIPOS_CONSTANTES = (bool, int, float, complex, str, bytes, tuple, list, dict, set, frozenset, type(None))
+
+# ============================================================================
+# IMPRESSÃO DO CÓDIGO
+# ============================================================================
+
+def _do_projeto(objeto) -> bool:
+    """Se objeto foi definido em um módulo deste diretório (e não numa biblioteca)"""
+    arquivo = getattr(sys.modules.get(getattr(objeto, '__module__', None) or ''), '__file__', None)
+    return arquivo is not None and os.path.dirname(os.path.abspath(arquivo)) == DIRETORIO_PROJETO
+
+def _nomes_globais(codigo) -> set:
+    """Nomes globais (e atributos) citados por um code object e pelos aninhados nele"""
+    nomes = set(codigo.co_names)
+    for constante in codigo.co_consts:
+        if inspect.iscode(constante):
+            nomes |= _nomes_globais(constante)
+    return nomes
+
+def fontes_codigo(objetos: Iterable) -> Dict[str, str]:
+    """
+    Código de que os objetos dependem, por nome qualificado.
+    
+    Funções e classes do projeto entram com o código-fonte e são seguidas
+    recursivamente (inclusive métodos e classes base); constantes de módulo
+    que elas citam entram com o valor serializado. Bibliotecas ficam de fora.
+    """
+    fontes = {}
+    pilha = list(objetos)
+    while pilha:
+        objeto = pilha.pop()
+        nome = f"{objeto.__module__}.{objeto.__qualname__}"
+        if nome in fontes:
+            continue
+        fontes[nome] = inspect.getsource(objeto)
+        
+        if inspect.isclass(objeto):
+            pilha.extend(base for base in objeto.__mro__[1:] if _do_projeto(base))
+            globais = sys.modules[objeto.__module__].__dict__
+            membros = [getattr(m, '__func__', getattr(m, 'fget', m)) for m in vars(objeto).values()]
+            codigos = [m.__code__ for m in membros if inspect.isfunction(m)]
+        else:
+            globais = objeto.__globals__
+            codigos = [objeto.__code__]
+        
+        for codigo in codigos:
+            for citado in _nomes_globais(codigo):
+                if citado not in globais:
+                    continue
+                valor = globais[citado]
+                if inspect.isfunction(valor) or inspect.isclass(valor):
+                    if _do_projeto(valor):
+                        pilha.append(valor)
+                elif isinstance(valor, TIPOS_CONSTANTES):
+                    fontes.setdefault(f"{globais['__name__']}.{citado}", hash_valor(valor))
+    return fontes
+
+# ============================================================================
+# ETAPAS
+# ============================================================================
+
+class Etapa:
+    """
+    Nó do pipeline: funcao(entradas, parametros, contexto) -> artefato.
+    
+    entradas traz os artefatos das dependências (por nome). parametros entra
+    na chave do cache; contexto (nº de processos, lista de sites...) não.
+    codigo lista as funções de análise cujo código-fonte também entra na
+    chave, com tudo do projeto que elas e funcao usam (fontes_codigo).
+    Etapas voláteis (coleta online) rodam sempre.
+    """
+    
+    def __init__(self, nome: str, funcao: Callable, dependencias: Iterable[str] = (),
+                 parametros: Dict = None, codigo: Iterable[Callable] = (), volatil: bool = False):
+        self.nome = nome
+        self.funcao = funcao
+        self.dependencias = tuple(dependencias)
+        self.parametros = parametros or {}
+        self.codigo = tuple(codigo)
+        self.volatil = volatil
+    
+    def impressao_codigo(self) -> str:
+        h = hashlib.sha256()
+        for nome, fonte in sorted(fontes_codigo((self.funcao,) + self.codigo).items()):
+            h.update(f"{nome}\n{fonte}\n".encode('utf-8'))
+        return h.hexdigest()
+
+def _sites_com_metricas(coleta: Dict, metricas: Dict) -> Dict:
+    """sites_data da coleta com as métricas de cada site, sem alterar os artefatos"""
+    return {nome: dict(data, metricas=metricas[nome]) if nome in metricas else data
+            for nome, data in coleta.items()}
+
+def _etapa_coleta(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    checkpoint = CheckpointColeta(contexto['checkpoint'], retomar=parametros['offline'])
+    sites = contexto['sites']
+    ordem = {site['name']: i for i, site in enumerate(sites)}
+    if parametros['offline']:
+        # Como no script principal: só os sites da lista atual, na ordem dela
+        coletados = checkpoint.carregar()
+        return {nome: coletados[nome] for nome in ordem if nome in coletados}
+    
+    sites_data = {}
+    variantes = MemoVariantes(contexto['variantes']) if contexto.get('variantes') else None
+    
+    def registrar(site, resultado):
+        url = variantes.url(site['domain']) if variantes is not None else None
+        sites_data[site['name']] = registro_coleta(site, resultado, url)
+        checkpoint.registrar(site['name'], sites_data[site['name']])
+    
+    cache = CacheHTTP(contexto['cache_dir'])
+    try:
+        if contexto['n_processos'] > 1:
+            coletar_sites_multiprocesso(sites, registrar, contexto['n_processos'], cache_dir=contexto['cache_dir'],
+                                        variantes=variantes)
+        else:
+            coletar_sites(sites, registrar, cache=cache, variantes=variantes)
+        
+        if parametros['profundidade_referencias'] > 0:
+            fronteira = FronteiraReferencias(parametros['profundidade_referencias'])
+            fronteira.seguir(sites_data, lambda fonte, ao_concluir: coletar_sites(fonte, ao_concluir, cache=cache,
+                                                                                 variantes=variantes))
+            for nome in fronteira.anexar(sites_data):
+                checkpoint.registrar(nome, sites_data[nome])
+    finally:
+        checkpoint.fechar()
+        if variantes is not None:
+            variantes.salvar()
+    return {nome: sites_data[nome] for nome in sorted(sites_data, key=ordem.get)}
+
+def _etapa_incidencia(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    return construir_incidencia(entradas['coleta'])
+
+def _etapa_pools(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    return identificar_dark_pools(entradas['coleta'], parametros['grupos_editoriais'], entradas['incidencia'])
+
+def _etapa_metricas(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    sites = {nome: dict(data) for nome, data in entradas['coleta'].items()}
+    estatisticas = calcular_estatisticas_categoria(sites, entradas['pools'], entradas['incidencia'])
+    return {
+        'estatisticas': estatisticas,
+        'metricas': {nome: data['metricas'] for nome, data in sites.items() if 'metricas' in data}
+    }
+
+def _etapa_testes(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    sites = _sites_com_metricas(entradas['coleta'], entradas['metricas']['metricas'])
+    reamostragem = {}
+    if parametros['n_reamostras'] > 0:
+        reamostragem = executar_testes_reamostragem(sites, parametros['n_reamostras'], contexto['n_processos'])
+    return {'testes': executar_testes_estatisticos(sites), 'testes_reamostragem': reamostragem}
+
+def _etapa_composicao(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    composicao = analisar_composicao_pools(entradas['pools'])
+    incidencia = entradas['incidencia']
+    if parametros['n_aleatorizacoes'] > 0 and incidencia['DIRECT'].nnz > 0:
+        # Os lotes definem as sementes (parâmetro); o nº de processos só a execução (contexto)
+        composicao['modelo_nulo'] = testar_modelo_nulo(incidencia, parametros['grupos_editoriais'],
+                                                       parametros['n_aleatorizacoes'], contexto['n_processos'],
+                                                       n_lotes=parametros['n_lotes'])
+    return composicao
+
+def _etapa_grafo(entradas: Dict, parametros: Dict, contexto: Dict):
+    return construir_grafo_bipartido(entradas['coleta'], {'pools': entradas['pools']}, entradas['incidencia'])
+
+def _etapa_vulnerabilidade(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    G, _ = entradas['grafo']
+    return analisar_vulnerabilidade(G, entradas['coleta'], entradas['incidencia'])
+
+def _etapa_estrategias(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    return analisar_estrategias(_sites_com_metricas(entradas['coleta'], entradas['metricas']['metricas']))
+
+def _etapa_brokers(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    G, _ = entradas['grafo']
+    return identificar_brokers(G, entradas['coleta'], parametros['amostras_betweenness'], contexto['n_processos'])
+
+def _etapa_integracao(entradas: Dict, parametros: Dict, contexto: Dict) -> Dict:
+    G, _ = entradas['grafo']
+    return analisar_integracao(G, parametros['peso_minimo'], parametros['n_execucoes_louvain'],
+                               contexto['n_processos'])
+
+def declarar_etapas(offline: bool = False, checkpoint: str = 'coleta_checkpoint.jsonl',
+                    grupos_editoriais: Dict = None, n_aleatorizacoes: int = N_ALEATORIZACOES,
+                    n_reamostras: int = N_REAMOSTRAS,
+                    amostras_betweenness: int = None, peso_minimo: int = 1,
+                    n_execucoes_louvain: int = N_EXECUCOES_LOUVAIN,
+                    profundidade_referencias: int = PROFUNDIDADE_REFERENCIAS,
+                    sites: List[Dict] = None) -> Dict[str, Etapa]:
+    """Etapas dos dois scripts com seus parâmetros, em ordem topológica"""
+    if grupos_editoriais is None:
+        grupos_editoriais = GRUPOS_EDITORIAIS
+    if sites is None:
+        sites = SITES
+    
+    # Offline, a coleta é função do conteúdo do checkpoint e da lista de sites (filtro e ordem)
+    parametros_coleta = {'offline': offline, 'profundidade_referencias': profundidade_referencias}
+    if offline:
+        parametros_coleta['checkpoint'] = hash_arquivo(checkpoint)
+        parametros_coleta['sites'] = hash_valor([site['name'] for site in sites])
+    
+    etapas = [
+        Etapa('coleta', _etapa_coleta, (), parametros_coleta,
+              codigo=(registro_coleta, CheckpointColeta, FronteiraReferencias), volatil=not offline),
+        Etapa('incidencia', _etapa_incidencia, ('coleta',), codigo=(construir_incidencia,)),
+        Etapa('pools', _etapa_pools, ('coleta', 'incidencia'), {'grupos_editoriais': grupos_editoriais},
+              codigo=(identificar_dark_pools, identificar_dark_pools_vetorizado)),
+        Etapa('metricas', _etapa_metricas, ('coleta', 'incidencia', 'pools'),
+              codigo=(calcular_estatisticas_categoria, calcular_metricas_lote)),
+        Etapa('testes', _etapa_testes, ('coleta', 'metricas'), {'n_reamostras': n_reamostras},
+              codigo=(executar_testes_estatisticos, executar_testes_reamostragem)),
+        Etapa('composicao', _etapa_composicao, ('incidencia', 'pools'),
+              {'grupos_editoriais': grupos_editoriais, 'n_aleatorizacoes': n_aleatorizacoes,
+               'n_lotes': N_LOTES_MODELO_NULO},
+              codigo=(analisar_composicao_pools, testar_modelo_nulo, trocar_arestas)),
+        Etapa('grafo', _etapa_grafo, ('coleta', 'incidencia', 'pools'), codigo=(construir_grafo_bipartido,)),
+        Etapa('vulnerabilidade', _etapa_vulnerabilidade, ('coleta', 'incidencia', 'grafo'),
+              codigo=(analisar_vulnerabilidade,)),
+        Etapa('estrategias', _etapa_estrategias, ('coleta', 'metricas'), codigo=(analisar_estrategias,)),
+        Etapa('brokers', _etapa_brokers, ('coleta', 'grafo'), {'amostras_betweenness': amostras_betweenness},
+              codigo=(identificar_brokers, betweenness_amostrada)),
+        Etapa('integracao', _etapa_integracao, ('grafo',),
+              {'peso_minimo': peso_minimo, 'n_execucoes_louvain': n_execucoes_louvain},
+              codigo=(analisar_integracao, projetar_sites, louvain_consenso)),
+    ]
+    return {etapa.nome: etapa for etapa in etapas}
+
+# ============================================================================
+# CACHE DE ARTEFATOS
+# ============================================================================
+
+def _canonico(obj):
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return str(obj)
+
+def hash_valor(valor) -> str:
+    """Hash estável de parâmetros (conjuntos ordenados, chaves ordenadas)"""
+    texto = json.dumps(valor, sort_keys=True, default=_canonico, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+def hash_arquivo(caminho: str) -> str:
+    """Hash do conteúdo de um arquivo (None se não existir)"""
+    if not os.path.exists(caminho):
+        return None
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+class CacheArtefatos:
+    """Artefatos em pickle por etapa e chave, com o hash do conteúdo ao lado"""
+    
+    def __init__(self, diretorio: str = DIRETORIO_CACHE_PIPELINE, versoes: int = VERSOES_POR_ETAPA):
+        self.diretorio = diretorio
+        self.versoes = versoes
+    
+    def caminho(self, etapa: str, chave: str, sufixo: str = 'pkl') -> str:
+        return os.path.join(self.diretorio, etapa, f"{chave}.{sufixo}")
+    
+    def meta(self, etapa: str, chave: str) -> Dict:
+        """Metadados do artefato (None se ausente ou incompleto)"""
+        try:
+            with open(self.caminho(etapa, chave, 'json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(self.caminho(etapa, chave)) else None
+    
+    def carregar(self, etapa: str, chave: str):
+        with open(self.caminho(etapa, chave), 'rb') as f:
+            return pickle.load(f)
+    
+    def guardar(self, etapa: str, chave: str, artefato, tempo_s: float) -> Dict:
+        """Grava o artefato (atomicamente) e devolve seus metadados"""
+        os.makedirs(os.path.join(self.diretorio, etapa), exist_ok=True)
+        conteudo = pickle.dumps(artefato, protocol=pickle.HIGHEST_PROTOCOL)
+        meta = {
+            'hash_conteudo': hashlib.sha256(conteudo).hexdigest(),
+            'tamanho': len(conteudo),
+            'tempo_s': round(tempo_s, 4),
+            'criado_em': datetime.now().isoformat(timespec='seconds')
+        }
+        for sufixo, dados in (('pkl', conteudo), ('json', json.dumps(meta).encode('utf-8'))):
+            caminho = self.caminho(etapa, chave, sufixo)
+            with open(caminho + '.tmp', 'wb') as f:
+                f.write(dados)
+            os.replace(caminho + '.tmp', caminho)
+        self._podar(etapa)
+        return meta
+    
+    def _podar(self, etapa: str):
+        diretorio = os.path.join(self.diretorio, etapa)
+        artefatos = sorted((os.path.join(diretorio, nome) for nome in os.listdir(diretorio) if nome.endswith('.pkl')),
+                           key=os.path.getmtime, reverse=True)
+        for caminho in artefatos[self.versoes:]:
+            for sufixo in ('.pkl', '.json'):
+                try:
+                    os.remove(caminho[:-4] + sufixo)
+                except FileNotFoundError:
+                    pass
+
+# ============================================================================
+# EXECUÇÃO DO GRAFO
+# ============================================================================
+
+def _executar_etapa(etapa: Etapa, chave: str, chaves_entradas: Dict[str, str], contexto: Dict,
+                    diretorio: str) -> Dict:
+    """Roda uma etapa (no processo atual ou num trabalhador) e grava a saída no cache"""
+    cache = CacheArtefatos(diretorio)
+    entradas = {nome: cache.carregar(nome, chave_entrada) for nome, chave_entrada in chaves_entradas.items()}
+    inicio = time.perf_counter()
+    artefato = etapa.funcao(entradas, etapa.parametros, contexto)
+    return cache.guardar(etapa.nome, chave, artefato, time.perf_counter() - inicio)
+
+class ExecutorPipeline:
+    """
+    Resolve as etapas necessárias para os alvos, reaproveitando o cache.
+    
+    A chave de cada etapa só pode ser calculada quando as dependências
+    terminaram (usa o hash do conteúdo delas); etapas prontas são disparadas
+    assim que possível, até n_processos ao mesmo tempo. Artefatos em cache só
+    são lidos do disco quando alguma etapa recalculada ou o chamador precisa.
+    """
+    
+    def __init__(self, etapas: Dict[str, Etapa], contexto: Dict = None, n_processos: int = 1,
+                 diretorio: str = DIRETORIO_CACHE_PIPELINE, forcar: Iterable[str] = ()):
+        self.etapas = etapas
+        self.contexto = dict(contexto or {}, n_processos=n_processos)
+        self.n_processos = n_processos
+        self.cache = CacheArtefatos(diretorio)
+        self.forcar = set(forcar)
+        self.chaves = {}
+        self.estado = {}
+        self._carregados = {}
+    
+    def _necessarias(self, alvos: Iterable[str]) -> List[str]:
+        necessarias = set()
+        pilha = list(alvos)
+        while pilha:
+            nome = pilha.pop()
+            if nome not in necessarias:
+                necessarias.add(nome)
+                pilha.extend(self.etapas[nome].dependencias)
+        return [nome for nome in self.etapas if nome in necessarias]
+    
+    def _chave(self, etapa: Etapa) -> str:
+        return hash_valor({
+            'etapa': etapa.nome,
+            'codigo': etapa.impressao_codigo(),
+            'parametros': hash_valor(etapa.parametros),
+            'entradas': {dep: self.estado[dep]['hash_conteudo'] for dep in etapa.dependencias}
+        })
+    
+    def executar(self, alvos: Iterable[str] = None) -> Dict[str, Dict]:
+        """Executa o necessário para os alvos (padrão: todas as etapas); devolve o estado de cada etapa"""
+        pendentes = self._necessarias(alvos or list(self.etapas))
+        em_execucao = {}
+        pool = ProcessPoolExecutor(self.n_processos) if self.n_processos > 1 else None
+        try:
+            while pendentes or em_execucao:
+                prontas = [nome for nome in pendentes
+                           if all(dep in self.estado for dep in self.etapas[nome].dependencias)]
+                for nome in prontas:
+                    pendentes.remove(nome)
+                    etapa = self.etapas[nome]
+                    chave = self.chaves[nome] = self._chave(etapa)
+                    meta = self.cache.meta(nome, chave)
+                    if meta and not etapa.volatil and nome not in self.forcar:
+                        self.estado[nome] = dict(meta, chave=chave, origem='cache')
+                        print(f"  {nome:16} cache")
+                        continue
+                    
+                    # No pool, cada etapa já ocupa um processo: nada de pools aninhados dentro dela
+                    contexto = self.contexto if pool is None else dict(self.contexto, n_processos=1)
+                    tarefa = (etapa, chave, {dep: self.chaves[dep] for dep in etapa.dependencias},
+                              contexto, self.cache.diretorio)
+                    if pool is None:
+                        print(f"  {nome:16} calculando...", flush=True)
+                        self._concluir(nome, _executar_etapa(*tarefa))
+                    else:
+                        print(f"  {nome:16} disparada", flush=True)
+                        em_execucao[pool.submit(_executar_etapa, *tarefa)] = nome
+                
+                if prontas or not em_execucao:
+                    continue
+                concluidas, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+                for futuro in concluidas:
+                    self._concluir(em_execucao.pop(futuro), futuro.result())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return self.estado
+    
+    def _concluir(self, nome: str, meta: Dict):
+        self.estado[nome] = dict(meta, chave=self.chaves[nome], origem='calculada')
+        print(f"  {nome:16} ✓ {meta['tempo_s']:.2f} s")
+    
+    def artefato(self, nome: str):
+        """Saída de uma etapa já executada (lida do cache na primeira vez)"""
+        if nome not in self._carregados:
+            self._carregados[nome] = self.cache.carregar(nome, self.chaves[nome])
+        return self._carregados[nome]
+
+# ============================================================================
+# SAÍDAS
+# ============================================================================
+
+def salvar_saidas(executor: ExecutorPipeline):
+    """Grava resultados_colunares.npz e resultados_redes.json a partir dos artefatos"""
+    coleta = executor.artefato('coleta')
+    incidencia = executor.artefato('incidencia')
+    pools = executor.artefato('pools')
+    metricas = executor.artefato('metricas')
+    testes = executor.artefato('testes')
+    composicao = executor.artefato('composicao')
+    
+    metadata = {
+        'timestamp': datetime.now().isoformat(),
+        'total_sites': len(coleta),
+        'sites_com_adstxt': sum(1 for s in coleta.values() if s['sucesso']),
+        'sellers_direct_unicos': len(incidencia['ordem']['DIRECT']),
+        'sellers_reseller_unicos': len(incidencia['ordem']['RESELLER']),
+        'grupos_editoriais': impressao_grupos(executor.etapas['pools'].parametros['grupos_editoriais']),
+        'pipeline': executor.estado
+    }
+    salvar_resultados_colunares(ARQUIVO_COLUNAR, _sites_com_metricas(coleta, metricas['metricas']), incidencia,
+                                pools, {
+                                    'metadata': metadata,
+                                    'composicao': composicao,
+                                    'estatisticas': metricas['estatisticas'],
+                                    'testes': testes['testes'],
+                                    'testes_reamostragem': testes['testes_reamostragem']
+                                })
+    print(f"✓ {ARQUIVO_COLUNAR}")
+    
+    with EscritorJSON('resultados_redes.json') as escritor:
+        escritor.secao('grafo', executor.artefato('grafo')[1])
+        for secao in ('vulnerabilidade', 'estrategias', 'brokers', 'integracao'):
+            escritor.secao(secao, executor.artefato(secao))
+    print("✓ resultados_redes.json")
+
+# ============================================================================
+# EXECUÇÃO
+# ============================================================================
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Pipeline completo (coleta + rede) com etapas memoizadas")
+    parser.add_argument('--offline', action='store_true',
+                        help="não coleta: parte do checkpoint (a coleta só é refeita se ele mudar)")
+    parser.add_argument('--checkpoint', default='coleta_checkpoint.jsonl')
+    parser.add_argument('--sites', metavar='ARQUIVO',
+                        help="CSV/TSV (.gz) com domínio, categoria e nome (padrão: SITES)")
+    parser.add_argument('--grupos', metavar='ARQUIVO',
+                        help="CSV/TSV com grupo e domínio (padrão: GRUPOS_EDITORIAIS)")
+    parser.add_argument('--categoria-padrao', default='NA')
+    parser.add_argument('--processos', type=int, default=1,
+                        help="etapas independentes em paralelo (cada uma em um processo)")
+    parser.add_argument('--aleatorizacoes', type=int, default=N_ALEATORIZACOES)
+    parser.add_argument('--reamostras', type=int, default=N_REAMOSTRAS)
+    parser.add_argument('--amostras-betweenness', type=int, metavar='K')
+    parser.add_argument('--peso-minimo', type=int, default=1)
+    parser.add_argument('--execucoes-louvain', type=int, default=N_EXECUCOES_LOUVAIN)
+    parser.add_argument('--profundidade-referencias', type=int, default=PROFUNDIDADE_REFERENCIAS,
+                        help="saltos seguidos a partir de subdomain=/OWNERDOMAIN=/... (0 desliga)")
+    parser.add_argument('--forcar', nargs='+', default=[], metavar='ETAPA',
+                        help="recalcula estas etapas mesmo com artefato em cache")
+    parser.add_argument('--cache', default=DIRETORIO_CACHE_PIPELINE, metavar='DIRETORIO')
+    parser.add_argument('--listar', action='store_true',
+                        help="mostra as etapas e dependências e sai")
+    args = parser.parse_args()
+    
+    sites = list(ler_lista_sites(args.sites, args.categoria_padrao)) if args.sites else SITES
+    etapas = declarar_etapas(offline=args.offline, checkpoint=args.checkpoint,
+                             grupos_editoriais=ler_grupos_editoriais(args.grupos) if args.grupos else None,
+                             n_aleatorizacoes=args.aleatorizacoes, n_reamostras=args.reamostras,
+                             amostras_betweenness=args.amostras_betweenness,
+                             peso_minimo=args.peso_minimo, n_execucoes_louvain=args.execucoes_louvain,
+                             profundidade_referencias=args.profundidade_referencias, sites=sites)
+    
+    if args.listar:
+        for etapa in etapas.values():
+            print(f"{etapa.nome:16} <- {', '.join(etapa.dependencias) or '(rede)'}"
+                  f"{'  [volátil]' if etapa.volatil else ''}")
+    else:
+        desconhecidas = set(args.forcar) - set(etapas)
+        if desconhecidas:
+            parser.error(f"etapas desconhecidas: {', '.join(sorted(desconhecidas))}")
+        
+        print("="*80)
+        print("PIPELINE - ETAPAS MEMOIZADAS")
+        print("="*80)
+        contexto = {
+            'sites': sites,
+            'checkpoint': args.checkpoint,
+            'cache_dir': '.cache_adstxt',
+            'variantes': 'variantes_adstxt.json'
+        }
+        executor = ExecutorPipeline(etapas, contexto, args.processos, args.cache, args.forcar)
+        executor.executar()
+        
+        calculadas = [nome for nome, estado in executor.estado.items() if estado['origem'] == 'calculada']
+        print(f"\n{len(calculadas)} de {len(executor.estado)} etapas recalculadas")
+        salvar_saidas(executor)
@@ -0,0 +1,317 @@
+"""
+HISTÓRICO DE ADS.TXT - SNAPSHOTS ENDEREÇADOS POR CONTEÚDO
+Guarda todos os ads.txt coletados ao longo do tempo sem repetir conteúdo
+
+ESTRUTURA (historico_adstxt/):
+- manifesto.jsonl      um registro por coleta: domínio, data, execução, hash
+- vocabulario.txt      sellers ("dominio#publisher_id"), id = nº da linha
+- corpos/ab/<hash>.txt.gz     corpo bruto, gravado uma vez por conteúdo
+- sellers/ab/<hash>.npz       sellers parseados como ids (DIRECT, RESELLER)
+
+EXECUÇÃO:
+python snapshots_adstxt.py execucoes
+python snapshots_adstxt.py sellers globo.com 2025-06-01
+python snapshots_adstxt.py diff 2025-06-01T10:00:00 2025-06-08T10:00:00
+
+Um único processo deve escrever no diretório por vez.
+"""
+
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import numpy as np
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List
+
+# Tipos de relação do ads.txt; analise_completa_darkpools importa daqui
+TIPOS_RELACAO = ('DIRECT', 'RESELLER')
+
+# ============================================================================
+# VOCABULÁRIO PERSISTENTE
+# ============================================================================
+
+class VocabularioPersistente:
+    """Dicionário seller -> id, só com inclusões, espelhado em um arquivo texto"""
+    
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.ids = {}
+        self.sellers = []
+        if os.path.exists(caminho):
+            with open(caminho, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    seller = linha.rstrip('\n')
+                    self.ids[seller] = len(self.sellers)
+                    self.sellers.append(seller)
+        self._novos = []
+    
+    def __len__(self) -> int:
+        return len(self.sellers)
+    
+    def codificar_lista(self, sellers: List[str]) -> np.ndarray:
+        ids = np.empty(len(sellers), dtype=np.int32)
+        for i, seller in enumerate(sellers):
+            seller_id = self.ids.get(seller)
+            if seller_id is None:
+                seller_id = self.ids[seller] = len(self.sellers)
+                self.sellers.append(seller)
+                self._novos.append(seller)
+            ids[i] = seller_id
+        return ids
+    
+    def decodificar(self, ids) -> List[str]:
+        return [self.sellers[i] for i in ids]
+    
+    def salvar(self):
+        """Acrescenta ao arquivo os sellers vistos desde o último salvar"""
+        if self._novos:
+            with open(self.caminho, 'a', encoding='utf-8') as f:
+                f.write(''.join(s + '\n' for s in self._novos))
+            self._novos = []
+
+# ============================================================================
+# REPOSITÓRIO DE SNAPSHOTS
+# ============================================================================
+
+def _limite_data(data) -> str:
+    """Data/datetime/ISO -> limite superior comparável às datas do manifesto"""
+    if isinstance(data, datetime):
+        return data.isoformat(timespec='seconds')
+    if isinstance(data, date):
+        return data.isoformat() + 'T23:59:59'
+    return data + 'T23:59:59' if len(data) == 10 else data
+
+class RepositorioSnapshots:
+    """
+    Histórico de ads.txt endereçado por conteúdo.
+    
+    Corpos idênticos (mesmo SHA-256) são gravados uma vez só, não importa
+    quantos domínios ou execuções os tenham servido; o manifesto liga
+    (domínio, data da coleta, execução) ao hash. Os sellers parseados de
+    cada hash ficam como arrays de ids do vocabulário, comprimidos, então
+    consultas e diffs não reparseiam nada. Sem o corpo (ex.: vindo de um
+    checkpoint), o hash é o do conteúdo parseado.
+    """
+    
+    def __init__(self, diretorio: str = 'historico_adstxt'):
+        self.diretorio = diretorio
+        for sub in ('corpos', 'sellers'):
+            os.makedirs(os.path.join(diretorio, sub), exist_ok=True)
+        self.vocabulario = VocabularioPersistente(os.path.join(diretorio, 'vocabulario.txt'))
+        self._caminho_manifesto = os.path.join(diretorio, 'manifesto.jsonl')
+        
+        # Índices do manifesto: domínio -> (datas ordenadas, hashes); execução -> {domínio: hash}
+        self._por_dominio = defaultdict(lambda: ([], []))
+        self._por_execucao = defaultdict(dict)
+        if os.path.exists(self._caminho_manifesto):
+            with open(self._caminho_manifesto, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    try:
+                        registro = json.loads(linha)
+                    except ValueError:
+                        continue  # última linha truncada por interrupção
+                    self._indexar(registro)
+        
+        self._manifesto = open(self._caminho_manifesto, 'a', encoding='utf-8')
+        self._cache_ids = {}
+    
+    def _indexar(self, registro: Dict):
+        datas, hashes = self._por_dominio[registro['domain']]
+        pos = bisect.bisect_right(datas, registro['coletado_em'])
+        datas.insert(pos, registro['coletado_em'])
+        hashes.insert(pos, registro['hash'])
+        if registro.get('execucao'):
+            self._por_execucao[registro['execucao']][registro['domain']] = registro['hash']
+    
+    def _caminho(self, tipo: str, hash_conteudo: str, sufixo: str) -> str:
+        return os.path.join(self.diretorio, tipo, hash_conteudo[:2], f"{hash_conteudo}.{sufixo}")
+    
+    def _gravar(self, caminho: str, escrever):
+        if os.path.exists(caminho):
+            return
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = caminho + '.tmp'
+        with open(temporario, 'wb') as f:
+            escrever(f)
+        os.replace(temporario, caminho)
+    
+    def registrar(self, domain: str, sellers: Dict[str, List[str]] = None, corpo: bytes = None,
+                  execucao: str = None, coletado_em: str = None, erro: str = None) -> str:
+        """
+        Registra uma coleta no manifesto; coletas com falha ficam com hash None.
+        
+        Retorna o hash do conteúdo. Corpo e sellers só são gravados se o
+        hash ainda não existir no repositório.
+        """
+        coletado_em = coletado_em or datetime.now().isoformat(timespec='seconds')
+        hash_conteudo = None
+        
+        if sellers is not None:
+            if corpo is not None:
+                hash_conteudo = hashlib.sha256(corpo).hexdigest()
+                self._gravar(self._caminho('corpos', hash_conteudo, 'txt.gz'),
+                             lambda f: f.write(gzip.compress(corpo)))
+            else:
+                canonico = json.dumps({t: sellers.get(t, []) for t in TIPOS_RELACAO}, ensure_ascii=False)
+                hash_conteudo = hashlib.sha256(b'sellers:' + canonico.encode('utf-8')).hexdigest()
+            
+            caminho_sellers = self._caminho('sellers', hash_conteudo, 'npz')
+            if not os.path.exists(caminho_sellers):
+                ids = {t: self.vocabulario.codificar_lista(sellers.get(t, [])) for t in TIPOS_RELACAO}
+                self.vocabulario.salvar()
+                self._gravar(caminho_sellers, lambda f: np.savez_compressed(f, **ids))
+        
+        registro = {'domain': domain, 'coletado_em': coletado_em, 'execucao': execucao,
+                    'hash': hash_conteudo, 'corpo': corpo is not None}
+        if erro:
+            registro['erro'] = erro
+        self._manifesto.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        self._manifesto.flush()
+        self._indexar(registro)
+        return hash_conteudo
+    
+    def fechar(self):
+        self.vocabulario.salvar()
+        self._manifesto.close()
+    
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    
+    def execucoes(self) -> List[str]:
+        return sorted(self._por_execucao)
+    
+    def hashes_da_execucao(self, execucao: str) -> Dict[str, str]:
+        """Domínio -> hash de cada coleta registrada na execução"""
+        return dict(self._por_execucao.get(execucao, {}))
+    
+    def hash_em(self, domain: str, data, ignorar_falhas: bool = False) -> str:
+        """
+        Hash da última coleta do domínio até a data (None se não houver ou se falhou).
+        
+        Com ignorar_falhas, coletas com falha são puladas: vale a última
+        bem-sucedida até a data.
+        """
+        datas, hashes = self._por_dominio.get(domain, ([], []))
+        pos = bisect.bisect_right(datas, _limite_data(data))
+        if ignorar_falhas:
+            while pos and hashes[pos - 1] is None:
+                pos -= 1
+        return hashes[pos - 1] if pos else None
+    
+    def ids(self, hash_conteudo: str) -> Dict[str, np.ndarray]:
+        """Arrays de ids (com repetições, na ordem do arquivo) de um conteúdo"""
+        if hash_conteudo not in self._cache_ids:
+            with np.load(self._caminho('sellers', hash_conteudo, 'npz')) as arquivo:
+                self._cache_ids[hash_conteudo] = {t: arquivo[t] for t in TIPOS_RELACAO}
+        return self._cache_ids[hash_conteudo]
+    
+    def corpo(self, hash_conteudo: str) -> bytes:
+        """Corpo bruto de um conteúdo (None se só o parse foi guardado)"""
+        caminho = self._caminho('corpos', hash_conteudo, 'txt.gz')
+        if not os.path.exists(caminho):
+            return None
+        with open(caminho, 'rb') as f:
+            return gzip.decompress(f.read())
+    
+    def sellers_em(self, domain: str, data) -> Dict[str, List[str]]:
+        """Sellers do site na data (última coleta bem-sucedida até ela), ou None"""
+        hash_conteudo = self.hash_em(domain, data, ignorar_falhas=True)
+        if hash_conteudo is None:
+            return None
+        return {t: self.vocabulario.decodificar(ids.tolist()) for t, ids in self.ids(hash_conteudo).items()}
+    
+    def _diferenca_hashes(self, hash_a: str, hash_b: str) -> Dict[str, Dict[str, List[str]]]:
+        vazio = {t: np.zeros(0, dtype=np.int32) for t in TIPOS_RELACAO}
+        ids_a = self.ids(hash_a) if hash_a else vazio
+        ids_b = self.ids(hash_b) if hash_b else vazio
+        diferenca = {}
+        for tipo in TIPOS_RELACAO:
+            a, b = np.unique(ids_a[tipo]), np.unique(ids_b[tipo])
+            diferenca[tipo] = {
+                'adicionados': self.vocabulario.decodificar(np.setdiff1d(b, a, assume_unique=True).tolist()),
+                'removidos': self.vocabulario.decodificar(np.setdiff1d(a, b, assume_unique=True).tolist())
+            }
+        return diferenca
+    
+    def diferenca(self, execucao_a: str, execucao_b: str) -> Dict:
+        """
+        Sellers adicionados/removidos por domínio entre duas execuções.
+        
+        Domínios com o mesmo hash nas duas são pulados sem abrir nada; os
+        demais comparam arrays de ids (conjuntos distintos, por tipo). Uma
+        coleta com falha (hash None) não é um ads.txt vazio: esses domínios
+        vão para 'falhas', sem diferença calculada.
+        """
+        hashes_a = self._por_execucao.get(execucao_a, {})
+        hashes_b = self._por_execucao.get(execucao_b, {})
+        
+        alterados = {}
+        falhas = []
+        iguais = 0
+        for domain in list(hashes_a) + [d for d in hashes_b if d not in hashes_a]:
+            if domain not in hashes_a or domain not in hashes_b:
+                continue
+            hash_a, hash_b = hashes_a[domain], hashes_b[domain]
+            if hash_a is None or hash_b is None:
+                falhas.append(domain)
+                continue
+            if hash_a == hash_b:
+                iguais += 1
+                continue
+            alterados[domain] = self._diferenca_hashes(hash_a, hash_b)
+        
+        return {
+            'execucoes': [execucao_a, execucao_b],
+            'iguais': iguais,
+            'alterados': alterados,
+            'falhas': falhas,
+            'so_em_a': [d for d in hashes_a if d not in hashes_b],
+            'so_em_b': [d for d in hashes_b if d not in hashes_a]
+        }
+    
+    def diferenca_datas(self, domain: str, data_a, data_b) -> Dict[str, Dict[str, List[str]]]:
+        """Sellers adicionados/removidos em um site entre duas datas (última coleta bem-sucedida até cada uma)"""
+        return self._diferenca_hashes(self.hash_em(domain, data_a, ignorar_falhas=True),
+                                      self.hash_em(domain, data_b, ignorar_falhas=True))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.fechar()
+
+# ============================================================================
+# EXECUÇÃO
+# ============================================================================
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Consulta o histórico de ads.txt")
+    parser.add_argument('--diretorio', default='historico_adstxt')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    sub.add_parser('execucoes', help="lista as execuções registradas")
+    p_sellers = sub.add_parser('sellers', help="sellers de um domínio em uma data")
+    p_sellers.add_argument('domain')
+    p_sellers.add_argument('data', help="YYYY-MM-DD ou YYYY-MM-DDTHH:MM:SS")
+    p_diff = sub.add_parser('diff', help="diferenças entre duas execuções")
+    p_diff.add_argument('execucao_a')
+    p_diff.add_argument('execucao_b')
+    args = parser.parse_args()
+    
+    with RepositorioSnapshots(args.diretorio) as repositorio:
+        if args.comando == 'execucoes':
+            for execucao in repositorio.execucoes():
+                print(f"{execucao}  ({len(repositorio.hashes_da_execucao(execucao))} domínios)")
+        elif args.comando == 'sellers':
+            sellers = repositorio.sellers_em(args.domain, args.data)
+            if sellers is None:
+                print(f"✗ Nenhuma coleta bem-sucedida de {args.domain} até {args.data}")
+            else:
+                print(json.dumps(sellers, indent=2, ensure_ascii=False))
+        else:
+            print(json.dumps(repositorio.diferenca(args.execucao_a, args.execucao_b), indent=2, ensure_ascii=False))
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from analise_completa_darkpools import (construir_incidencia, identificar_dark_pools,
+                                        identificar_dark_pools_vetorizado)
+
+
+def site(domain, cat, direct, reseller=(), sucesso=True):
+    return {'domain': domain, 'cat': cat, 'sucesso': sucesso,
+            'sellers': {'DIRECT': list(direct), 'RESELLER': list(reseller)}}
+
+
+SITES_DATA = {
+    'A': site('a.com', 'FC', ['x#1', 'y#1', 'g#1', 'y#1']),
+    'B': site('b.com', 'MS', ['x#1', 'z#1', 'g#1']),
+    'C': site('c.com', 'MS', ['y#1', 'z#1', 'w#1'], ['x#1']),
+    'D': site('d.com', 'HP', ['w#1'], sucesso=False),
+    'E': site('e.com', 'HP', ['w#1', 'solo#1']),
+}
+
+GRUPOS = {'grupo_ab': {'a.com', 'b.com'}}
+
+
+def normalizar(pools):
+    return [(seller, pool['sites'], pool['n_sites'], sorted(pool['categorias']), pool['tipo'])
+            for seller, pool in pools.items()]
+
+
+def test_pools_do_exemplo():
+    pools = identificar_dark_pools(SITES_DATA, GRUPOS)
+    # x#1 e g#1 só aparecem como DIRECT em sites do mesmo grupo editorial
+    assert list(pools) == ['y#1', 'z#1', 'w#1']
+    # Repetições no mesmo ads.txt contam, como nas listas originais
+    assert pools['y#1']['sites'] == ['A', 'A', 'C']
+    assert pools['y#1']['n_sites'] == 3
+    assert pools['y#1']['tipo'] == 'misto_FC_MS'
+    assert pools['z#1']['tipo'] == 'homogeneo_MS'
+    # D falhou e não conta
+    assert pools['w#1']['sites'] == ['C', 'E']
+
+
+def test_vetorizado_igual_ao_laco_no_exemplo():
+    incidencia = construir_incidencia(SITES_DATA)
+    assert normalizar(identificar_dark_pools_vetorizado(incidencia, GRUPOS)) == \
+        normalizar(identificar_dark_pools(SITES_DATA, GRUPOS))
+
+
+@pytest.mark.parametrize('semente', range(5))
+def test_vetorizado_igual_ao_laco_aleatorio(semente):
+    rng = random.Random(semente)
+    sellers = [f"ssp{k}.com#{k}" for k in range(40)]
+    sites_data = {
+        f"s{i}": site(f"s{i}.com", rng.choice('ABC'),
+                      rng.choices(sellers, k=rng.randint(0, 12)), rng.choices(sellers, k=rng.randint(0, 5)),
+                      sucesso=rng.random() > 0.1)
+        for i in range(60)
+    }
+    grupos = {f"g{j}": {f"s{i}.com" for i in rng.sample(range(60), 4)} for j in range(5)}
+    incidencia = construir_incidencia(sites_data)
+    assert normalizar(identificar_dark_pools_vetorizado(incidencia, grupos)) == \
+        normalizar(identificar_dark_pools(sites_data, grupos))
+
+
+def test_mais_de_63_categorias():
+    # Categorias vêm do CSV: não podem colidir quando passam da largura de um bitmask
+    sites_data = {f"s{i}": site(f"s{i}.com", f"cat{i:03d}", ['comum#1', f"par{i // 2}#1"]) for i in range(80)}
+    incidencia = construir_incidencia(sites_data)
+    pools = identificar_dark_pools_vetorizado(incidencia, {})
+    assert normalizar(pools) == normalizar(identificar_dark_pools(sites_data, {}))
+    assert len(pools['comum#1']['categorias']) == 80
+    assert pools['par35#1']['tipo'] == 'misto_cat070_cat071'
@@ -0,0 +1,197 @@
+import asyncio
+import random
+import socket
+from collections import Counter
+
+import pytest
+
+import analise_completa_darkpools as analise
+from analise_completa_darkpools import EscalonadorCortesia
+
+IPS = {
+    'a.com': '10.0.0.1',
+    'b.com': '10.0.0.2',
+    'c.com': '10.0.1.1',
+    'd.com': '10.0.2.1',
+}
+
+SITES = [{'name': domain, 'domain': domain, 'cat': 'X'} for domain in IPS]
+
+OK = (True, {'DIRECT': ['x.com#1'], 'RESELLER': []}, "")
+
+
+class ResolvedorFalso:
+    """Resolve pelo dicionário de IPs, sem rede"""
+    
+    def __init__(self, ips=IPS):
+        self.ips = ips
+        self.consultas = Counter()
+    
+    async def enderecos(self, host):
+        self.consultas[host] += 1
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (self.ips[host], 0))]
+
+
+@pytest.fixture(autouse=True)
+def esperas_curtas(monkeypatch):
+    monkeypatch.setattr(analise, 'ESPERA_RETENTATIVA', 0.001)
+
+
+def executar(escalonador, tentativa, imediato=None, sites=SITES, ips=IPS):
+    resolvedor = ResolvedorFalso(ips)
+    concluidos = {}
+    
+    def ao_concluir(site, resultado):
+        assert site['domain'] not in concluidos
+        concluidos[site['domain']] = resultado
+    
+    asyncio.run(escalonador.executar(iter(sites), tentativa, ao_concluir, imediato=imediato,
+                                     resolvedor=resolvedor))
+    return concluidos, resolvedor
+
+
+def test_todos_concluidos_e_agrupados_por_prefixo():
+    chamadas = Counter()
+    
+    async def tentativa(site, n):
+        chamadas[site['domain']] += 1
+        return OK, False, None
+    
+    escalonador = EscalonadorCortesia(taxa=1000, rajada=100)
+    concluidos, resolvedor = executar(escalonador, tentativa)
+    assert concluidos == {domain: OK for domain in IPS}
+    assert chamadas == Counter(list(IPS))
+    assert resolvedor.consultas == Counter(list(IPS))
+    assert {chave: grupo.dominios for chave, grupo in escalonador.grupos.items()} == {
+        '10.0.0.0/24': 2, '10.0.1.0/24': 1, '10.0.2.0/24': 1}
+
+
+def test_falha_transitoria_repetida_ate_max_tentativas():
+    tentativas = []
+    
+    async def tentativa(site, n):
+        tentativas.append((site['domain'], n))
+        if site['domain'] == 'a.com':
+            return (False, {}, "HTTP 503"), True, None
+        return OK, False, None
+    
+    concluidos, _ = executar(EscalonadorCortesia(taxa=1000, rajada=100, max_tentativas=3), tentativa)
+    assert concluidos['a.com'] == (False, {}, "HTTP 503")
+    assert [n for domain, n in tentativas if domain == 'a.com'] == [1, 2, 3]
+    assert concluidos['b.com'] == OK
+
+
+def test_falha_permanente_nao_repetida():
+    tentativas = Counter()
+    
+    async def tentativa(site, n):
+        tentativas[site['domain']] += 1
+        return (False, {}, "HTTP 404"), False, None
+    
+    concluidos, _ = executar(EscalonadorCortesia(taxa=1000, rajada=100), tentativa)
+    assert set(concluidos) == set(IPS)
+    assert set(tentativas.values()) == {1}
+
+
+def test_excecao_na_tentativa_vira_falha():
+    async def tentativa(site, n):
+        raise RuntimeError("falhou")
+    
+    concluidos, _ = executar(EscalonadorCortesia(taxa=1000, rajada=100), tentativa)
+    assert all(resultado == (False, {}, "falhou") for resultado in concluidos.values())
+
+
+def test_imediato_dispensa_rede():
+    async def tentativa(site, n):
+        raise AssertionError("não deveria acessar a rede")
+    
+    concluidos, resolvedor = executar(EscalonadorCortesia(), tentativa, imediato=lambda site: OK)
+    assert concluidos == {domain: OK for domain in IPS}
+    assert not resolvedor.consultas
+
+
+def test_limite_de_concorrencia_por_grupo():
+    sites = [{'name': f"s{i}", 'domain': 'a.com', 'cat': 'X'} for i in range(12)]
+    em_voo = 0
+    pico = 0
+    
+    async def tentativa(site, n):
+        nonlocal em_voo, pico
+        em_voo += 1
+        pico = max(pico, em_voo)
+        await asyncio.sleep(0.005)
+        em_voo -= 1
+        return OK, False, None
+    
+    escalonador = EscalonadorCortesia(taxa=1000, rajada=100, concorrencia_inicial=2, concorrencia_maxima=3)
+    concluidos = []
+    asyncio.run(escalonador.executar(sites, tentativa, lambda site, resultado: concluidos.append(site['name']),
+                                     resolvedor=ResolvedorFalso()))
+    assert sorted(concluidos) == sorted(site['name'] for site in sites)
+    assert pico <= 3
+
+
+def test_taxa_do_grupo_espacada_pela_agenda():
+    sites = [{'name': f"s{i}", 'domain': 'a.com', 'cat': 'X'} for i in range(5)]
+    instantes = []
+    
+    async def tentativa(site, n):
+        instantes.append(asyncio.get_running_loop().time())
+        return OK, False, None
+    
+    escalonador = EscalonadorCortesia(taxa=50, rajada=1, concorrencia_inicial=5)
+    asyncio.run(escalonador.executar(sites, tentativa, lambda site, resultado: None,
+                                     resolvedor=ResolvedorFalso()))
+    intervalos = [b - a for a, b in zip(instantes, instantes[1:])]
+    assert len(instantes) == 5
+    assert min(intervalos) >= 0.015
+
+
+def test_429_pausa_o_grupo():
+    sites = [{'name': f"s{i}", 'domain': 'a.com', 'cat': 'X'} for i in range(3)]
+    instantes = {}
+    
+    async def tentativa(site, n):
+        instantes.setdefault(site['name'], []).append(asyncio.get_running_loop().time())
+        if site['name'] == 's0' and n == 1:
+            return (False, {}, "HTTP 429"), True, 0.1
+        return OK, False, None
+    
+    escalonador = EscalonadorCortesia(taxa=1000, rajada=100, concorrencia_inicial=1)
+    asyncio.run(escalonador.executar(sites, tentativa, lambda site, resultado: None,
+                                     resolvedor=ResolvedorFalso()))
+    primeira = instantes['s0'][0]
+    assert instantes['s0'][1] - primeira >= 0.09
+    assert min(instantes['s1'][0], instantes['s2'][0]) - primeira >= 0.09
+    assert escalonador.grupos['10.0.0.0/24'].http_429 == 1
+
+
+def test_despacho_nao_percorre_todos_os_grupos(monkeypatch):
+    # Grupos limitados a uma tentativa por vez: cada conclusão deve tocar só o próprio grupo,
+    # e não varrer todos os grupos ativos (grupos × conclusões)
+    n_grupos, por_grupo = 500, 3
+    ips = {f"d{i}.com": f"10.{i // 256}.{i % 256}.1" for i in range(n_grupos)}
+    consultas = Counter()
+    espera_original = analise.GrupoHospedagem.espera
+    
+    def espera(grupo, agora):
+        consultas['espera'] += 1
+        return espera_original(grupo, agora)
+    
+    monkeypatch.setattr(analise.GrupoHospedagem, 'espera', espera)
+    
+    async def tentativa(site, n):
+        # Conclusões espalhadas no tempo, como latências reais: um despertar por conclusão
+        await asyncio.sleep(atrasos[site['name']])
+        return OK, False, None
+    
+    sites = [{'name': f"{domain}/{k}", 'domain': domain, 'cat': 'X'} for k in range(por_grupo) for domain in ips]
+    rng = random.Random(0)
+    atrasos = {site['name']: rng.uniform(0, 0.2) for site in sites}
+    escalonador = EscalonadorCortesia(max_concorrencia=10000, taxa=1e6, rajada=10,
+                                      concorrencia_inicial=1, concorrencia_maxima=1)
+    concluidos = []
+    asyncio.run(escalonador.executar(sites, tentativa, lambda site, resultado: concluidos.append(site['name']),
+                                     resolvedor=ResolvedorFalso(ips)))
+    assert len(concluidos) == len(sites)
+    assert consultas['espera'] <= 10 * len(sites)
@@ -0,0 +1,119 @@
+import copy
+import random
+
+import pytest
+
+from analise_completa_darkpools import (atualizar_incremental, calcular_metricas_site, carregar_snapshot,
+                                        construir_incidencia, identificar_dark_pools, impressao_grupos,
+                                        motivo_analise_completa, salvar_resultados_colunares)
+
+SELLERS = [f"ssp{k}.com#{k}" for k in range(60)]
+
+
+def site(domain, cat, direct, sucesso=True):
+    if not sucesso:
+        return {'domain': domain, 'cat': cat, 'sucesso': False, 'erro': 'Timeout'}
+    return {'domain': domain, 'cat': cat, 'sucesso': True, 'sellers': {'DIRECT': direct, 'RESELLER': []},
+            'n_direct_raw': len(direct), 'n_reseller_raw': 0}
+
+
+def sites_aleatorios(rng, n):
+    return {f"s{i}": site(f"s{i}.com", rng.choice(['FC', 'HP', 'MS']), rng.choices(SELLERS, k=rng.randint(0, 10)),
+                          sucesso=rng.random() > 0.1)
+            for i in range(n)}
+
+
+def recoleta(rng, anteriores, rodada):
+    """Nova coleta: listas alteradas, sites removidos, novos, falhas e mudança de categoria (ordem relativa mantida)"""
+    novos = {}
+    for k, (nome, data) in enumerate(anteriores.items()):
+        sorteio = rng.random()
+        if sorteio < 0.05:
+            continue
+        data = {k: copy.deepcopy(v) for k, v in data.items() if k != 'metricas'}
+        if sorteio < 0.15:
+            data = site(data['domain'], data['cat'], rng.choices(SELLERS, k=rng.randint(0, 10)))
+        elif sorteio < 0.2 and data['sucesso']:
+            direct = data['sellers']['DIRECT']
+            rng.shuffle(direct)
+            direct.insert(0, rng.choice(SELLERS))
+        elif sorteio < 0.23:
+            data = site(data['domain'], data['cat'], [], sucesso=False)
+        elif sorteio < 0.25:
+            data['cat'] = 'FC' if data['cat'] != 'FC' else 'MS'
+        novos[nome] = data
+        if rng.random() < 0.05:
+            nome_novo = f"novo{rodada}_{k}"
+            novos[nome_novo] = site(f"{nome_novo}.com", 'HP', rng.choices(SELLERS, k=rng.randint(1, 10)))
+    return novos
+
+
+def analise_completa(sites_data, grupos):
+    incidencia = construir_incidencia(sites_data)
+    pools = identificar_dark_pools(sites_data, grupos, incidencia)
+    for data in sites_data.values():
+        if data['sucesso']:
+            data['metricas'] = calcular_metricas_site(data['sellers'], set(pools))
+    return incidencia, pools
+
+
+def gravar(caminho, sites_data, incidencia, pools, grupos):
+    salvar_resultados_colunares(caminho, sites_data, incidencia, pools, {
+        'metadata': {'grupos_editoriais': impressao_grupos(grupos)},
+        'composicao': {}, 'estatisticas': {}, 'testes': {}, 'testes_reamostragem': {}
+    })
+
+
+def comparavel(pools):
+    return [(seller, pool['sites'], pool['n_sites'], sorted(pool['categorias']), pool['tipo'])
+            for seller, pool in pools.items()]
+
+
+@pytest.mark.parametrize('semente', range(8))
+def test_incremental_igual_a_analise_completa(tmp_path, semente):
+    rng = random.Random(semente)
+    grupos = {'g': {f"s{i}.com" for i in range(5)}}
+    atual = sites_aleatorios(rng, 80)
+    incidencia, pools = analise_completa(atual, grupos)
+    caminho = str(tmp_path / 'snapshot.npz')
+    gravar(caminho, atual, incidencia, pools, grupos)
+    
+    # Três recoletas seguidas, cada uma a partir do snapshot gravado pela anterior
+    for rodada in range(3):
+        novos = recoleta(rng, atual, rodada)
+        esperado_sites = copy.deepcopy(novos)
+        _, esperado = analise_completa(esperado_sites, grupos)
+        
+        anterior = carregar_snapshot(caminho)
+        assert anterior['indice'] is not None and 'sellers' not in next(iter(anterior['sites'].values()))
+        assert motivo_analise_completa(anterior, novos, grupos) == ""
+        pools, _ = atualizar_incremental(anterior, novos, grupos)
+        
+        assert comparavel(pools) == comparavel(esperado)
+        for nome, data in novos.items():
+            if data['sucesso']:
+                assert data['metricas'] == esperado_sites[nome]['metricas'], nome
+        
+        gravar(caminho, novos, construir_incidencia(novos), pools, grupos)
+        atual = novos
+
+
+def test_grupos_diferentes_exigem_analise_completa(tmp_path):
+    rng = random.Random(0)
+    sites_data = sites_aleatorios(rng, 20)
+    incidencia, pools = analise_completa(sites_data, {})
+    caminho = str(tmp_path / 'snapshot.npz')
+    gravar(caminho, sites_data, incidencia, pools, {})
+    anterior = carregar_snapshot(caminho)
+    assert motivo_analise_completa(anterior, sites_data, {}) == ""
+    assert "grupos editoriais" in motivo_analise_completa(anterior, sites_data, {'g': {'s0.com', 's1.com'}})
+
+
+def test_ordem_dos_sites_trocada_exige_analise_completa(tmp_path):
+    rng = random.Random(1)
+    sites_data = sites_aleatorios(rng, 20)
+    incidencia, pools = analise_completa(sites_data, {})
+    caminho = str(tmp_path / 'snapshot.npz')
+    gravar(caminho, sites_data, incidencia, pools, {})
+    invertidos = dict(reversed(list(sites_data.items())))
+    assert "ordem" in motivo_analise_completa(carregar_snapshot(caminho), invertidos, {})
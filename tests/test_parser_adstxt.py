@@ -0,0 +1,90 @@
+import pytest
+
+from analise_completa_darkpools import (ParserAdsTxt, parsear_adstxt, parsear_corpo,
+                                        verificar_cabecalhos)
+
+LINHAS = [
+    "# ads.txt de exemplo",
+    "google.com, pub-123, DIRECT, f08c47fec0942fa0",
+    "www.AppNexus.com, 456, reseller  # comentário no fim",
+    "rubiconproject.com, 789, DIRECT",
+    "linha inválida sem vírgulas",
+    "openx.com, 1, INDIRETO",
+    "contact=adops@exemplo.com",
+    "subdomain=Sub.Exemplo.com",
+    "OWNERDOMAIN=exemplo.com",
+    "MANAGERDOMAIN=gerente.com, BR",
+    "inventorypartnerdomain=parceiro.com",
+]
+
+ESPERADO = {
+    'DIRECT': ['google.com#pub-123', 'rubiconproject.com#789'],
+    'RESELLER': ['appnexus.com#456'],
+    'referencias': ['subdomain=sub.exemplo.com', 'ownerdomain=exemplo.com',
+                    'managerdomain=gerente.com', 'inventorypartnerdomain=parceiro.com'],
+}
+
+
+def test_parsear_adstxt():
+    assert parsear_adstxt(LINHAS) == ESPERADO
+
+
+def test_managerdomain_com_pais():
+    sellers = parsear_adstxt(["MANAGERDOMAIN=gerente.com, BR"])
+    assert sellers['referencias'] == ['managerdomain=gerente.com']
+    assert sellers['DIRECT'] == sellers['RESELLER'] == []
+
+
+@pytest.mark.parametrize('tamanho_bloco', [1, 7, 64, 1 << 16])
+def test_parser_em_blocos_igual_ao_de_linhas(tamanho_bloco):
+    corpo = ("\ufeff" + "\r\n".join(LINHAS)).encode('utf-8')
+    parser = ParserAdsTxt()
+    for inicio in range(0, len(corpo), tamanho_bloco):
+        assert parser.alimentar(corpo[inicio:inicio + tamanho_bloco])
+    assert parser.finalizar() == ESPERADO
+
+
+def test_parser_rejeita_html():
+    parser = ParserAdsTxt()
+    assert not parser.alimentar(b"\n  <!DOCTYPE html><html>")
+    assert parser.erro == "HTML em vez de ads.txt"
+
+
+def test_parser_rejeita_corpo_grande():
+    sellers, erro = parsear_corpo(b"a.com, 1, DIRECT\n" * 100, max_bytes=1000)
+    assert sellers == {}
+    assert erro == "ads.txt excede 1000 bytes"
+
+
+def test_parser_guarda_corpo():
+    parser = ParserAdsTxt(guardar_corpo=True)
+    parser.alimentar(b"a.com, 1, DIRECT\n")
+    parser.alimentar(b"b.com, 2, RESELLER")
+    assert parser.corpo == b"a.com, 1, DIRECT\nb.com, 2, RESELLER"
+    assert parser.finalizar()['RESELLER'] == ['b.com#2']
+
+
+@pytest.mark.parametrize('headers, erro', [
+    ({'Content-Type': 'text/plain; charset=utf-8'}, ""),
+    ({}, ""),
+    ({'Content-Type': 'text/html; charset=UTF-8'}, ""),
+    ({'Content-Type': 'image/png'}, "Content-Type image/png"),
+    ({'Content-Length': str(10 ** 9)}, "ads.txt excede"),
+])
+def test_verificar_cabecalhos(headers, erro):
+    resultado = verificar_cabecalhos(headers)
+    assert resultado.startswith(erro) if erro else resultado == ""
+
+
+def test_text_html_com_corpo_de_ads_txt():
+    # Tipo errado, corpo válido: os cabeçalhos passam e o parser lê o arquivo
+    assert verificar_cabecalhos({'Content-Type': 'text/html'}) == ""
+    sellers, erro = parsear_corpo("\r\n".join(LINHAS).encode('utf-8'))
+    assert erro == ""
+    assert sellers == ESPERADO
+
+
+@pytest.mark.parametrize('corpo', [b"<!DOCTYPE html>\n<html>", b"\xef\xbb\xbf  <html lang='pt'>", b"\n<head>"])
+def test_text_html_com_pagina_html(corpo):
+    assert verificar_cabecalhos({'Content-Type': 'text/html'}) == ""
+    assert parsear_corpo(corpo) == ({}, "HTML em vez de ads.txt")
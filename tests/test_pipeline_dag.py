@@ -0,0 +1,45 @@
+from analise_completa_darkpools import CheckpointColeta, construir_incidencia, identificar_dark_pools
+from pipeline_dag import _etapa_coleta, _etapa_composicao, declarar_etapas, hash_valor
+
+
+def registro(n):
+    return {'domain': f"s{n}.com", 'cat': 'FC', 'sucesso': True, 'sellers': {'DIRECT': [], 'RESELLER': []}}
+
+
+def test_coleta_offline_filtra_e_ordena_pela_lista(tmp_path):
+    caminho = str(tmp_path / 'checkpoint.jsonl')
+    checkpoint = CheckpointColeta(caminho, retomar=True)
+    for n in (3, 1, 9, 2):
+        checkpoint.registrar(f"s{n}", registro(n))
+    checkpoint.fechar()
+    
+    sites = [{'name': f"s{n}", 'domain': f"s{n}.com", 'cat': 'FC'} for n in (1, 2, 3, 4)]
+    coleta = _etapa_coleta({}, {'offline': True}, {'checkpoint': caminho, 'sites': sites})
+    # s9 saiu da lista; s4 não está no checkpoint
+    assert list(coleta) == ['s1', 's2', 's3']
+
+
+def test_lista_de_sites_entra_na_chave_offline(tmp_path):
+    caminho = str(tmp_path / 'checkpoint.jsonl')
+    open(caminho, 'w').close()
+    sites = [{'name': f"s{n}", 'domain': f"s{n}.com", 'cat': 'FC'} for n in (1, 2)]
+    
+    def parametros(sites):
+        return declarar_etapas(offline=True, checkpoint=caminho, sites=sites)['coleta'].parametros
+    
+    assert hash_valor(parametros(sites)) != hash_valor(parametros(sites[::-1]))
+
+
+def test_modelo_nulo_nao_depende_dos_processos():
+    # nº de processos é contexto (fora da chave): o resultado em cache tem que valer para qualquer --processos
+    sites_data = {f"s{i}": dict(registro(i), cat='FC' if i % 2 else 'MS',
+                                sellers={'DIRECT': [f"x{i % 3}#1", f"y{i % 4}#1"], 'RESELLER': []})
+                  for i in range(12)}
+    incidencia = construir_incidencia(sites_data)
+    entradas = {'incidencia': incidencia, 'pools': identificar_dark_pools(sites_data, {}, incidencia)}
+    parametros = declarar_etapas(grupos_editoriais={}, n_aleatorizacoes=20)['composicao'].parametros
+    
+    def modelo_nulo(n_processos):
+        return _etapa_composicao(entradas, parametros, {'n_processos': n_processos})['modelo_nulo']
+    
+    assert repr(modelo_nulo(1)) == repr(modelo_nulo(2))
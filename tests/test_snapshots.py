@@ -0,0 +1,38 @@
+import pytest
+
+from snapshots_adstxt import RepositorioSnapshots
+
+ANTES = {'DIRECT': ['a.com#1', 'b.com#2'], 'RESELLER': []}
+DEPOIS = {'DIRECT': ['a.com#1', 'c.com#3'], 'RESELLER': []}
+
+
+@pytest.fixture
+def repositorio(tmp_path):
+    with RepositorioSnapshots(str(tmp_path / 'historico')) as repositorio:
+        yield repositorio
+
+
+def test_diferenca_datas_pula_coleta_com_falha(repositorio):
+    repositorio.registrar('x.com', ANTES, execucao='e1', coletado_em='2024-01-01T00:00:00')
+    repositorio.registrar('x.com', None, execucao='e2', coletado_em='2024-02-01T00:00:00', erro="Timeout")
+    repositorio.registrar('x.com', DEPOIS, execucao='e3', coletado_em='2024-03-01T00:00:00')
+    
+    # A falha de fevereiro não vira "todos os sellers removidos"
+    diferenca = repositorio.diferenca_datas('x.com', '2024-01-15', '2024-02-15')
+    assert diferenca['DIRECT'] == {'adicionados': [], 'removidos': []}
+    diferenca = repositorio.diferenca_datas('x.com', '2024-02-15', '2024-03-15')
+    assert diferenca['DIRECT'] == {'adicionados': ['c.com#3'], 'removidos': ['b.com#2']}
+
+
+def test_diferenca_separa_falhas(repositorio):
+    for domain in ('ok.com', 'falhou_antes.com', 'falhou_depois.com'):
+        repositorio.registrar(domain, ANTES if domain != 'falhou_antes.com' else None, execucao='e1',
+                              erro=None if domain != 'falhou_antes.com' else "HTTP 503")
+    repositorio.registrar('ok.com', DEPOIS, execucao='e2')
+    repositorio.registrar('falhou_antes.com', DEPOIS, execucao='e2')
+    repositorio.registrar('falhou_depois.com', None, execucao='e2', erro="Timeout")
+    
+    diferenca = repositorio.diferenca('e1', 'e2')
+    assert list(diferenca['alterados']) == ['ok.com']
+    assert diferenca['falhas'] == ['falhou_antes.com', 'falhou_depois.com']
+    assert diferenca['iguais'] == 0
@@ -0,0 +1,39 @@
+from analise_completa_darkpools import _escolher_variante, variantes_adstxt
+
+URLS = variantes_adstxt('exemplo.com')
+
+VALIDO = ((True, {'DIRECT': ['a.com#1'], 'RESELLER': []}, ""), False)
+VAZIO = ((True, {'DIRECT': [], 'RESELLER': []}, ""), False)
+FALHA_DNS = ((False, {}, "Erro de conexão"), False)
+TIMEOUT = ((False, {}, "Timeout"), True)
+
+
+def test_urls_em_ordem_de_preferencia():
+    assert URLS[0] == 'https://exemplo.com/ads.txt'
+    assert len(set(URLS)) == len(URLS)
+
+
+def test_valida_vence_preferida_vazia():
+    concluidas = {URLS[0]: VAZIO, URLS[-1]: VALIDO}
+    assert _escolher_variante(URLS, concluidas) == URLS[-1]
+
+
+def test_entre_validas_vale_a_ordem_de_urls():
+    concluidas = {URLS[1]: VALIDO, URLS[0]: VALIDO}
+    assert _escolher_variante(URLS, concluidas) == URLS[0]
+
+
+def test_sucesso_vazio_vence_falha():
+    concluidas = {URLS[0]: TIMEOUT, URLS[1]: VAZIO}
+    assert _escolher_variante(URLS, concluidas) == URLS[1]
+
+
+def test_todas_falham_fica_a_preferida():
+    # A falha da preferida decide a retentativa, mesmo que outra seja transitória
+    concluidas = {URLS[1]: TIMEOUT, URLS[0]: FALHA_DNS}
+    assert _escolher_variante(URLS, concluidas) == URLS[0]
+
+
+def test_so_considera_variantes_concluidas():
+    concluidas = {URLS[2]: FALHA_DNS}
+    assert _escolher_variante(URLS, concluidas) == URLS[2]